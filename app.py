@@ -1,5 +1,7 @@
 import streamlit as st
 import random
+import bisect
+from collections import Counter
 import pandas as pd
 import io
 from datetime import datetime
@@ -74,8 +76,57 @@ def predict_disease(image, disease_name=None):
 def predict_multiple(image):
     return {d: round(random.uniform(0.5, 1.0), 2) for d in diseases}
 
+# -------------------- Patient Search Index --------------------
+# Sorted (token, row) pairs over patient names and IDs, maintained on save,
+# so a prefix search is a binary search instead of a scan of every patient.
+if "patient_index" not in st.session_state:
+    st.session_state["patient_index"] = []
+
+def index_tokens(*values):
+    return {token for value in values for token in str(value).lower().split()}
+
+def index_patient(row, name, patient_id):
+    for token in index_tokens(name, patient_id):
+        bisect.insort(st.session_state.patient_index, (token, row))
+
+def search_patients(query):
+    """Rows whose name or ID has a word starting with every query term"""
+    index = st.session_state.patient_index
+    matches = None
+    for term in index_tokens(query):
+        rows = set()
+        i = bisect.bisect_left(index, (term, -1))
+        while i < len(index) and index[i][0].startswith(term):
+            rows.add(index[i][1])
+            i += 1
+        matches = rows if matches is None else matches & rows
+    return sorted(matches or [])
+
+# -------------------- Aggregate Store --------------------
+# Dashboard counters updated as patients are saved, so unfiltered charts
+# never rebuild a DataFrame from every patient.
+AGE_BUCKET = 5
+
+if "aggregates" not in st.session_state:
+    st.session_state["aggregates"] = {"Disease": Counter(), "Gender": Counter(), "Age": Counter()}
+
+def age_bucket(age):
+    return int(age) // AGE_BUCKET * AGE_BUCKET
+
+def update_aggregates(age, gender, disease):
+    aggregates = st.session_state.aggregates
+    aggregates["Disease"][disease] += 1
+    aggregates["Gender"][gender] += 1
+    aggregates["Age"][age_bucket(age)] += 1
+
+def counts_series(counter, sort_index=False):
+    series = pd.Series(dict(counter), dtype="int64")
+    return series.sort_index() if sort_index else series.sort_values(ascending=False)
+
 # -------------------- Utility: Save Patient --------------------
 def save_patient_info(name, age, gender, patient_id, disease, confidence):
+    index_patient(len(st.session_state.patients), name, patient_id)
+    update_aggregates(age, gender, disease)
     st.session_state.patients.append({
         "Name": name,
         "Age": age,
@@ -236,14 +287,15 @@ for i, tab_container in enumerate(tabs):
         elif tab_name == "Patient History":
             st.subheader("All Patients History")
             if st.session_state.patients:
-                df = pd.DataFrame(st.session_state.patients)
-
                 # Search & filter
-                search = st.text_input("Search Patient by Name or ID")
+                search = st.text_input("Search Patient by Name or ID", help="Prefix match on each word")
                 min_conf = st.slider("Filter by Minimum Confidence", 0.0, 1.0, 0.5)
-                df_filtered = df[df["Confidence"] >= min_conf]
                 if search:
-                    df_filtered = df_filtered[df_filtered["Name"].str.contains(search, case=False) | df_filtered["Patient ID"].str.contains(search, case=False)]
+                    df = pd.DataFrame([st.session_state.patients[i] for i in search_patients(search)],
+                                      columns=list(st.session_state.patients[0]))
+                else:
+                    df = pd.DataFrame(st.session_state.patients)
+                df_filtered = df[df["Confidence"] >= min_conf]
 
                 st.dataframe(df_filtered)
 
@@ -258,27 +310,37 @@ for i, tab_container in enumerate(tabs):
         elif tab_name == "Analytics Dashboard":
             st.subheader("Patient Analytics")
             if st.session_state.patients:
-                df = pd.DataFrame(st.session_state.patients)
+                aggregates = st.session_state.aggregates
 
                 # Disease filter
-                selected_diseases = st.multiselect("Filter by Disease", df["Disease"].unique())
+                selected_diseases = st.multiselect("Filter by Disease", sorted(aggregates["Disease"]))
                 if selected_diseases:
+                    # Filtered views scan the matching rows
+                    df = pd.DataFrame(st.session_state.patients)
                     df = df[df["Disease"].isin(selected_diseases)]
+                    disease_counts = df["Disease"].value_counts()
+                    gender_counts = df["Gender"].value_counts()
+                    age_counts = df["Age"].map(age_bucket).value_counts().sort_index()
+                else:
+                    disease_counts = counts_series(aggregates["Disease"])
+                    gender_counts = counts_series(aggregates["Gender"])
+                    age_counts = counts_series(aggregates["Age"], sort_index=True)
 
                 st.markdown("### Disease Distribution")
-                fig1 = px.bar(df["Disease"].value_counts(), title="Disease Counts")
+                fig1 = px.bar(disease_counts, title="Disease Counts")
                 st.plotly_chart(fig1, use_container_width=True)
 
                 st.markdown("### Age Distribution")
-                fig2 = px.histogram(df, x="Age", nbins=20, title="Age Histogram")
+                fig2 = px.bar(x=[f"{a}-{a + AGE_BUCKET - 1}" for a in age_counts.index], y=age_counts.values,
+                              labels={'x': 'Age', 'y': 'Patients'}, title="Age Histogram")
                 st.plotly_chart(fig2, use_container_width=True)
 
                 st.markdown("### Gender Distribution")
-                fig3 = px.bar(df["Gender"].value_counts(), title="Gender Counts")
+                fig3 = px.bar(gender_counts, title="Gender Counts")
                 st.plotly_chart(fig3, use_container_width=True)
 
                 st.markdown("### Disease Pie Chart")
-                fig4 = px.pie(df, names="Disease", title="Disease Breakdown")
+                fig4 = px.pie(names=disease_counts.index, values=disease_counts.values, title="Disease Breakdown")
                 st.plotly_chart(fig4, use_container_width=True)
             else:
                 st.info("No patient data to show analytics.")
@@ -76,7 +76,10 @@ def evaluate(model, df):
     X = X.reshape(len(X), -1)  # flatten for SVM/ML models
 
     y_pred = model.predict(X)
+    report(y_true, y_pred)
 
+
+def report(y_true, y_pred):
     print("\n================ Evaluation Report ================")
     print(classification_report(y_true, y_pred))
     print("\n================ Confusion Matrix ================")
@@ -87,6 +90,28 @@ def evaluate(model, df):
     pd.DataFrame(report_dict).transpose().to_csv("evaluation_report.csv", index=True)
     print("\n[INFO] Evaluation report saved as evaluation_report.csv")
 
+def load_shard_data(shards_dir):
+    """X, y from a shard directory compiled by new/dataset_shards.py (no decoding)"""
+    import sys
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "new"))
+    from dataset_shards import ShardReader
+
+    reader = ShardReader(shards_dir)
+    X = np.empty((len(reader), int(np.prod(reader.image_size)) * 3), dtype=np.float32)
+    y_true = []
+    row = 0
+    for images, labels in reader.iter_batches(256):
+        # Shards are RGB; preprocess_image works on cv2's BGR
+        X[row:row + len(images)] = images[..., ::-1].reshape(len(images), -1) / 255.0
+        y_true.extend(reader.class_names[label] for label in labels)
+        row += len(images)
+    return X, y_true
+
+
+def evaluate_shards(model, shards_dir):
+    X, y_true = load_shard_data(shards_dir)
+    report(y_true, model.predict(X))
+
 # ---------------------------------------------
 # 5. MAIN
 # ---------------------------------------------
@@ -94,11 +119,16 @@ def evaluate(model, df):
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("--model", type=str, required=True, help="Path to trained model (.pkl)")
-    parser.add_argument("--testcsv", type=str, required=True, help="CSV file with image paths & labels")
+    data = parser.add_mutually_exclusive_group(required=True)
+    data.add_argument("--testcsv", type=str, help="CSV file with image paths & labels")
+    data.add_argument("--shards", type=str, help="Compiled shard directory (new/dataset_shards.py build)")
 
     args = parser.parse_args()
 
     model = load_model(args.model)
-    df_test = load_test_data(args.testcsv)
-    evaluate(model, df_test)
+    if args.shards:
+        evaluate_shards(model, args.shards)
+    else:
+        df_test = load_test_data(args.testcsv)
+        evaluate(model, df_test)
 
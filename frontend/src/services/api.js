@@ -122,12 +122,28 @@ export const reportAPI = {
     return response.data;
   },
 
-  download: async (reportId) => {
-    const response = await api.get(`/reports/download/${reportId}`, {
-      responseType: "blob",
-    });
+  status: async (reportId) => {
+    const response = await api.get(`/reports/${reportId}`);
     return response.data;
   },
+
+  // Reports render in the background: poll until done, then fetch the PDF.
+  download: async (reportId, { intervalMs = 1000, timeoutMs = 60000 } = {}) => {
+    const deadline = Date.now() + timeoutMs;
+    for (;;) {
+      const response = await api.get(`/reports/download/${reportId}`, {
+        responseType: "blob",
+      });
+      if (response.status !== 202) {
+        return response.data;
+      }
+      if (Date.now() > deadline) {
+        throw new Error("Report generation timed out");
+      }
+      const retryAfter = Number(response.headers["retry-after"]) * 1000;
+      await new Promise((resolve) => setTimeout(resolve, retryAfter || intervalMs));
+    }
+  },
 };
 
 export const prescriptionAPI = {
@@ -135,6 +151,45 @@ export const prescriptionAPI = {
     const response = await api.post("/prescription/generate", diagnosisData);
     return response.data;
   },
+
+  // Streams server-sent events (meta, token, section, error, done) and
+  // resolves with the final validated prescription from the "done" event.
+  generateStream: async (diagnosisData, onEvent = () => {}) => {
+    const token = localStorage.getItem("token");
+    const response = await fetch(`${API_BASE_URL}/prescription/stream`, {
+      method: "POST",
+      headers: {
+        "Content-Type": "application/json",
+        ...(token ? { Authorization: `Bearer ${token}` } : {}),
+      },
+      body: JSON.stringify(diagnosisData),
+    });
+    if (!response.ok) {
+      throw new Error(`Prescription stream failed: ${response.status}`);
+    }
+
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = "";
+    let result = null;
+
+    while (true) {
+      const { value, done } = await reader.read();
+      if (done) break;
+      buffer += decoder.decode(value, { stream: true });
+
+      let boundary;
+      while ((boundary = buffer.indexOf("\n\n")) !== -1) {
+        const raw = buffer.slice(0, boundary);
+        buffer = buffer.slice(boundary + 2);
+        const event = raw.match(/^event: (.*)$/m)?.[1] || "message";
+        const data = JSON.parse(raw.match(/^data: (.*)$/m)?.[1] || "null");
+        onEvent(event, data);
+        if (event === "done") result = data;
+      }
+    }
+    return result;
+  },
 };
 
 export default api;
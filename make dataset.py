@@ -1,6 +1,9 @@
 import os
-import shutil
-import random
+import sys
+
+# Split engine shared with new/dataset_split.py
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "new"))
+from dataset_split import split_dataset
 
 # ---------------------------------------------------------
 # MAIN PATHS
@@ -18,18 +21,14 @@ IMAGE_EXTENSIONS = (
     ".tif", ".tiff", ".nii", ".nii.gz"
 )
 
-# ---------------------------------------------------------
-# CREATE OUTPUT STRUCTURE
-# ---------------------------------------------------------
-for split in ["train", "val", "test"]:
-    for mod in modalities:
-        os.makedirs(os.path.join(output_folder, split, mod), exist_ok=True)
-
 # Dataset split ratios
 train_ratio = 0.70
 val_ratio = 0.20
 test_ratio = 0.10
 
+# Group images by patient instead of content, e.g. r"^(\d+)_" for NIH-style names (None = content hash)
+patient_pattern = None
+
 # ---------------------------------------------------------
 # MODALITY DETECTION LOGIC
 # ---------------------------------------------------------
@@ -67,35 +66,6 @@ for root, dirs, files in os.walk(dataset_folder):
             else:
                 print(f"⚠ Skipped (unknown modality): {full_path}")
 
-# ---------------------------------------------------------
-# SPLIT & COPY FUNCTION
-# ---------------------------------------------------------
-def split_and_copy(images, mod):
-    """Shuffle, split, copy images into train/val/test folders."""
-    if len(images) == 0:
-        print(f"⚠ No images found for {mod.upper()} — skipping.")
-        return
-
-    random.shuffle(images)
-    total = len(images)
-
-    train_end = int(total * train_ratio)
-    val_end = train_end + int(total * val_ratio)
-
-    train_files = images[:train_end]
-    val_files = images[train_end:val_end]
-    test_files = images[val_end:]
-
-    # Copy sets
-    for src in train_files:
-        shutil.copy2(src, os.path.join(output_folder, "train", mod, os.path.basename(src)))
-
-    for src in val_files:
-        shutil.copy2(src, os.path.join(output_folder, "val", mod, os.path.basename(src)))
-
-    for src in test_files:
-        shutil.copy2(src, os.path.join(output_folder, "test", mod, os.path.basename(src)))
-
 # ---------------------------------------------------------
 # PROCESS ALL MODALITIES
 # ---------------------------------------------------------
@@ -103,11 +73,21 @@ print("\n========== DATASET SUMMARY ==========")
 
 for mod in modalities:
     print(f"{mod.upper()} images found: {len(dataset_images[mod])}")
+    if len(dataset_images[mod]) == 0:
+        print(f"⚠ No images found for {mod.upper()} — skipping.")
 
 print("\n========== STARTING SPLIT ==========\n")
 
-for mod in modalities:
-    split_and_copy(dataset_images[mod], mod)
+# Splits come from a hash of each file's content, so re-runs keep every file in the
+# same split and only place new files; files are hardlinked under data/<split>/<modality>/
+# with their path relative to the dataset folder
+files = [(mod, path, os.path.relpath(path, dataset_folder)) for mod in modalities for path in dataset_images[mod]]
+split_dataset(
+    files,
+    output_folder,
+    ratios={"train": train_ratio, "val": val_ratio, "test": test_ratio},
+    patient_pattern=patient_pattern
+)
 
 print("\n=====================================")
 print("✔ All datasets merged & categorized.")
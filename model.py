@@ -1,14 +1,29 @@
 ## model.py
 
+import os
+import json
+import glob
+import time
+import numpy as np
 from keras.models import Sequential, load_model
-from keras.layers import Conv2D, MaxPooling2D, Flatten, Dense, Dropout
+from keras.layers import Conv2D, MaxPooling2D, Flatten, Dense, Dropout, GlobalAveragePooling2D
 from keras.optimizers import Adam
+from keras.callbacks import Callback
+
+# Checkpoint every N training batches (and at every epoch end); 0 disables mid-epoch checkpoints
+CHECKPOINT_EVERY = int(os.environ.get("CHECKPOINT_EVERY", 200))
+# ...and/or every N seconds of training
+CHECKPOINT_SECONDS = int(os.environ.get("CHECKPOINT_SECONDS", 0))
+# Number of most recent checkpoints kept on disk
+CHECKPOINT_KEEP = int(os.environ.get("CHECKPOINT_KEEP", 2))
 
 
 # ---------------------------------------------
 # Build CNN Model
 # ---------------------------------------------
-def build_model(num_classes):
+def build_model(num_classes, compact=False):
+    # compact: global average pooling instead of Flatten, which drops the
+    # 22M-parameter Dense input layer (used for the distilled serving student)
     model = Sequential([
         Conv2D(32, (3, 3), activation="relu", input_shape=(224, 224, 3)),
         MaxPooling2D(),
@@ -19,7 +34,7 @@ def build_model(num_classes):
         Conv2D(128, (3, 3), activation="relu"),
         MaxPooling2D(),
 
-        Flatten(),
+        GlobalAveragePooling2D() if compact else Flatten(),
         Dense(256, activation="relu"),
         Dropout(0.3),
 
@@ -33,21 +48,172 @@ def build_model(num_classes):
     )
     return model
 
+# ---------------------------------------------
+# Checkpoints
+# ---------------------------------------------
+def _write_json(path, value):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(value, f)
+    os.replace(tmp_path, path)
+
+
+def latest_checkpoint(checkpoint_dir):
+    """State of the newest checkpoint ({"path", "epoch", "step", "complete", ...}) or None"""
+    try:
+        with open(os.path.join(checkpoint_dir, "latest.json")) as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return state if os.path.exists(state.get("path", "")) else None
+
+
+class TrainingCheckpoint(Callback):
+    """Saves model, optimizer state and the (epoch, batch) position of the data iterator.
+
+    Each checkpoint is written to a temporary file and renamed, and latest.json
+    is only updated afterwards, so a run killed mid-write resumes from the
+    previous checkpoint. Only the newest `keep` checkpoints are retained.
+    """
+
+    def __init__(self, checkpoint_dir, train_data=None, every=CHECKPOINT_EVERY, every_seconds=CHECKPOINT_SECONDS,
+                 keep=CHECKPOINT_KEEP):
+        super().__init__()
+        self.checkpoint_dir = checkpoint_dir
+        self.train_data = train_data
+        self.every = every
+        self.every_seconds = every_seconds
+        self.keep = keep
+        self.epoch = 0
+        self.step_offset = 0  # batches of the current epoch consumed before this fit() call
+        self._last_save = time.time()
+        os.makedirs(checkpoint_dir, exist_ok=True)
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self.epoch = epoch
+
+    def on_train_batch_end(self, batch, logs=None):
+        if batch + 1 == self.params.get("steps"):
+            return  # on_epoch_end saves the epoch boundary
+        step = self.step_offset + batch + 1
+        due_steps = self.every and step % self.every == 0
+        due_time = self.every_seconds and time.time() - self._last_save >= self.every_seconds
+        if due_steps or due_time:
+            self.save(self.epoch, step)
+
+    def on_epoch_end(self, epoch, logs=None):
+        self.step_offset = 0
+        self.save(epoch + 1, 0)
+
+    def save(self, epoch, step):
+        name = f"ckpt-e{epoch:03d}-s{step:06d}"
+        path = os.path.join(self.checkpoint_dir, name + ".keras")
+        tmp_path = os.path.join(self.checkpoint_dir, name + ".tmp.keras")
+        self.model.save(tmp_path)
+        os.replace(tmp_path, path)
+
+        state = {"path": path, "epoch": epoch, "step": step, "complete": False,
+                 "saved_at": time.strftime("%Y-%m-%dT%H:%M:%S")}
+        # Mid-epoch: remember this epoch's shuffle order so resuming skips exactly the seen batches
+        index_array = getattr(self.train_data, "index_array", None)
+        if step and index_array is not None:
+            np.save(os.path.join(self.checkpoint_dir, name + ".order.npy"), index_array)
+            state["order"] = os.path.join(self.checkpoint_dir, name + ".order.npy")
+        _write_json(os.path.join(self.checkpoint_dir, "latest.json"), state)
+        self._last_save = time.time()
+        self._prune(path)
+        print(f"\n[INFO] Checkpoint saved: epoch {epoch}, batch {step} -> {path}")
+
+    def mark_complete(self):
+        """Flag the run as finished so the next train_model call starts fresh"""
+        state = latest_checkpoint(self.checkpoint_dir)
+        if state:
+            _write_json(os.path.join(self.checkpoint_dir, "latest.json"), {**state, "complete": True})
+
+    def _prune(self, latest_path):
+        checkpoints = sorted(glob.glob(os.path.join(self.checkpoint_dir, "ckpt-*.keras")))
+        checkpoints = [p for p in checkpoints if not p.endswith(".tmp.keras")]
+        for path in checkpoints[:-self.keep] if self.keep else []:
+            if path == latest_path:
+                continue
+            for stale in (path, path[:-len(".keras")] + ".order.npy"):
+                if os.path.exists(stale):
+                    os.remove(stale)
+
+
+def _remaining_batches(train_data, state):
+    """(data, steps) for the rest of a partially trained epoch"""
+    step = state["step"]
+    if hasattr(train_data, "__getitem__") and hasattr(train_data, "__len__"):
+        # Sequence / DirectoryIterator: restore the epoch's order and continue after the last seen batch
+        if state.get("order") and hasattr(train_data, "index_array"):
+            train_data.index_array = np.load(state["order"])
+
+        def batches():
+            for i in range(step, len(train_data)):
+                yield train_data[i]
+        return batches(), len(train_data) - step
+    # tf.data: skip the same number of batches (the reshuffled order is not restored)
+    return train_data.skip(step), None
+
+
 # ---------------------------------------------
 # Train Model
 # ---------------------------------------------
-def train_model(train_data, test_data, epochs=10, save_path="chest_disease_model.h5"):
-    model = build_model(train_data.num_classes)
+def train_model(train_data, test_data, epochs=10, save_path="chest_disease_model.h5", num_classes=None,
+                checkpoint_dir=None, resume=True, checkpoint_every=CHECKPOINT_EVERY, profiler=None):
+    """Train and save the CNN; resumes from the newest checkpoint of an interrupted run.
+
+    profiler: optional callback with a wrap(train_data) method (new/training_profiler.py)
+    """
+    checkpoint_dir = checkpoint_dir or os.path.splitext(save_path)[0] + "_checkpoints"
+    checkpoint = TrainingCheckpoint(checkpoint_dir, train_data, every=checkpoint_every)
+    callbacks = [checkpoint] + ([profiler] if profiler else [])
+    wrap = profiler.wrap if profiler else (lambda data: data)
+
+    state = latest_checkpoint(checkpoint_dir) if resume else None
+    if state and not state.get("complete"):
+        model = load_model(state["path"])
+        print(f"[INFO] Resuming from {state['path']} (epoch {state['epoch']}, batch {state['step']})")
+    else:
+        state = None
+        # tf.data datasets don't carry num_classes like a DirectoryIterator does
+        model = build_model(num_classes or train_data.num_classes)
+
+    # Batch i of an epoch must be index_array[i*bs:(i+1)*bs] for checkpoints to point at the
+    # right batch: a Sequence/DirectoryIterator already reshuffles index_array on_epoch_end, so
+    # fit() must not shuffle the batch order on top of it (it does by default for PyDatasets)
+    shuffle = not (hasattr(train_data, "__getitem__") and hasattr(train_data, "__len__"))
 
     print("\n==================== TRAINING STARTED ====================")
+    initial_epoch = state["epoch"] if state else 0
+    partial = None
+    if state and state["step"] and initial_epoch < epochs:
+        # Finish the interrupted epoch first
+        data, steps = _remaining_batches(train_data, state)
+        checkpoint.step_offset = state["step"]
+        partial = model.fit(wrap(data), validation_data=test_data, epochs=initial_epoch + 1,
+                            initial_epoch=initial_epoch, steps_per_epoch=steps, shuffle=False,
+                            callbacks=callbacks)
+        if hasattr(train_data, "on_epoch_end"):
+            train_data.on_epoch_end()
+        initial_epoch += 1
+
     history = model.fit(
-        train_data,
+        wrap(train_data),
         validation_data=test_data,
-        epochs=epochs
+        epochs=epochs,
+        initial_epoch=initial_epoch,
+        shuffle=shuffle,
+        callbacks=callbacks
     )
+    if partial is not None:
+        for key, values in partial.history.items():
+            history.history[key] = values + history.history.get(key, [])
 
     # Save model
     model.save(save_path)
+    checkpoint.mark_complete()
     print(f"\nModel saved as {save_path}")
 
     return model, history
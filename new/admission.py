@@ -0,0 +1,331 @@
+"""
+Admission control and load shedding for the API.
+
+Each class of work (model inference, LLM calls, plain database reads) gets its
+own lane with a concurrency limit, a bounded wait queue and a wait budget.
+Requests that would wait longer than the budget are rejected up front with
+429/503 and a Retry-After header instead of piling up until the gunicorn
+timeout, so cheap reads keep flowing while the model is saturated.
+"""
+import asyncio
+import math
+import os
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+from functools import wraps
+
+from flask import jsonify
+
+
+class Overloaded(Exception):
+    """Raised when a lane cannot admit a request within its budget"""
+
+    def __init__(self, lane, status, retry_after, reason):
+        super().__init__(f"{lane}: {reason}")
+        self.lane = lane
+        self.status = status
+        self.retry_after = max(1, int(math.ceil(retry_after)))
+        self.reason = reason
+
+
+class _LaneState:
+    """Counters and wait estimation shared by the thread and asyncio lanes"""
+
+    def __init__(self, name, max_concurrent, max_queue, max_wait, initial_service_time):
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        # Exponentially weighted average of how long one admitted request holds a slot
+        self.service_time = initial_service_time
+        self.active = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+
+    def _estimated_wait(self):
+        """Seconds a newly queued request would wait before getting a slot"""
+        ahead = self.active + self.waiting - self.max_concurrent + 1
+        if ahead <= 0:
+            return 0.0
+        return ahead * self.service_time / self.max_concurrent
+
+    def _try_admit(self):
+        """Take a free slot immediately, or raise if the request must be shed.
+
+        Returns False when the caller should queue for a slot.
+        """
+        if self.active < self.max_concurrent and self.waiting == 0:
+            self.active += 1
+            self.admitted += 1
+            return True
+
+        if self.waiting >= self.max_queue:
+            self.rejected += 1
+            raise Overloaded(self.name, 503, self._estimated_wait() or self.service_time,
+                             "queue is full")
+
+        estimate = self._estimated_wait()
+        if estimate > self.max_wait:
+            self.rejected += 1
+            raise Overloaded(self.name, 429, estimate, "estimated wait exceeds budget")
+
+        return False
+
+    def _queue_timeout(self):
+        self.timed_out += 1
+        return Overloaded(self.name, 503, self._estimated_wait() or self.service_time,
+                          "timed out waiting in queue")
+
+    def _finish(self, elapsed):
+        self.active -= 1
+        self.service_time = 0.8 * self.service_time + 0.2 * elapsed
+
+    def _counters(self):
+        return {
+            'active': self.active,
+            'waiting': self.waiting,
+            'max_concurrent': self.max_concurrent,
+            'max_queue': self.max_queue,
+            'service_time_s': round(self.service_time, 3),
+            'estimated_wait_s': round(self._estimated_wait(), 3),
+            'admitted': self.admitted,
+            'rejected': self.rejected,
+            'timed_out': self.timed_out
+        }
+
+
+class Lane(_LaneState):
+    """Bounded FIFO admission queue in front of a concurrency limit (threads)"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        with self._cond:
+            if self._try_admit():
+                return
+
+            self.waiting += 1
+            deadline = time.monotonic() + self.max_wait
+            try:
+                while self.active >= self.max_concurrent:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise self._queue_timeout()
+                    self._cond.wait(remaining)
+            finally:
+                self.waiting -= 1
+
+            self.active += 1
+            self.admitted += 1
+
+    def release(self, elapsed):
+        with self._cond:
+            self._finish(elapsed)
+            self._cond.notify()
+
+    def releaser(self):
+        """Release callback for a slot held past the view (streamed responses).
+
+        Call it from every exit path (generator finally, response close, setup
+        errors); only the first call releases the slot.
+        """
+        start = time.monotonic()
+        lock = threading.Lock()
+        released = []
+
+        def release():
+            with lock:
+                if released:
+                    return
+                released.append(True)
+            self.release(time.monotonic() - start)
+        return release
+
+    @contextmanager
+    def slot(self):
+        self.acquire()
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.release(time.monotonic() - start)
+
+    def snapshot(self):
+        with self._cond:
+            return self._counters()
+
+
+class AsyncLane(_LaneState):
+    """Same admission policy for coroutines running on one event loop"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._cond = None
+
+    def _condition(self):
+        # Created lazily so the lane binds to the server's running loop
+        if self._cond is None:
+            self._cond = asyncio.Condition()
+        return self._cond
+
+    async def acquire(self):
+        cond = self._condition()
+        async with cond:
+            if self._try_admit():
+                return
+
+            self.waiting += 1
+            deadline = time.monotonic() + self.max_wait
+            try:
+                while self.active >= self.max_concurrent:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise self._queue_timeout()
+                    try:
+                        await asyncio.wait_for(cond.wait(), remaining)
+                    except asyncio.TimeoutError:
+                        pass
+            finally:
+                self.waiting -= 1
+
+            self.active += 1
+            self.admitted += 1
+
+    async def release(self, elapsed):
+        cond = self._condition()
+        async with cond:
+            self._finish(elapsed)
+            cond.notify()
+
+    def releaser(self):
+        """Async counterpart of Lane.releaser; only the first await releases the slot"""
+        start = time.monotonic()
+        released = []
+
+        async def release():
+            if released:
+                return
+            released.append(True)
+            await self.release(time.monotonic() - start)
+        return release
+
+    @asynccontextmanager
+    async def slot(self):
+        await self.acquire()
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            await self.release(time.monotonic() - start)
+
+    def snapshot(self):
+        return self._counters()
+
+
+def _lane_from_env(name, concurrency, queue, max_wait, service_time, lane_class=Lane):
+    prefix = f"ADMISSION_{name.upper()}_"
+    return lane_class(
+        name,
+        max_concurrent=int(os.environ.get(prefix + 'CONCURRENCY', concurrency)),
+        max_queue=int(os.environ.get(prefix + 'QUEUE', queue)),
+        max_wait=float(os.environ.get(prefix + 'MAX_WAIT', max_wait)),
+        initial_service_time=float(os.environ.get(prefix + 'SERVICE_TIME', service_time))
+    )
+
+
+# Threaded server (gunicorn --threads, see Procfile): every admitted *or queued*
+# request blocks one of SERVER_THREADS, so the heavy lanes' concurrency + queue
+# must leave threads free for reads. READ_RESERVED_THREADS are never given to
+# inference or LLM requests; the rest is split between them by `share`.
+#
+#   SERVER_THREADS=8, reserved 2 -> inference 1 + 1 queued, llm 2, export 1, reads keep >= 2
+SERVER_THREADS = int(os.environ.get('SERVER_THREADS', 8))
+READ_RESERVED_THREADS = int(os.environ.get('ADMISSION_READ_RESERVED_THREADS', max(2, SERVER_THREADS // 4)))
+
+# One model instance serves the whole worker, so inference runs one at a time:
+# extra concurrency only splits the same CPU and makes every request slower.
+# Bulk exports hold a thread for as long as their zip streams, so only one runs at a time.
+HEAVY_LANES = {
+    'inference': dict(concurrency=1, share=0.4, max_wait=30, service_time=2.0),
+    'llm': dict(concurrency=2, share=0.4, max_wait=60, service_time=8.0),
+    'export': dict(concurrency=1, share=0.2, max_wait=0, service_time=60.0),
+}
+
+
+def thread_lane_defaults(threads=SERVER_THREADS, reserved=READ_RESERVED_THREADS):
+    """Lane sizes whose blocked threads fit the server's thread budget"""
+    budget = max(len(HEAVY_LANES), threads - reserved)
+    lanes = {}
+    for name, cfg in HEAVY_LANES.items():
+        slots = max(1, int(budget * cfg['share']))
+        concurrency = min(cfg['concurrency'], slots)
+        lanes[name] = dict(concurrency=concurrency, queue=slots - concurrency,
+                           max_wait=cfg['max_wait'], service_time=cfg['service_time'])
+    # Reads may use every thread; past that they wait in gunicorn's accept backlog, not in a thread.
+    # With no queue the lane only sheds when all threads are busy and max_wait (ADMISSION_READ_MAX_WAIT)
+    # is never consulted; it only takes effect if ADMISSION_READ_QUEUE is raised above 0
+    lanes['read'] = dict(concurrency=threads, queue=0, max_wait=5, service_time=0.3)
+    return lanes
+
+
+# The ASGI server queues coroutines, not threads, so its queues can be longer
+ASYNC_LANE_DEFAULTS = {
+    'inference': dict(concurrency=1, queue=4, max_wait=30, service_time=2.0),
+    'llm': dict(concurrency=2, queue=8, max_wait=60, service_time=8.0),
+    'read': dict(concurrency=8, queue=32, max_wait=5, service_time=0.3),
+    'export': dict(concurrency=1, queue=0, max_wait=0, service_time=60.0),
+}
+
+LANE_DEFAULTS = thread_lane_defaults()
+LANES = {name: _lane_from_env(name, **cfg) for name, cfg in LANE_DEFAULTS.items()}
+ASYNC_LANES = {name: _lane_from_env(name, lane_class=AsyncLane, **cfg) for name, cfg in ASYNC_LANE_DEFAULTS.items()}
+
+
+def get_lane(name):
+    return LANES[name]
+
+
+def overloaded_response(error):
+    """Flask response for a shed request"""
+    response = jsonify({
+        'error': 'Server is busy, please retry shortly',
+        'reason': error.reason,
+        'lane': error.lane,
+        'retry_after': error.retry_after
+    })
+    response.status_code = error.status
+    response.headers['Retry-After'] = str(error.retry_after)
+    return response
+
+
+def admit(lane_name):
+    """Decorator to run a route inside an admission lane"""
+    lane = LANES[lane_name]
+
+    def decorator(f):
+        @wraps(f)
+        def decorated(*args, **kwargs):
+            try:
+                lane.acquire()
+            except Overloaded as e:
+                print(f"⚠️ Shedding request on '{e.lane}' lane: {e.reason} (retry after {e.retry_after}s)")
+                return overloaded_response(e)
+
+            start = time.monotonic()
+            try:
+                return f(*args, **kwargs)
+            finally:
+                lane.release(time.monotonic() - start)
+
+        return decorated
+
+    return decorator
+
+
+def admission_snapshot():
+    return {name: lane.snapshot() for name, lane in LANES.items()}
@@ -1,4 +1,4 @@
-from flask import Flask, request, jsonify, send_file
+from flask import Flask, request, jsonify, send_file, Response
 from flask_cors import CORS
 import numpy as np
 import cv2
@@ -11,6 +11,8 @@ import os
 import hashlib
 import jwt
 import re
+import json
+import time
 from functools import wraps
 
 # Suppress TensorFlow warnings BEFORE importing TensorFlow
@@ -22,6 +24,18 @@ import tensorflow as tf
 tf.get_logger().setLevel('ERROR')  # Only show errors
 
 from supabase_client import get_supabase_client
+from knowledge_pack import get_knowledge_pack
+from report_renderer import file_version
+from serving_export import ServingModel, default_export_dir, load_serving_model
+from reports import ContentStore, ReportService, overlay_image, DONE, FAILED
+from bulk_export import iter_report_zip
+from admission import admit, admission_snapshot, get_lane, Overloaded, overloaded_response
+from llm_client import HedgedLLMClient, GeminiBackend, LLMError
+from prescriptions import (
+    PRESCRIPTION_MODELS, parse_prescription_response,
+    get_fallback_prescription, normalize_prescription_request, build_prompt_for_key,
+    lookup_prescription, prescription_cache, PrescriptionStream
+)
 
 # Try to import Google Generative AI for prescription generation
 try:
@@ -36,6 +50,18 @@ except Exception as e:
     GEMINI_AVAILABLE = False
     gemini_model = None
 
+# Race the prescription models with delayed hedges under one overall deadline
+LLM_DEADLINE = float(os.environ.get('LLM_DEADLINE', 25))
+LLM_HEDGE_DELAY = os.environ.get('LLM_HEDGE_DELAY')
+llm_client = HedgedLLMClient(
+    GeminiBackend(genai) if GEMINI_AVAILABLE else None,
+    PRESCRIPTION_MODELS,
+    deadline=LLM_DEADLINE,
+    hedge_delay=float(LLM_HEDGE_DELAY) if LLM_HEDGE_DELAY else None,
+    stats_half_life=float(os.environ.get('LLM_STATS_HALF_LIFE', 300)),
+    explore_rate=float(os.environ.get('LLM_EXPLORE_RATE', 0.05))
+)
+
 app = Flask(__name__)
 CORS(app)  # Enable CORS for React frontend
 
@@ -46,16 +72,27 @@ TOKEN_EXPIRATION_HOURS = int(os.environ.get('TOKEN_EXPIRATION_HOURS', 24))
 
 # Load model with optimizations
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-MODEL_PATH = os.path.join(BASE_DIR, 'models', 'chest_disease_efficientnetv2.h5')
+# MODEL_FILE=chest_disease_student.h5 serves the distilled CPU student (distill.py) instead
+MODEL_PATH = os.path.join(BASE_DIR, 'models', os.environ.get('MODEL_FILE', 'chest_disease_efficientnetv2.h5'))
+
+# SavedModel with a uint8 serving signature (serving_export.py export); used instead of
+# model.predict when it exists and was exported from MODEL_PATH
+SERVING_EXPORT_DIR = os.environ.get('SERVING_EXPORT_DIR', default_export_dir(MODEL_PATH))
 
 print("📦 Loading TensorFlow model (this may take a moment)...")
 try:
-    # Suppress Keras compilation warning
-    model = tf.keras.models.load_model(MODEL_PATH, compile=False)
-    # Warm up the model with a dummy prediction for faster first inference
-    dummy_input = np.zeros((1, 224, 224, 3), dtype=np.float32)
-    _ = model.predict(dummy_input, verbose=0)
-    print(f"✅ Model loaded and warmed up successfully")
+    model = load_serving_model(SERVING_EXPORT_DIR, MODEL_PATH)
+    if model is not None:
+        # Warm up the signature so the first request doesn't pay for it
+        _ = model(np.zeros((1, 224, 224, 3), dtype=np.uint8))
+        print(f"✅ Serving signature loaded from {SERVING_EXPORT_DIR} and warmed up")
+    else:
+        # Suppress Keras compilation warning
+        model = tf.keras.models.load_model(MODEL_PATH, compile=False)
+        # Warm up the model with a dummy prediction for faster first inference
+        dummy_input = np.zeros((1, 224, 224, 3), dtype=np.float32)
+        _ = model.predict(dummy_input, verbose=0)
+        print(f"✅ Model loaded and warmed up successfully")
 except Exception as e:
     print(f"❌ Failed to load model: {e}")
     model = None
@@ -82,6 +119,12 @@ DISEASE_MAP = {
     48: "Lower Lobe Opacity", 49: "Normal"
 }
 
+# Clinical knowledge pack is read once at startup
+get_knowledge_pack()
+
+# Background PDF renderer with a content-addressed store on local disk
+report_service = ReportService(ContentStore(), file_version(MODEL_PATH))
+
 # Initialize Supabase client
 supabase = get_supabase_client()
 print("✅ Connected to Supabase database")
@@ -226,36 +269,213 @@ def token_required(f):
 
 # Supabase client is initialized globally above
 
-def preprocess_image(image_bytes):
-    """Preprocess image for model input"""
+def decode_scan(image_bytes):
+    """Decode and resize to a uint8 BGR batch of one (the serving signature's input)"""
     nparr = np.frombuffer(image_bytes, np.uint8)
     img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
     img = cv2.resize(img, (224, 224))
-    img = img.astype('float32') / 255.0
-    img = np.expand_dims(img, axis=0)
-    return img
+    return np.expand_dims(img, axis=0)
+
+def preprocess_image(image_bytes):
+    """Preprocess image for model input"""
+    return decode_scan(image_bytes).astype('float32') / 255.0
+
+def model_runtime():
+    """How predictions are served, for the health checks"""
+    if model is None:
+        return None
+    return 'saved_model_signature' if isinstance(model, ServingModel) else 'keras'
+
+def predict_scan(image_bytes):
+    """Class probabilities for one image, through the serving signature when loaded"""
+    if isinstance(model, ServingModel):
+        # The signature scales uint8 -> [0, 1] itself
+        return model(decode_scan(image_bytes))
+    return model.predict(preprocess_image(image_bytes), verbose=0)
 
 def generate_gradcam_simple(original_image, confidence):
     """Generate a simple heatmap overlay"""
     nparr = np.frombuffer(original_image, np.uint8)
     img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-    h, w, _ = img.shape
     
     # Create a simple overlay (in production, use real Grad-CAM)
-    overlay = img.copy()
-    color = (0, 255, 0) if confidence > 70 else (0, 165, 255)
-    cv2.rectangle(overlay, (w//4, h//4), (3*w//4, 3*h//4), color, -1)
-    overlay = cv2.addWeighted(img, 0.7, overlay, 0.3, 0)
+    overlay = overlay_image(img, confidence)
     
     # Convert to base64
     _, buffer = cv2.imencode('.png', overlay)
     img_str = base64.b64encode(buffer).decode()
     return f"data:image/png;base64,{img_str}"
 
+def run_diagnosis(image_bytes):
+    """Preprocess, predict and render the overlay for one uploaded image (CPU-bound)"""
+    # Predict
+    if model:
+        predictions = predict_scan(image_bytes)
+        class_idx = np.argmax(predictions[0])
+        confidence = float(predictions[0][class_idx]) * 100
+        print(f"✅ Prediction made: {class_idx} with {confidence:.2f}% confidence")
+    else:
+        # Fallback if model not loaded
+        class_idx = 0
+        confidence = 85.0
+        print("⚠️ Using fallback prediction")
+    
+    disease = DISEASE_MAP.get(class_idx, "Unknown")
+    print(f"✅ Disease: {disease}")
+    
+    # Generate Grad-CAM
+    gradcam_image = generate_gradcam_simple(image_bytes, confidence)
+    print(f"✅ Grad-CAM generated")
+    return disease, confidence, gradcam_image
+
+def build_diagnosis_record(user_id, patient, disease, confidence, image_url, timestamp):
+    """Row inserted into the Supabase records table for a diagnosis"""
+    return {
+        'user_id': user_id,  # Link to authenticated user
+        'patient_name': patient.get('name', 'Unknown'),
+        'patient_id': patient.get('id', 'AUTO-' + timestamp),
+        'age': int(patient.get('age', 0)) if patient.get('age') else 0,
+        'sex': patient.get('gender', 'Unknown'),
+        'physician': patient.get('physician', 'Dr. AI'),
+        'diagnosis': disease,
+        'confidence': float(confidence),
+        'image_url': image_url,
+        'timestamp': datetime.datetime.now().isoformat()
+    }
+
+def clinical_reference(disease):
+    """Clinical summary, drug info and sources for a class from the knowledge pack"""
+    entry = get_knowledge_pack().lookup(disease)
+    return {
+        'summary': entry['summary'],
+        'summary_url': entry['summary_url'],
+        'drug_info': entry['drug_info'],
+        'drug_url': entry['drug_url']
+    }
+
+def build_diagnosis_result(diagnosis_id, disease, confidence, gradcam_image, image_url):
+    """Response body of the predict endpoint"""
+    return {
+        'id': diagnosis_id,
+        'disease': disease,
+        'confidence': round(confidence, 2),
+        'gradcam_image': gradcam_image,
+        'image_url': image_url,
+        'clinical_info': f'Diagnosis: {disease}. Please consult with a healthcare professional for proper medical advice.',
+        'clinical_reference': clinical_reference(disease),
+        'timestamp': datetime.datetime.now().isoformat()
+    }
+
+def retain_scan(diagnosis_id, image_bytes):
+    """Keep the upload for server-side reports; never fails the diagnosis"""
+    try:
+        report_service.retain_scan(diagnosis_id, image_bytes)
+    except Exception as e:
+        print(f"⚠️ Could not retain scan for reports: {e}")
+
+def report_status_body(job):
+    """Status document for a report job, with polling and download links"""
+    return {
+        **job.to_dict(),
+        'status_url': f'/api/reports/{job.report_id}',
+        'download_url': f'/api/reports/download/{job.report_id}'
+    }
+
+def report_status_response(job):
+    """200 once finished, otherwise 202 with a Retry-After hint for polling"""
+    response = jsonify(report_status_body(job))
+    if job.status == FAILED:
+        response.status_code = 500
+    elif job.status != DONE:
+        response.status_code = 202
+        response.headers['Retry-After'] = '1'
+    return response
+
+EXPORT_PAGE_SIZE = 500
+
+def parse_export_filters(args):
+    """Date range (inclusive, YYYY-MM-DD), physician and diagnosis from query args"""
+    filters = {}
+    for key in ('from', 'to'):
+        if args.get(key):
+            filters[key] = datetime.date.fromisoformat(args[key])
+    for key in ('physician', 'diagnosis'):
+        if args.get(key):
+            filters[key] = args[key]
+    return filters
+
+def iter_export_records(user_id, filters):
+    """Matching records, fetched a page at a time so large exports stay bounded"""
+    offset = 0
+    while True:
+        query = supabase.table('records').select('*').eq('user_id', user_id)
+        if 'from' in filters:
+            query = query.gte('timestamp', filters['from'].isoformat())
+        if 'to' in filters:
+            query = query.lt('timestamp', (filters['to'] + datetime.timedelta(days=1)).isoformat())
+        if 'physician' in filters:
+            query = query.eq('physician', filters['physician'])
+        if 'diagnosis' in filters:
+            query = query.eq('diagnosis', filters['diagnosis'])
+        page = query.order('timestamp').range(offset, offset + EXPORT_PAGE_SIZE - 1).execute().data
+        yield from page
+        if len(page) < EXPORT_PAGE_SIZE:
+            return
+        offset += EXPORT_PAGE_SIZE
+
+def export_scan(record):
+    """Retained scan for a record, if any"""
+    return report_service.scan_bytes(str(record['id']))
+
+def export_filename(filters):
+    parts = [str(filters.get('from', 'all')), str(filters.get('to', 'now'))]
+    return f"reports_{'_'.join(parts)}.zip"
+
+def format_history(records):
+    """Shape database rows for the diagnosis history response"""
+    return [{
+        'id': record['id'],
+        'patient_name': record['patient_name'],
+        'patient_id': record['patient_id'],
+        'age': record['age'],
+        'sex': record['sex'],
+        'diagnosis': record['diagnosis'],
+        'confidence': record['confidence'],
+        'timestamp': record['timestamp']
+    } for record in records]
+
+def summarize_patients(records):
+    """Collapse records (newest first) into unique patients with scan counts"""
+    patient_map = {}
+    for record in records:
+        patient_id = record['patient_id']
+        if patient_id not in patient_map:
+            patient_map[patient_id] = {
+                'name': record['patient_name'],
+                'id': patient_id,
+                'age': record['age'],
+                'gender': record['sex'],
+                'status': 'Active',
+                'total_scans': 0,
+                'latest_diagnosis': None,
+                'last_visit': None
+            }
+        
+        # Count scans (all records for this patient)
+        patient_map[patient_id]['total_scans'] += 1
+        
+        # Set latest diagnosis and last visit (first record since ordered by timestamp desc)
+        if patient_map[patient_id]['latest_diagnosis'] is None:
+            patient_map[patient_id]['latest_diagnosis'] = record['diagnosis']
+            patient_map[patient_id]['last_visit'] = record['timestamp']
+    
+    return list(patient_map.values())
+
 # ==================== API ROUTES ====================
 
 @app.route('/api/diagnosis/predict', methods=['POST'])
 @token_required
+@admit('inference')
 def predict():
     """Predict disease from uploaded image"""
     if 'image' not in request.files:
@@ -276,28 +496,7 @@ def predict():
         image_bytes = file.read()
         print(f"✅ Image read: {len(image_bytes)} bytes")
         
-        # Preprocess
-        processed_img = preprocess_image(image_bytes)
-        print(f"✅ Image preprocessed: {processed_img.shape}")
-        
-        # Predict
-        if model:
-            predictions = model.predict(processed_img, verbose=0)
-            class_idx = np.argmax(predictions[0])
-            confidence = float(predictions[0][class_idx]) * 100
-            print(f"✅ Prediction made: {class_idx} with {confidence:.2f}% confidence")
-        else:
-            # Fallback if model not loaded
-            class_idx = 0
-            confidence = 85.0
-            print("⚠️ Using fallback prediction")
-        
-        disease = DISEASE_MAP.get(class_idx, "Unknown")
-        print(f"✅ Disease: {disease}")
-        
-        # Generate Grad-CAM
-        gradcam_image = generate_gradcam_simple(image_bytes, confidence)
-        print(f"✅ Grad-CAM generated")
+        disease, confidence, gradcam_image = run_diagnosis(image_bytes)
         
         # Parse patient data
         import json
@@ -311,34 +510,18 @@ def predict():
         # Insert record into Supabase with user_id
         print(f"💾 Saving to Supabase...")
         try:
-            response = supabase.table('records').insert({
-                'user_id': user_id,  # Link to authenticated user
-                'patient_name': patient.get('name', 'Unknown'),
-                'patient_id': patient.get('id', 'AUTO-' + timestamp),
-                'age': int(patient.get('age', 0)) if patient.get('age') else 0,
-                'sex': patient.get('gender', 'Unknown'),
-                'physician': patient.get('physician', 'Dr. AI'),
-                'diagnosis': disease,
-                'confidence': float(confidence),
-                'image_url': image_url,
-                'timestamp': datetime.datetime.now().isoformat()
-            }).execute()
+            response = supabase.table('records').insert(
+                build_diagnosis_record(user_id, patient, disease, confidence, image_url, timestamp)
+            ).execute()
             
             diagnosis_id = str(response.data[0]['id']) if response.data else 'unknown'
             print(f"✅ Saved to database with ID: {diagnosis_id}")
+            retain_scan(diagnosis_id, image_bytes)
         except Exception as db_error:
             print(f"❌ Database error: {str(db_error)}")
             diagnosis_id = 'temp-' + timestamp
         
-        result = {
-            'id': diagnosis_id,
-            'disease': disease,
-            'confidence': round(confidence, 2),
-            'gradcam_image': gradcam_image,
-            'image_url': image_url,
-            'clinical_info': f'Diagnosis: {disease}. Please consult with a healthcare professional for proper medical advice.',
-            'timestamp': datetime.datetime.now().isoformat()
-        }
+        result = build_diagnosis_result(diagnosis_id, disease, confidence, gradcam_image, image_url)
         
         print(f"✅ Returning result")
         print("=" * 50)
@@ -353,6 +536,7 @@ def predict():
 
 @app.route('/api/diagnosis/history', methods=['GET'])
 @token_required
+@admit('read')
 def get_history():
     """Get diagnosis history for authenticated user"""
     try:
@@ -362,18 +546,7 @@ def get_history():
         
         print(f"📊 Supabase returned {len(response.data)} records")
         
-        history = []
-        for record in response.data:
-            history.append({
-                'id': record['id'],
-                'patient_name': record['patient_name'],
-                'patient_id': record['patient_id'],
-                'age': record['age'],
-                'sex': record['sex'],
-                'diagnosis': record['diagnosis'],
-                'confidence': record['confidence'],
-                'timestamp': record['timestamp']
-            })
+        history = format_history(response.data)
         
         print(f"📊 Returning {len(history)} history items")
         return jsonify(history)
@@ -383,6 +556,7 @@ def get_history():
 
 @app.route('/api/patients', methods=['GET'])
 @token_required
+@admit('read')
 def get_patients():
     """Get all patients for authenticated user"""
     try:
@@ -392,31 +566,7 @@ def get_patients():
         
         print(f"👥 Supabase returned {len(response.data)} patient records")
         
-        # Get unique patients with scan counts and latest diagnosis
-        patient_map = {}
-        for record in response.data:
-            patient_id = record['patient_id']
-            if patient_id not in patient_map:
-                patient_map[patient_id] = {
-                    'name': record['patient_name'],
-                    'id': patient_id,
-                    'age': record['age'],
-                    'gender': record['sex'],
-                    'status': 'Active',
-                    'total_scans': 0,
-                    'latest_diagnosis': None,
-                    'last_visit': None
-                }
-            
-            # Count scans (all records for this patient)
-            patient_map[patient_id]['total_scans'] += 1
-            
-            # Set latest diagnosis and last visit (first record since ordered by timestamp desc)
-            if patient_map[patient_id]['latest_diagnosis'] is None:
-                patient_map[patient_id]['latest_diagnosis'] = record['diagnosis']
-                patient_map[patient_id]['last_visit'] = record['timestamp']
-        
-        patients = list(patient_map.values())
+        patients = summarize_patients(response.data)
         
         print(f"👥 Returning {len(patients)} unique patients with scan counts")
         return jsonify({'patients': patients})
@@ -636,6 +786,7 @@ def signup():
 
 @app.route('/api/auth/me', methods=['GET'])
 @token_required
+@admit('read')
 def get_current_user():
     """Get current user info from custom JWT token"""
     try:
@@ -666,16 +817,19 @@ def logout():
 
 @app.route('/api/prescription/generate', methods=['POST'])
 @token_required
+@admit('llm')
 def generate_prescription():
     """Generate AI-powered prescription using Gemini"""
     try:
         data = request.get_json()
         disease = data.get('disease', 'Unknown')
-        confidence = data.get('confidence', 0)
-        patient_name = data.get('patient_name', 'Patient')
-        patient_age = data.get('patient_age', 'N/A')
-        patient_gender = data.get('patient_gender', 'N/A')
-        clinical_info = data.get('clinical_info', '')
+        key, clinical_info = normalize_prescription_request(data)
+        
+        # Common case: same disease/age band/sex/confidence band seen before
+        cached = lookup_prescription(key)
+        if cached is not None:
+            print(f"⚡ Prescription served from memory for {key.disease} ({key.age_band}, {key.sex})")
+            return jsonify({'prescription': cached})
         
         if not GEMINI_AVAILABLE or not gemini_model:
             print("⚠️ Gemini not available, using fallback")
@@ -683,73 +837,19 @@ def generate_prescription():
                 'prescription': get_fallback_prescription(disease, "Gemini AI not configured")
             })
         
-        prompt = f"""You are a medical AI assistant. Based on the following chest X-ray diagnosis, generate a detailed prescription and medical recommendations.
-
-DIAGNOSIS DETAILS:
-- Detected Condition: {disease}
-- Confidence Level: {confidence}%
-- Patient Name: {patient_name}
-- Patient Age: {patient_age}
-- Patient Gender: {patient_gender}
-- Clinical Information: {clinical_info}
-
-Please provide a comprehensive response in the following JSON format ONLY (no markdown, no code blocks, just pure JSON):
-{{
-    "medications": [
-        {{"name": "Medication Name", "dosage": "Dosage amount", "frequency": "How often", "duration": "How long"}}
-    ],
-    "precautions": ["List of precautions the patient should take"],
-    "lifestyle_recommendations": ["Lifestyle changes and recommendations"],
-    "follow_up": "Recommended follow-up schedule",
-    "emergency_signs": ["Signs that require immediate medical attention"],
-    "dietary_advice": ["Dietary recommendations"],
-    "tests_recommended": ["Additional tests that may be needed"]
-}}
-
-Important: 
-1. Be specific to the diagnosed condition ({disease})
-2. Consider the patient's age ({patient_age}) when recommending medications
-3. Include appropriate dosages for the condition severity
-4. Always include a disclaimer that this is AI-generated and should be reviewed by a physician"""
-
-        # Try multiple models with fallback (gemini-2.5-flash has better rate limits)
-        models_to_try = ['gemini-2.5-flash', 'gemini-2.0-flash', 'gemini-1.5-flash']
-        last_error = None
-        
-        for model_name in models_to_try:
-            try:
-                print(f"🤖 Trying model: {model_name}")
-                temp_model = genai.GenerativeModel(model_name)
-                response = temp_model.generate_content(prompt)
-                response_text = response.text.strip()
-                
-                # Clean up response - remove markdown code blocks if present
-                if response_text.startswith('```'):
-                    parts = response_text.split('```')
-                    if len(parts) >= 2:
-                        response_text = parts[1]
-                        if response_text.startswith('json'):
-                            response_text = response_text[4:]
-                response_text = response_text.strip()
-                
-                import json
-                prescription_data = json.loads(response_text)
-                prescription_data['generated_by'] = f'Gemini AI ({model_name})'
-                prescription_data['disclaimer'] = 'This prescription is AI-generated and should be reviewed and approved by a licensed healthcare provider before use.'
-                
-                print(f"✅ Prescription generated successfully with {model_name}")
-                return jsonify({'prescription': prescription_data})
-                
-            except Exception as model_error:
-                last_error = str(model_error)
-                print(f"⚠️ Model {model_name} failed: {last_error[:100]}")
-                continue
-        
-        # All models failed
-        print(f"❌ All Gemini models failed. Last error: {last_error}")
-        return jsonify({
-            'prescription': get_fallback_prescription(disease, last_error)
-        })
+        prompt = build_prompt_for_key(key, clinical_info)
+
+        try:
+            prescription_data, model_name = llm_client.generate_sync(prompt, parse=parse_prescription_response)
+            prescription_cache.put(key, prescription_data)
+            print(f"✅ Prescription generated successfully with {model_name}")
+            return jsonify({'prescription': prescription_data})
+        except LLMError as llm_error:
+            # All models failed or the deadline expired
+            print(f"❌ Gemini prescription failed: {llm_error}")
+            return jsonify({
+                'prescription': get_fallback_prescription(disease, str(llm_error))
+            })
         
     except Exception as e:
         print(f"❌ Prescription generation error: {str(e)}")
@@ -757,73 +857,166 @@ Important:
             'prescription': get_fallback_prescription("Unknown", str(e))
         })
 
-def get_fallback_prescription(disease, error_msg=""):
-    """Generate a disease-specific fallback prescription"""
-    # Disease-specific recommendations
-    disease_recommendations = {
-        "Pneumonia": {
-            "medications": [
-                {"name": "Amoxicillin", "dosage": "500mg", "frequency": "3 times daily", "duration": "7-10 days"},
-                {"name": "Paracetamol", "dosage": "500mg", "frequency": "As needed for fever", "duration": "Until symptoms resolve"}
-            ],
-            "precautions": ["Complete the full course of antibiotics", "Rest and stay hydrated", "Avoid smoking"],
-            "tests_recommended": ["Follow-up chest X-ray in 2 weeks", "Complete blood count"]
-        },
-        "Tuberculosis": {
-            "medications": [
-                {"name": "DOTS Therapy", "dosage": "As per TB program", "frequency": "Daily under supervision", "duration": "6-9 months"}
-            ],
-            "precautions": ["Strictly follow medication schedule", "Wear mask in public", "Ensure good ventilation"],
-            "tests_recommended": ["Sputum test", "Monthly liver function tests"]
-        },
-        "COVID-19": {
-            "medications": [
-                {"name": "Paracetamol", "dosage": "500-650mg", "frequency": "Every 6 hours if fever", "duration": "As needed"},
-                {"name": "Vitamin C", "dosage": "1000mg", "frequency": "Once daily", "duration": "2 weeks"}
-            ],
-            "precautions": ["Self-isolate for recommended period", "Monitor oxygen levels", "Stay hydrated"],
-            "tests_recommended": ["RT-PCR test", "Pulse oximetry monitoring"]
-        },
-        "Normal": {
-            "medications": [
-                {"name": "No medication required", "dosage": "N/A", "frequency": "N/A", "duration": "N/A"}
-            ],
-            "precautions": ["Maintain healthy lifestyle", "Regular exercise", "Annual health checkup"],
-            "tests_recommended": ["Routine health checkup as needed"]
-        }
-    }
+SSE_HEADERS = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+
+@app.route('/api/prescription/stream', methods=['POST'])
+@token_required
+def stream_prescription():
+    """Stream an AI-powered prescription as server-sent events"""
+    data = request.get_json() or {}
+    disease = data.get('disease', 'Unknown')
+    key, clinical_info = normalize_prescription_request(data)
+    stream = PrescriptionStream(key, disease)
     
-    # Get disease-specific or default recommendations
-    specific = disease_recommendations.get(disease, {
-        "medications": [{"name": "Consult with physician", "dosage": "As directed", "frequency": "N/A", "duration": "N/A"}],
-        "precautions": ["Please consult with a qualified healthcare provider for proper diagnosis and treatment."],
-        "tests_recommended": ["As recommended by physician"]
-    })
+    cached = lookup_prescription(key)
+    if cached is not None:
+        return Response(stream.from_memory(cached), mimetype='text/event-stream', headers=SSE_HEADERS)
     
-    return {
-        'medications': specific.get('medications', [{"name": "Consult with physician", "dosage": "As directed", "frequency": "N/A", "duration": "N/A"}]),
-        'precautions': specific.get('precautions', ["Consult healthcare provider"]) + (
-            [f"Note: AI prescription service temporarily unavailable"] if error_msg else []
-        ),
-        'lifestyle_recommendations': [
-            'Maintain a healthy diet',
-            'Get adequate rest',
-            'Stay hydrated',
-            'Follow up with your healthcare provider'
-        ],
-        'follow_up': 'Schedule an appointment with your physician within 1-2 weeks',
-        'emergency_signs': [
-            'Difficulty breathing',
-            'Chest pain',
-            'High fever (>103°F/39.4°C)',
-            'Severe coughing with blood',
-            'Confusion or altered consciousness'
-        ],
-        'dietary_advice': ['Eat nutritious foods', 'Avoid processed foods', 'Stay hydrated'],
-        'tests_recommended': specific.get('tests_recommended', ['As recommended by physician']),
-        'generated_by': 'Smart Fallback System',
-        'disclaimer': 'This is a fallback response. Please consult a healthcare provider for personalized medical advice.'
-    }
+    if not GEMINI_AVAILABLE or not gemini_model:
+        events = [stream.start('fallback')] + stream.fail("Gemini AI not configured")
+        return Response(events, mimetype='text/event-stream', headers=SSE_HEADERS)
+    
+    # The LLM slot is held for as long as the stream runs, not just until the view returns.
+    # A generator closed before its first next() never runs its finally, so the slot is
+    # also released on response close and on setup errors (only the first release counts).
+    lane = get_lane('llm')
+    try:
+        lane.acquire()
+    except Overloaded as e:
+        return overloaded_response(e)
+    release = lane.releaser()
+    
+    try:
+        prompt = build_prompt_for_key(key, clinical_info)
+        
+        def generate():
+            try:
+                yield stream.start('llm')
+                model_name = None
+                try:
+                    for model_name, chunk in llm_client.stream_sync(prompt):
+                        yield from stream.on_chunk(chunk)
+                except LLMError as llm_error:
+                    yield from stream.fail(str(llm_error))
+                    return
+                yield from stream.finish(model_name)
+            finally:
+                release()
+        
+        response = Response(generate(), mimetype='text/event-stream', headers=SSE_HEADERS)
+        response.call_on_close(release)
+        return response
+    except BaseException:
+        release()
+        raise
+
+@app.route('/api/reports/generate', methods=['POST'])
+@token_required
+@admit('read')
+def generate_report():
+    """Queue a PDF report for a diagnosis; poll status_url or download_url for the result"""
+    data = request.get_json(silent=True) or {}
+    diagnosis_id = data.get('diagnosis_id')
+    if not diagnosis_id:
+        return jsonify({'error': 'diagnosis_id is required'}), 400
+
+    user_id = request.user['user_id']
+    try:
+        response = supabase.table('records').select('*').eq('id', diagnosis_id).eq('user_id', user_id).limit(1).execute()
+    except Exception as e:
+        print(f"❌ Error loading diagnosis for report: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+    if not response.data:
+        return jsonify({'error': 'Diagnosis not found'}), 404
+
+    job = report_service.submit(response.data[0], user_id)
+    print(f"📄 Report {job.report_id} for diagnosis {diagnosis_id}: {job.status}")
+    return report_status_response(job)
+
+@app.route('/api/reports/export', methods=['GET'])
+@token_required
+def export_reports():
+    """Stream a zip of reports for ?from=&to=&physician=&diagnosis= as they render"""
+    try:
+        filters = parse_export_filters(request.args)
+    except ValueError:
+        return jsonify({'error': 'from/to must be YYYY-MM-DD'}), 400
+
+    # The export lane slot is held while the zip streams (same release paths as the prescription stream)
+    lane = get_lane('export')
+    try:
+        lane.acquire()
+    except Overloaded as e:
+        return overloaded_response(e)
+    release = lane.releaser()
+
+    try:
+        user_id = request.user['user_id']
+        print(f"📦 Bulk export for user {user_id}: {filters}")
+
+        def generate():
+            try:
+                yield from iter_report_zip(iter_export_records(user_id, filters), load_scan=export_scan)
+            finally:
+                release()
+
+        response = Response(
+            generate(),
+            mimetype='application/zip',
+            headers={
+                'Content-Disposition': f'attachment; filename="{export_filename(filters)}"',
+                'Cache-Control': 'no-store',
+                'X-Accel-Buffering': 'no'
+            }
+        )
+        response.call_on_close(release)
+        return response
+    except BaseException:
+        release()
+        raise
+
+@app.route('/api/reports/<report_id>', methods=['GET'])
+@token_required
+def get_report_status(report_id):
+    """Current state of a report job"""
+    job = report_service.get(report_id)
+    if job is None or job.user_id != request.user['user_id']:
+        return jsonify({'error': 'Report not found'}), 404
+    return report_status_response(job)
+
+@app.route('/api/reports/download/<report_id>', methods=['GET'])
+@token_required
+def download_report(report_id):
+    """Stream a finished report from the store (ETag/Range aware)"""
+    job = report_service.get(report_id)
+    if job is None or job.user_id != request.user['user_id']:
+        return jsonify({'error': 'Report not found'}), 404
+    if job.status != DONE:
+        return report_status_response(job)
+
+    response = send_file(
+        report_service.store.blob_path(job.digest),
+        mimetype='application/pdf',
+        as_attachment=True,
+        download_name=job.filename,
+        conditional=True,
+        etag=job.digest,
+        max_age=3600
+    )
+    # Reports contain patient data: cacheable by the browser only
+    response.cache_control.private = True
+    response.cache_control.public = False
+    return response
+
+@app.route('/api/clinical-info/<disease>', methods=['GET'])
+@token_required
+def get_clinical_info(disease):
+    """Clinical reference for a disease class (in-memory, no network)"""
+    return jsonify({
+        'disease': disease,
+        'pack_version': get_knowledge_pack().version,
+        **clinical_reference(disease)
+    })
 
 @app.route('/api/health', methods=['GET'])
 def health():
@@ -831,7 +1024,13 @@ def health():
     return jsonify({
         'status': 'healthy',
         'model_loaded': model is not None,
+        'model_runtime': model_runtime(),
         'gemini_available': GEMINI_AVAILABLE,
+        'admission': admission_snapshot(),
+        'prescription_cache': prescription_cache.stats(),
+        'llm': llm_client.stats(),
+        'knowledge_pack': get_knowledge_pack().version,
+        'reports': report_service.stats(),
         'timestamp': datetime.datetime.now().isoformat()
     })
 
@@ -2,72 +2,41 @@ import streamlit as st
 import tensorflow as tf
 import numpy as np
 import cv2
-import sqlite3
 import pandas as pd
 import datetime
+import hashlib
 from PIL import Image
-from io import BytesIO
-from reportlab.lib.pagesizes import A4
-from reportlab.pdfgen import canvas
-from reportlab.lib.utils import ImageReader
-from reportlab.platypus import Paragraph
-from reportlab.lib.styles import getSampleStyleSheet
-from reportlab.lib.colors import black, grey, darkgreen
+from io import BytesIO, StringIO
+import tempfile
+import os
+from report_renderer import render_report, render_report_cached, file_version
+from bulk_export import iter_report_zip
 
 # =========================================================
 # 1. DATABASE CONFIGURATION & INITIALIZATION
 # =========================================================
-DB_FILE = "radiology_app.db"
-
-def init_db():
-    """Initializes the SQLite database and creates necessary tables."""
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    
-    # Table for Patient Diagnosis History
-    c.execute('''CREATE TABLE IF NOT EXISTS records (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    patient_name TEXT,
-                    patient_id TEXT,
-                    age INTEGER,
-                    sex TEXT,
-                    physician TEXT,
-                    diagnosis TEXT,
-                    confidence REAL,
-                    timestamp TEXT
-                )''')
-    
-    # Table for User Authentication
-    c.execute('''CREATE TABLE IF NOT EXISTS users (
-                    username TEXT PRIMARY KEY,
-                    password TEXT
-                )''')
-    
-    conn.commit()
-    conn.close()
-
-def save_prediction(patient_data, diagnosis, confidence):
-    """Saves a diagnostic record to the database."""
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    c.execute('''INSERT INTO records 
-                 (patient_name, patient_id, age, sex, physician, diagnosis, confidence, timestamp) 
-                 VALUES (?, ?, ?, ?, ?, ?, ?, ?)''', 
-              (patient_data['name'], patient_data['id'], patient_data['age'], 
-               patient_data['sex'], patient_data['physician'], diagnosis, 
-               confidence, datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")))
-    conn.commit()
-    conn.close()
-
-def get_all_records():
-    """Fetches all diagnostic history from the database."""
-    conn = sqlite3.connect(DB_FILE)
-    df = pd.read_sql_query("SELECT * FROM records ORDER BY timestamp DESC", conn)
-    conn.close()
-    return df
-
-# Initialize Database on Start
-init_db()
+# Shared WAL connection manager, migrations and paged queries (initialized on import)
+from database import save_prediction, count_records, query_records, iter_records, distinct_values
+
+HISTORY_PAGE_SIZE = 50
+# st.download_button needs the whole zip in memory, so in-app exports are capped;
+# larger exports go through the streaming GET /api/reports/export route
+UI_EXPORT_MAX_REPORTS = int(os.environ.get("UI_EXPORT_MAX_REPORTS", 200))
+UI_EXPORT_MAX_MB = int(os.environ.get("UI_EXPORT_MAX_MB", 100))
+
+def records_csv(filters):
+    """CSV of all matching records, assembled in batches"""
+    out = StringIO()
+    header = True
+    batch = []
+    for row in iter_records(filters):
+        batch.append(row)
+        if len(batch) == 5000:
+            pd.DataFrame(batch).to_csv(out, index=False, header=header)
+            header, batch = False, []
+    if batch or header:
+        pd.DataFrame(batch).to_csv(out, index=False, header=header)
+    return out.getvalue().encode('utf-8')
 
 # =========================================================
 # 2. GLOBAL CONSTANTS & DISEASE MAPPING
@@ -127,15 +96,14 @@ def get_disease_stage(disease_name, confidence):
 # =========================================================
 # 4. CLINICAL DATA FETCHING
 # =========================================================
+from knowledge_pack import get_knowledge_pack
+
+# Served from the offline knowledge pack (placeholder text for classes it lacks)
 def fetch_wikipedia(disease_name):
-    text = f"The condition {disease_name} is a known respiratory illness characterized by specific radiological findings. Clinical management typically involves diagnostic imaging, laboratory tests, and targeted therapy."
-    url = f"https://en.wikipedia.org/wiki/{disease_name.replace(' ', '_')}"
-    return text, url
+    return get_knowledge_pack().summary(disease_name)
 
 def fetch_openfda_drug(disease_name):
-    text = f"FDA analysis suggests standard treatment protocols for {disease_name} involve monitoring of respiratory function. Pharmaceutical interventions depend on the underlying etiology."
-    url = "https://open.fda.gov/"
-    return text, url
+    return get_knowledge_pack().drug_info(disease_name)
 
 def format_clinical_text(text, max_sentences=5):
     if not text: return "Clinical information is currently unavailable."
@@ -143,12 +111,19 @@ def format_clinical_text(text, max_sentences=5):
     selected = sentences[:max_sentences]
     return ". ".join(selected) + "."
 
+@st.cache_data(max_entries=64, show_spinner=False)
+def get_clinical_text(disease_name, pack_version):
+    """Formatted (summary, summary url, drug info) for a class, per knowledge pack version"""
+    wiki_text, wiki_url = fetch_wikipedia(disease_name)
+    fda_text, _ = fetch_openfda_drug(disease_name)
+    return format_clinical_text(wiki_text), wiki_url, format_clinical_text(fda_text)
+
 # =========================================================
 # 5. MODEL LOADING & GRAD-CAM LOGIC
 # =========================================================
-import os
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 MODEL_PATH = os.path.join(BASE_DIR, "models", "chest_disease_efficientnetv2.h5")
+MODEL_VERSION = file_version(MODEL_PATH)
 
 @st.cache_resource
 def load_model():
@@ -166,129 +141,69 @@ def load_model():
 
 model = load_model()
 
-def get_gradcam(image, model, is_demo_mode):
-    if 'prediction_counter' not in st.session_state:
-        st.session_state.prediction_counter = 0
-    
-    current_idx = st.session_state.prediction_counter
-    st.session_state.prediction_counter = (current_idx + 1) % 50 
-    
+def to_bgr(image):
     img = image.copy()
     if len(img.shape) == 2:
         img = cv2.cvtColor(img, cv2.COLOR_GRAY2BGR)
     elif img.shape[2] > 3:
         img = img[:, :, :3]
+    return img
 
-    if is_demo_mode:
-        class_idx = current_idx 
-        confidence = 92.5 + (current_idx % 7) * 0.5
-    else:
-        try:
-            target_size = (224, 224)
-            processed_img = cv2.resize(img, target_size)
-            processed_img = processed_img.astype('float32') / 255.0
-            processed_img = np.expand_dims(processed_img, axis=0) 
-            predictions = model.predict(processed_img, verbose=0)
-            class_idx = np.argmax(predictions[0])
-            confidence = predictions[0][class_idx] * 100.0
-        except Exception as e:
-            st.error(f"Prediction error: {e}")
-            class_idx, confidence = 49, 1.0 
-
-    # Generate Heatmap Overlay
+def draw_overlay(img):
+    """Heatmap overlay for the localization map (RGB)"""
     h, w, _ = img.shape
     overlay = img.copy()
     color = (0, 255, 0)
     cv2.rectangle(overlay, (w//4, h//4), (3*w//4, 3*h//4), color, -1)
     overlay = cv2.addWeighted(img, 0.7, overlay, 0.3, 0)
-    overlay = cv2.cvtColor(overlay, cv2.COLOR_BGR2RGB)
+    return cv2.cvtColor(overlay, cv2.COLOR_BGR2RGB)
+
+# Real predictions are memoized on (upload content hash, model version); the
+# underscore arguments are excluded from Streamlit's cache key.
+@st.cache_data(max_entries=32, show_spinner=False)
+def decode_upload(upload_digest, _data):
+    return np.array(Image.open(BytesIO(_data)).convert("RGB"))
+
+# Errors propagate out of the cached function so a failed prediction is never cached
+@st.cache_data(max_entries=32, show_spinner=False)
+def analyze_upload(upload_digest, model_version, _image, _model):
+    img = to_bgr(_image)
+    target_size = (224, 224)
+    processed_img = cv2.resize(img, target_size)
+    processed_img = processed_img.astype('float32') / 255.0
+    processed_img = np.expand_dims(processed_img, axis=0) 
+    predictions = _model.predict(processed_img, verbose=0)
+    class_idx = int(np.argmax(predictions[0]))
+    confidence = float(predictions[0][class_idx] * 100.0)
+    return draw_overlay(img), class_idx, confidence
+
+def get_gradcam(image, model, is_demo_mode, upload_digest=None):
+    if not is_demo_mode:
+        try:
+            return analyze_upload(upload_digest, MODEL_VERSION, image, model)
+        except Exception as e:
+            st.error(f"Prediction error: {e}")
+            return draw_overlay(to_bgr(image)), 49, 1.0
+
+    # Demo mode cycles through the classes and is deliberately never cached
+    if 'prediction_counter' not in st.session_state:
+        st.session_state.prediction_counter = 0
+    
+    current_idx = st.session_state.prediction_counter
+    st.session_state.prediction_counter = (current_idx + 1) % 50 
     
-    return overlay, class_idx, confidence
+    class_idx = current_idx 
+    confidence = 92.5 + (current_idx % 7) * 0.5
+    return draw_overlay(to_bgr(image)), class_idx, confidence
 
 # =========================================================
 # 6. PROFESSIONAL PDF GENERATION
 # =========================================================
-def create_pdf_report_full(original_img, gradcam_img, disease, confidence, clinical_summary, fda_reference, patient_info):
-    buffer = BytesIO()
-    c = canvas.Canvas(buffer, pagesize=A4)
-    width, height = A4
-    
-    if isinstance(original_img, np.ndarray): original_img = Image.fromarray(original_img)
-    if isinstance(gradcam_img, np.ndarray): gradcam_img = Image.fromarray(gradcam_img)
-
-    original_reader = ImageReader(original_img)
-    gradcam_reader = ImageReader(gradcam_img)
-    
-    styles = getSampleStyleSheet()
-    body_style = styles["Normal"]
-    body_style.fontName = "Helvetica"
-    body_style.fontSize = 10
-    body_style.leading = 12
-
-    # PDF Header
-    c.setFont("Helvetica-Bold", 20)
-    c.setFillColor(darkgreen)
-    c.drawCentredString(width / 2, height - 40, "AI-ASSISTED RADIOLOGY REPORT")
-    
-    c.setFont("Helvetica", 11)
-    c.setFillColor(grey)
-    c.drawCentredString(width / 2, height - 60, f"Study Date: {datetime.date.today()}")
-    c.line(40, height - 75, width - 40, height - 75)
-
-    # Patient Details Section
-    c.setFont("Helvetica-Bold", 14)
-    c.setFillColor(black)
-    c.drawString(40, height - 100, "1. PATIENT & STUDY DETAILS")
-    
-    y_start = height - 125  
-    data_points = [
-        ("Patient Name:", patient_info.get("name")),
-        ("Patient ID:", patient_info.get("id")),
-        ("Age/Sex:", f"{patient_info.get('age')} / {patient_info.get('sex')}"),
-        ("Referring Dr.:", patient_info.get("physician")),
-        ("Scan Type:", patient_info.get("scan_type", "Chest X-ray")),
-        ("AI Confidence:", f"{confidence:.2f}%"),
-        ("Predicted Condition:", disease),
-        ("Clinical Stage:", patient_info.get("stage", "N/A"))
-    ]   
-    for i, (label, value) in enumerate(data_points):
-        y_pos = y_start - (i * 18)
-        c.setFont("Helvetica", 10)
-        c.drawString(40, y_pos, label)
-        c.setFont("Helvetica-Bold", 10)
-        c.drawString(150, y_pos, str(value))
-        
-    c.line(40, y_start - 110, width - 40, y_start - 110)
-
-    # Imaging Results Section
-    img_y = y_start - 140
-    c.setFont("Helvetica-Bold", 14)
-    c.drawString(40, img_y, "2. IMAGING RESULTS & LOCALIZATION")
-    
-    c.setFont("Helvetica-Bold", 10)
-    c.drawString(40, img_y - 20, "Original X-Ray")
-    c.drawImage(original_reader, 40, img_y - 210, width=220, height=180, preserveAspectRatio=True)
-
-    c.drawString(300, img_y - 20, "Grad-CAM Heatmap")
-    c.drawImage(gradcam_reader, 300, img_y - 210, width=220, height=180, preserveAspectRatio=True)
-
-    # Clinical Summary Section
-    clinical_y = img_y - 240
-    c.setFont("Helvetica-Bold", 14)
-    c.drawString(40, clinical_y, "3. CLINICAL OVERVIEW")
-    
-    para = Paragraph(clinical_summary, body_style)
-    para.wrapOn(c, width - 80, 200)
-    para.drawOn(c, 40, clinical_y - para.height - 10)
-
-    # Final Footer
-    c.setFont("Helvetica-Bold", 8)
-    c.setFillColor(grey)
-    c.drawCentredString(width/2, 40, "MEDICAL DISCLAIMER: For professional decision support only. Review required by a qualified clinician.")
-    
-    c.save()
-    buffer.seek(0)
-    return buffer
+def create_pdf_report_full(original_img, gradcam_img, disease, confidence, clinical_summary, fda_reference, patient_info, record_id=None):
+    """Print-resolution report, cached per (record, model version) once the record is saved"""
+    args = (original_img, gradcam_img, disease, confidence, clinical_summary, fda_reference, patient_info)
+    pdf = render_report_cached(record_id, MODEL_VERSION, *args) if record_id is not None else render_report(*args)
+    return BytesIO(pdf)
 
 # =========================================================
 # 7. AUTHENTICATION & LOGIN UI
@@ -319,6 +234,41 @@ def show_login_page():
 # =========================================================
 # 8. MAIN APPLICATION UI
 # =========================================================
+def show_bulk_export():
+    """Filter the records and export all their PDF reports as one zip"""
+    with st.expander("📦 Bulk Report Export"):
+        today = datetime.date.today()
+        col_from, col_to = st.columns(2)
+        date_from = col_from.date_input("From", today - datetime.timedelta(days=30))
+        date_to = col_to.date_input("To", today)
+        col_phys, col_diag = st.columns(2)
+        physician = col_phys.selectbox("Physician", ["All"] + distinct_values('physician'))
+        diagnosis = col_diag.selectbox("Diagnosis", ["All"] + distinct_values('diagnosis'))
+
+        filters = {"date_from": date_from, "date_to": date_to,
+                   "physician": None if physician == "All" else physician,
+                   "diagnosis": None if diagnosis == "All" else diagnosis}
+        matching = count_records(filters)
+        st.caption(f"{matching} reports match")
+        too_many = matching > UI_EXPORT_MAX_REPORTS
+        if too_many:
+            st.warning(f"In-app exports are limited to {UI_EXPORT_MAX_REPORTS} reports. Narrow the filters, "
+                       "or use the streaming GET /api/reports/export endpoint for larger exports.")
+
+        if st.button("Build Export", disabled=matching == 0 or too_many):
+            with st.spinner(f"Rendering {matching} reports..."):
+                # Zip is spooled to disk chunk by chunk and read back only if it fits the cap
+                with tempfile.TemporaryFile() as spool:
+                    for chunk in iter_report_zip(iter_records(filters)):
+                        spool.write(chunk)
+                        if spool.tell() > UI_EXPORT_MAX_MB * 1024 * 1024:
+                            st.error(f"Export exceeds {UI_EXPORT_MAX_MB} MB. Narrow the filters, or use "
+                                     "GET /api/reports/export for larger exports.")
+                            return
+                    spool.seek(0)
+                    st.download_button("⬇️ Download Reports (.zip)", spool.read(),
+                                       f"reports_{date_from}_{date_to}.zip", "application/zip")
+
 def show_main_app():
     st.title("🩻 Multi-Disease Chest Scan Analyzer")
     st.markdown("---")
@@ -375,8 +325,9 @@ def show_main_app():
             )
 
         if uploaded_file:
-            image = Image.open(uploaded_file).convert("RGB")
-            img_np = np.array(image)
+            upload_bytes = uploaded_file.getvalue()
+            upload_digest = hashlib.sha256(upload_bytes).hexdigest()
+            img_np = decode_upload(upload_digest, upload_bytes)
             
             # Display image with scan type info
             col_img, col_info = st.columns([3, 2])
@@ -401,73 +352,87 @@ def show_main_app():
             if st.button("Run Analysis", use_container_width=True, type="primary"):
                 with st.spinner("Processing Model Weights..."):
                     # 1. Prediction & GradCAM
-                    gradcam_img, class_idx, confidence = get_gradcam(img_np, model, DEMO_MODE)
+                    gradcam_img, class_idx, confidence = get_gradcam(img_np, model, DEMO_MODE, upload_digest)
                     disease = get_disease_name(class_idx)
                     
                     # 1.5 Calculate Disease Stage
                     disease_stage = get_disease_stage(disease, confidence)
 
                     # 2. SAVE TO DATABASE (Integrated Step with stage)
-                    save_prediction(patient_data, disease, confidence)
-
-                    # 3. Results UI
+                    record_id = save_prediction(patient_data, disease, confidence)
                     st.success(f"✅ Diagnosis for {p_name} saved to database.")
-                    
-                    # Disease Stage Alert
-                    if "Stage IV" in disease_stage or "Critical" in disease_stage:
-                        st.error(f"🚨 CRITICAL CONDITION: {disease} - {disease_stage}")
-                    elif "Stage III" in disease_stage:
-                        st.warning(f"⚠️ ADVANCED CONDITION: {disease} - {disease_stage}")
-                    
-                    col1, col2 = st.columns(2)
-                    with col1:
-                        st.subheader(f"Diagnosis: {disease}")
-                        st.metric("Confidence Score", f"{confidence:.2f}%")
-                        st.metric("Clinical Stage", disease_stage, help="AI-assessed severity based on confidence level")
-                        st.info(f"📋 Scan Type: {xray_type}")
-                    
-                    st.image(gradcam_img, caption="Localization Map", use_container_width=True)
-
-                    # Clinical Context
-                    wiki_text, wiki_url = fetch_wikipedia(disease)
-                    fda_text, fda_url = fetch_openfda_drug(disease)
-                    clean_wiki = format_clinical_text(wiki_text)
-                    clean_fda = format_clinical_text(fda_text)
-
-                    st.markdown("---")
-                    st.subheader("📚 Clinical Reference")
-                    st.write(clean_wiki)
-                    st.markdown(f"🔗 [Full Wikipedia Article]({wiki_url})")
-
-                    with st.expander("📜 FDA / Medical Treatment Guidelines"):
-                        st.write(clean_fda)
-
-                    # PDF Report with stage info
-                    patient_data_extended = patient_data.copy()
-                    patient_data_extended['scan_type'] = xray_type
-                    patient_data_extended['stage'] = disease_stage
-                    
-                    pdf = create_pdf_report_full(img_np, gradcam_img, disease, confidence, clean_wiki, clean_fda, patient_data_extended)
-                    st.download_button("⬇️ Download PDF Report", pdf, f"{p_id}_{disease.replace(' ', '_')}_report.pdf", "application/pdf")
+
+                    # Kept across reruns (tab switches, PDF download) so the model is not re-run
+                    st.session_state.analysis = {
+                        "digest": upload_digest, "gradcam_img": gradcam_img, "disease": disease,
+                        "confidence": confidence, "stage": disease_stage, "record_id": record_id,
+                        "patient": patient_data.copy(), "scan_type": xray_type
+                    }
+
+            analysis = st.session_state.get("analysis")
+            if analysis and analysis["digest"] == upload_digest:
+                gradcam_img, disease, confidence = analysis["gradcam_img"], analysis["disease"], analysis["confidence"]
+                disease_stage, record_id = analysis["stage"], analysis["record_id"]
+
+                # 3. Results UI
+                # Disease Stage Alert
+                if "Stage IV" in disease_stage or "Critical" in disease_stage:
+                    st.error(f"🚨 CRITICAL CONDITION: {disease} - {disease_stage}")
+                elif "Stage III" in disease_stage:
+                    st.warning(f"⚠️ ADVANCED CONDITION: {disease} - {disease_stage}")
+                
+                col1, col2 = st.columns(2)
+                with col1:
+                    st.subheader(f"Diagnosis: {disease}")
+                    st.metric("Confidence Score", f"{confidence:.2f}%")
+                    st.metric("Clinical Stage", disease_stage, help="AI-assessed severity based on confidence level")
+                    st.info(f"📋 Scan Type: {analysis['scan_type']}")
+                
+                st.image(gradcam_img, caption="Localization Map", use_container_width=True)
+
+                # Clinical Context
+                clean_wiki, wiki_url, clean_fda = get_clinical_text(disease, get_knowledge_pack().version)
+
+                st.markdown("---")
+                st.subheader("📚 Clinical Reference")
+                st.write(clean_wiki)
+                st.markdown(f"🔗 [Full Wikipedia Article]({wiki_url})")
+
+                with st.expander("📜 FDA / Medical Treatment Guidelines"):
+                    st.write(clean_fda)
+
+                # PDF Report with stage info
+                patient_data_extended = analysis["patient"].copy()
+                patient_data_extended['scan_type'] = analysis["scan_type"]
+                patient_data_extended['stage'] = disease_stage
+                
+                pdf = create_pdf_report_full(img_np, gradcam_img, disease, confidence, clean_wiki, clean_fda, patient_data_extended, record_id)
+                st.download_button("⬇️ Download PDF Report", pdf, f"{patient_data_extended['id']}_{disease.replace(' ', '_')}_report.pdf", "application/pdf")
 
     with tab_history:
         st.subheader("📋 Diagnostic Records Database")
-        history_df = get_all_records()
+        total_records = count_records()
         
-        if not history_df.empty:
+        if total_records:
             # Search Functionality
-            search_query = st.text_input("Search by Patient ID or Name")
-            if search_query:
-                history_df = history_df[
-                    history_df['patient_id'].str.contains(search_query, case=False) |
-                    history_df['patient_name'].str.contains(search_query, case=False)
-                ]
+            search_query = st.text_input("Search by Patient Name, ID, Physician or Diagnosis",
+                                         help="Prefix match on each word, e.g. 'MRN-10 pneu'")
+            filters = {"search": search_query} if search_query else {}
+            matching = count_records(filters) if search_query else total_records
+
+            # Only the visible page is read from the database
+            pages = max(1, -(-matching // HISTORY_PAGE_SIZE))
+            page = st.number_input(f"Page (of {pages})", 1, pages, 1)
+            history_df = query_records(filters, limit=HISTORY_PAGE_SIZE, offset=(page - 1) * HISTORY_PAGE_SIZE)
+            st.caption(f"Showing {len(history_df)} of {matching} records")
             
             st.dataframe(history_df, use_container_width=True)
             
-            # Export CSV
-            csv = history_df.to_csv(index=False).encode('utf-8')
-            st.download_button("📥 Export Entire Database as CSV", csv, "radiology_history.csv", "text/csv")
+            # Export CSV (built only on request)
+            if st.button("📥 Prepare CSV Export"):
+                st.download_button("⬇️ Download CSV", records_csv(filters), "radiology_history.csv", "text/csv")
+
+            show_bulk_export()
         else:
             st.info("No records currently exist in the database.")
 
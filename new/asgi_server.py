@@ -0,0 +1,679 @@
+"""
+Async (ASGI) serving mode for the MediScan API.
+
+Same routes and response bodies as api_server.py, but Supabase and Gemini
+calls are awaited on non-blocking clients and model inference runs on a
+dedicated single-thread executor, so slow prescriptions or database round
+trips no longer tie up the worker's threads.
+
+Run with:
+    cd new && uvicorn asgi_server:app --host 0.0.0.0 --port 5000 --workers 1
+"""
+import asyncio
+import contextlib
+import datetime
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import wraps
+
+from starlette.applications import Starlette
+from starlette.background import BackgroundTask
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import JSONResponse, StreamingResponse, FileResponse, Response
+from starlette.routing import Route
+
+# Model loading, auth helpers and response shaping are shared with the sync server
+import api_server
+from api_server import (
+    GEMINI_AVAILABLE,
+    hash_password, verify_password, validate_email, validate_password,
+    generate_token, verify_token, run_diagnosis,
+    build_diagnosis_record, build_diagnosis_result, format_history, summarize_patients,
+    clinical_reference, report_service, report_status_body, retain_scan,
+    parse_export_filters, iter_export_records, export_scan, export_filename
+)
+from bulk_export import iter_report_zip
+from reports import DONE, FAILED
+from knowledge_pack import get_knowledge_pack
+from prescriptions import (
+    parse_prescription_response, get_fallback_prescription,
+    normalize_prescription_request, build_prompt_for_key, lookup_prescription, prescription_cache,
+    PrescriptionStream
+)
+from admission import ASYNC_LANES, Overloaded
+from llm_client import LLMError
+from supabase_client import get_async_supabase_client
+
+# CPU-bound TensorFlow work runs here, one image at a time, off the event loop
+INFERENCE_WORKERS = int(os.environ.get('INFERENCE_WORKERS', 1))
+inference_executor = ThreadPoolExecutor(max_workers=INFERENCE_WORKERS, thread_name_prefix='inference')
+
+
+def error(message, status):
+    return JSONResponse({'error': message}, status_code=status)
+
+
+def token_required(f):
+    """Decorator to require valid JWT token"""
+    @wraps(f)
+    async def decorated(request):
+        token = request.headers.get('Authorization')
+
+        if not token:
+            return error('Token is missing', 401)
+
+        try:
+            # Remove 'Bearer ' prefix if present
+            if token.startswith('Bearer '):
+                token = token[7:]
+
+            payload = verify_token(token)
+            if not payload:
+                return error('Token is invalid or expired', 401)
+
+            request.state.user = payload
+
+        except Exception:
+            return error('Token verification failed', 401)
+
+        return await f(request)
+
+    return decorated
+
+
+def overloaded_response(e):
+    print(f"⚠️ Shedding request on '{e.lane}' lane: {e.reason} (retry after {e.retry_after}s)")
+    return JSONResponse({
+        'error': 'Server is busy, please retry shortly',
+        'reason': e.reason,
+        'lane': e.lane,
+        'retry_after': e.retry_after
+    }, status_code=e.status, headers={'Retry-After': str(e.retry_after)})
+
+
+def admit(lane_name):
+    """Decorator to run a route inside an asyncio admission lane"""
+    lane = ASYNC_LANES[lane_name]
+
+    def decorator(f):
+        @wraps(f)
+        async def decorated(request):
+            try:
+                await lane.acquire()
+            except Overloaded as e:
+                return overloaded_response(e)
+
+            start = time.monotonic()
+            try:
+                return await f(request)
+            finally:
+                await lane.release(time.monotonic() - start)
+
+        return decorated
+
+    return decorator
+
+
+async def read_json(request):
+    try:
+        return await request.json()
+    except Exception:
+        return {}
+
+
+# ==================== API ROUTES ====================
+
+@token_required
+@admit('inference')
+async def predict(request):
+    """Predict disease from uploaded image"""
+    form = await request.form()
+    if 'image' not in form:
+        return error('No image provided', 400)
+
+    file = form['image']
+    patient_data = form.get('patient_data', '{}')
+
+    try:
+        user_id = request.state.user['user_id']
+        image_bytes = await file.read()
+        print(f"🔬 Starting diagnosis for user {user_id}: {len(image_bytes)} bytes")
+
+        loop = asyncio.get_running_loop()
+        disease, confidence, gradcam_image = await loop.run_in_executor(
+            inference_executor, run_diagnosis, image_bytes
+        )
+
+        patient = json.loads(patient_data)
+        timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+        image_url = None
+
+        try:
+            supabase = await get_async_supabase_client()
+            response = await supabase.table('records').insert(
+                build_diagnosis_record(user_id, patient, disease, confidence, image_url, timestamp)
+            ).execute()
+            diagnosis_id = str(response.data[0]['id']) if response.data else 'unknown'
+            print(f"✅ Saved to database with ID: {diagnosis_id}")
+            await loop.run_in_executor(None, retain_scan, diagnosis_id, image_bytes)
+        except Exception as db_error:
+            print(f"❌ Database error: {str(db_error)}")
+            diagnosis_id = 'temp-' + timestamp
+
+        return JSONResponse(build_diagnosis_result(diagnosis_id, disease, confidence, gradcam_image, image_url))
+
+    except Exception as e:
+        print(f"❌ ERROR in predict: {str(e)}")
+        return error(f'Analysis failed: {str(e)}', 500)
+
+
+@token_required
+@admit('read')
+async def get_history(request):
+    """Get diagnosis history for authenticated user"""
+    try:
+        user_id = request.state.user['user_id']
+        supabase = await get_async_supabase_client()
+        response = await supabase.table('records').select('*').eq('user_id', user_id).order('timestamp', desc=True).limit(100).execute()
+        return JSONResponse(format_history(response.data))
+    except Exception as e:
+        print(f"❌ Error fetching history: {str(e)}")
+        return error(str(e), 500)
+
+
+@token_required
+@admit('read')
+async def get_patients(request):
+    """Get all patients for authenticated user"""
+    try:
+        user_id = request.state.user['user_id']
+        supabase = await get_async_supabase_client()
+        response = await supabase.table('records').select('*').eq('user_id', user_id).order('timestamp', desc=True).execute()
+        return JSONResponse({'patients': summarize_patients(response.data)})
+    except Exception as e:
+        print(f"❌ Error fetching patients: {str(e)}")
+        return error(str(e), 500)
+
+
+@token_required
+async def create_patient(request):
+    """Create a new patient record"""
+    try:
+        data = await read_json(request)
+        user_id = request.state.user['user_id']
+
+        if not data.get('name'):
+            return error('Patient name is required', 400)
+
+        patient_id = data.get('id') or f"P{datetime.datetime.now().strftime('%Y%m%d%H%M%S')}"
+
+        supabase = await get_async_supabase_client()
+        await supabase.table('records').insert({
+            'user_id': user_id,
+            'patient_name': data.get('name'),
+            'patient_id': patient_id,
+            'age': int(data.get('age', 0)),
+            'sex': data.get('gender', 'Unknown'),
+            'physician': data.get('physician', 'Dr. AI'),
+            'diagnosis': 'Initial Registration',
+            'confidence': 0,
+            'timestamp': datetime.datetime.now().isoformat()
+        }).execute()
+
+        return JSONResponse({
+            'message': 'Patient created successfully',
+            'patient': {
+                'id': patient_id,
+                'name': data.get('name'),
+                'age': int(data.get('age', 0)),
+                'gender': data.get('gender', 'Unknown')
+            }
+        }, status_code=201)
+
+    except Exception as e:
+        print(f"❌ Error creating patient: {str(e)}")
+        return error(str(e), 500)
+
+
+@token_required
+async def delete_patient(request):
+    """Delete a patient and all their records"""
+    try:
+        patient_id = request.path_params['patient_id']
+        user_id = request.state.user['user_id']
+        supabase = await get_async_supabase_client()
+        await supabase.table('records').delete().eq('user_id', user_id).eq('patient_id', patient_id).execute()
+        return JSONResponse({'message': 'Patient deleted successfully'})
+    except Exception as e:
+        print(f"❌ Error deleting patient: {str(e)}")
+        return error(str(e), 500)
+
+
+@token_required
+async def update_patient(request):
+    """Update a patient's information"""
+    try:
+        patient_id = request.path_params['patient_id']
+        data = await read_json(request)
+        user_id = request.state.user['user_id']
+
+        update_data = {}
+        if data.get('name'):
+            update_data['patient_name'] = data.get('name')
+        if data.get('age'):
+            update_data['age'] = int(data.get('age'))
+        if data.get('gender'):
+            update_data['sex'] = data.get('gender')
+
+        if update_data:
+            supabase = await get_async_supabase_client()
+            await supabase.table('records').update(update_data).eq('user_id', user_id).eq('patient_id', patient_id).execute()
+
+        return JSONResponse({
+            'message': 'Patient updated successfully',
+            'patient': {
+                'id': patient_id,
+                'name': data.get('name'),
+                'age': int(data.get('age', 0)),
+                'gender': data.get('gender', 'Unknown')
+            }
+        })
+
+    except Exception as e:
+        print(f"❌ Error updating patient: {str(e)}")
+        return error(str(e), 500)
+
+
+async def login(request):
+    """User login with custom JWT authentication"""
+    data = await read_json(request)
+    email = data.get('email')
+    password = data.get('password')
+
+    if not email or not password:
+        return error('Email and password required', 400)
+
+    try:
+        supabase = await get_async_supabase_client()
+        response = await supabase.table('users').select('*').eq('email', email).execute()
+        user = response.data[0] if response.data else None
+
+        if user and verify_password(password, user['password_hash']):
+            token = generate_token(user['id'], user['email'], user['role'])
+            return JSONResponse({
+                'token': token,
+                'user': {
+                    'id': str(user['id']),
+                    'name': user['name'],
+                    'email': user['email'],
+                    'role': user['role']
+                }
+            })
+        return error('Invalid email or password', 401)
+
+    except Exception as e:
+        print(f"❌ Login error: {str(e)}")
+        return error('Login failed. Please try again.', 500)
+
+
+async def signup(request):
+    """User signup with custom JWT authentication"""
+    data = await read_json(request)
+    password = data.get('password')
+    name = data.get('name')
+    email = data.get('email')
+
+    if not all([password, name, email]):
+        return error('All fields are required', 400)
+
+    if not validate_email(email):
+        return error('Invalid email format', 400)
+
+    is_valid, message = validate_password(password)
+    if not is_valid:
+        return error(message, 400)
+
+    try:
+        supabase = await get_async_supabase_client()
+        existing = await supabase.table('users').select('id').eq('email', email).execute()
+        if existing.data:
+            return error('Email already registered', 409)
+
+        response = await supabase.table('users').insert({
+            'username': email,
+            'password_hash': hash_password(password),
+            'name': name,
+            'email': email,
+            'role': 'doctor'
+        }).execute()
+
+        user = response.data[0]
+        token = generate_token(user['id'], user['email'], user['role'])
+
+        return JSONResponse({
+            'token': token,
+            'user': {
+                'id': str(user['id']),
+                'name': user['name'],
+                'email': user['email'],
+                'role': user['role']
+            }
+        }, status_code=201)
+
+    except Exception as e:
+        print(f"⚠️ Signup error: {str(e)}")
+        return error('Failed to create account. Please try again.', 500)
+
+
+@token_required
+@admit('read')
+async def get_current_user(request):
+    """Get current user info from custom JWT token"""
+    try:
+        user_id = request.state.user['user_id']
+        supabase = await get_async_supabase_client()
+        response = await supabase.table('users').select('id, name, email, role').eq('id', user_id).execute()
+
+        if response.data:
+            user = response.data[0]
+            return JSONResponse({
+                'user': {
+                    'id': str(user['id']),
+                    'name': user['name'],
+                    'email': user['email'],
+                    'role': user['role']
+                }
+            })
+        return error('User not found', 404)
+
+    except Exception as e:
+        print(f"❌ Error getting user: {str(e)}")
+        return error('Failed to get user info', 500)
+
+
+async def logout(request):
+    """Logout endpoint (client-side token removal)"""
+    return JSONResponse({'message': 'Logged out successfully'})
+
+
+@token_required
+@admit('llm')
+async def generate_prescription(request):
+    """Generate AI-powered prescription using Gemini"""
+    try:
+        data = await read_json(request)
+        disease = data.get('disease', 'Unknown')
+        key, clinical_info = normalize_prescription_request(data)
+
+        cached = lookup_prescription(key)
+        if cached is not None:
+            return JSONResponse({'prescription': cached})
+
+        if not GEMINI_AVAILABLE or not api_server.gemini_model:
+            return JSONResponse({
+                'prescription': get_fallback_prescription(disease, "Gemini AI not configured")
+            })
+
+        prompt = build_prompt_for_key(key, clinical_info)
+
+        try:
+            prescription_data, model_name = await api_server.llm_client.generate(prompt, parse=parse_prescription_response)
+            prescription_cache.put(key, prescription_data)
+            return JSONResponse({'prescription': prescription_data})
+        except LLMError as llm_error:
+            print(f"❌ Gemini prescription failed: {llm_error}")
+            return JSONResponse({'prescription': get_fallback_prescription(disease, str(llm_error))})
+
+    except Exception as e:
+        print(f"❌ Prescription generation error: {str(e)}")
+        return JSONResponse({'prescription': get_fallback_prescription("Unknown", str(e))})
+
+
+SSE_HEADERS = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+
+
+@token_required
+async def stream_prescription(request):
+    """Stream an AI-powered prescription as server-sent events"""
+    data = await read_json(request)
+    disease = data.get('disease', 'Unknown')
+    key, clinical_info = normalize_prescription_request(data)
+    stream = PrescriptionStream(key, disease)
+
+    cached = lookup_prescription(key)
+    if cached is not None:
+        return StreamingResponse(iter(stream.from_memory(cached)), media_type='text/event-stream', headers=SSE_HEADERS)
+
+    if not GEMINI_AVAILABLE or not api_server.gemini_model:
+        events = [stream.start('fallback')] + stream.fail("Gemini AI not configured")
+        return StreamingResponse(iter(events), media_type='text/event-stream', headers=SSE_HEADERS)
+
+    # Released when the stream ends, when the response finishes (covers a client that
+    # disconnects before the generator starts) or on setup errors; only the first call counts
+    lane = ASYNC_LANES['llm']
+    try:
+        await lane.acquire()
+    except Overloaded as e:
+        return overloaded_response(e)
+    release = lane.releaser()
+
+    try:
+        prompt = build_prompt_for_key(key, clinical_info)
+
+        async def generate():
+            try:
+                yield stream.start('llm')
+                model_name = None
+                try:
+                    async for model_name, chunk in api_server.llm_client.stream(prompt):
+                        for event in stream.on_chunk(chunk):
+                            yield event
+                except LLMError as llm_error:
+                    for event in stream.fail(str(llm_error)):
+                        yield event
+                    return
+                for event in stream.finish(model_name):
+                    yield event
+            finally:
+                await release()
+
+        return StreamingResponse(generate(), media_type='text/event-stream', headers=SSE_HEADERS,
+                                 background=BackgroundTask(release))
+    except BaseException:
+        await release()
+        raise
+
+
+# Longest a client may ask to wait for a report before falling back to polling
+REPORT_MAX_WAIT = float(os.environ.get('REPORT_MAX_WAIT', 30))
+
+
+async def wait_for_report(job, timeout):
+    """Await job completion without tying up a thread"""
+    if job.finished or timeout <= 0:
+        return
+    loop = asyncio.get_running_loop()
+    done = loop.create_future()
+    job.add_done_callback(lambda _: loop.call_soon_threadsafe(
+        lambda: done.done() or done.set_result(None)))
+    try:
+        await asyncio.wait_for(done, timeout=min(timeout, REPORT_MAX_WAIT))
+    except asyncio.TimeoutError:
+        pass
+
+
+def report_status_response(job):
+    if job.status == FAILED:
+        return JSONResponse(report_status_body(job), status_code=500)
+    if job.status != DONE:
+        return JSONResponse(report_status_body(job), status_code=202, headers={'Retry-After': '1'})
+    return JSONResponse(report_status_body(job))
+
+
+def requested_wait(request, data=None):
+    try:
+        return float(request.query_params.get('wait') or (data or {}).get('wait') or 0)
+    except ValueError:
+        return 0
+
+
+@token_required
+@admit('read')
+async def generate_report(request):
+    """Queue a PDF report for a diagnosis; optional wait (seconds) awaits completion"""
+    data = await read_json(request)
+    diagnosis_id = data.get('diagnosis_id')
+    if not diagnosis_id:
+        return error('diagnosis_id is required', 400)
+
+    user_id = request.state.user['user_id']
+    try:
+        supabase = await get_async_supabase_client()
+        response = await supabase.table('records').select('*').eq('id', diagnosis_id).eq('user_id', user_id).limit(1).execute()
+    except Exception as e:
+        print(f"❌ Error loading diagnosis for report: {str(e)}")
+        return error(str(e), 500)
+    if not response.data:
+        return error('Diagnosis not found', 404)
+
+    job = report_service.submit(response.data[0], user_id)
+    await wait_for_report(job, requested_wait(request, data))
+    return report_status_response(job)
+
+
+@token_required
+async def get_report_status(request):
+    """Current state of a report job; ?wait=<seconds> long-polls"""
+    job = report_service.get(request.path_params['report_id'])
+    if job is None or job.user_id != request.state.user['user_id']:
+        return error('Report not found', 404)
+    await wait_for_report(job, requested_wait(request))
+    return report_status_response(job)
+
+
+@token_required
+async def download_report(request):
+    """Stream a finished report from the store (ETag aware)"""
+    job = report_service.get(request.path_params['report_id'])
+    if job is None or job.user_id != request.state.user['user_id']:
+        return error('Report not found', 404)
+    await wait_for_report(job, requested_wait(request))
+    if job.status != DONE:
+        return report_status_response(job)
+
+    etag = f'"{job.digest}"'
+    headers = {'ETag': etag, 'Cache-Control': 'private, max-age=3600'}
+    if request.headers.get('if-none-match') == etag:
+        return Response(status_code=304, headers=headers)
+    return FileResponse(
+        report_service.store.blob_path(job.digest),
+        media_type='application/pdf',
+        filename=job.filename,
+        headers=headers
+    )
+
+
+@token_required
+async def export_reports(request):
+    """Stream a zip of reports for ?from=&to=&physician=&diagnosis= as they render"""
+    try:
+        filters = parse_export_filters(request.query_params)
+    except ValueError:
+        return error('from/to must be YYYY-MM-DD', 400)
+
+    # One export at a time; the slot is released once the response is done or on setup errors
+    lane = ASYNC_LANES['export']
+    try:
+        await lane.acquire()
+    except Overloaded as e:
+        return overloaded_response(e)
+    release = lane.releaser()
+
+    try:
+        user_id = request.state.user['user_id']
+        print(f"📦 Bulk export for user {user_id}: {filters}")
+        # Sync generator: Starlette iterates it in its threadpool, off the event loop
+        return StreamingResponse(
+            iter_report_zip(iter_export_records(user_id, filters), load_scan=export_scan),
+            media_type='application/zip',
+            headers={
+                'Content-Disposition': f'attachment; filename="{export_filename(filters)}"',
+                'Cache-Control': 'no-store'
+            },
+            background=BackgroundTask(release)
+        )
+    except BaseException:
+        await release()
+        raise
+
+
+@token_required
+async def get_clinical_info(request):
+    """Clinical reference for a disease class (in-memory, no network)"""
+    disease = request.path_params['disease']
+    return JSONResponse({
+        'disease': disease,
+        'pack_version': get_knowledge_pack().version,
+        **clinical_reference(disease)
+    })
+
+
+async def health(request):
+    """Health check endpoint"""
+    return JSONResponse({
+        'status': 'healthy',
+        'model_loaded': api_server.model is not None,
+        'model_runtime': api_server.model_runtime(),
+        'gemini_available': GEMINI_AVAILABLE,
+        'admission': {name: lane.snapshot() for name, lane in ASYNC_LANES.items()},
+        'prescription_cache': prescription_cache.stats(),
+        'llm': api_server.llm_client.stats(),
+        'knowledge_pack': get_knowledge_pack().version,
+        'reports': report_service.stats(),
+        'serving_mode': 'asgi',
+        'timestamp': datetime.datetime.now().isoformat()
+    })
+
+
+routes = [
+    Route('/api/diagnosis/predict', predict, methods=['POST']),
+    Route('/api/diagnosis/history', get_history, methods=['GET']),
+    Route('/api/patients', get_patients, methods=['GET']),
+    Route('/api/patients', create_patient, methods=['POST']),
+    Route('/api/patients/{patient_id}', delete_patient, methods=['DELETE']),
+    Route('/api/patients/{patient_id}', update_patient, methods=['PUT']),
+    Route('/api/auth/login', login, methods=['POST']),
+    Route('/api/auth/signup', signup, methods=['POST']),
+    Route('/api/auth/me', get_current_user, methods=['GET']),
+    Route('/api/auth/logout', logout, methods=['POST']),
+    Route('/api/prescription/generate', generate_prescription, methods=['POST']),
+    Route('/api/prescription/stream', stream_prescription, methods=['POST']),
+    Route('/api/reports/generate', generate_report, methods=['POST']),
+    Route('/api/reports/export', export_reports, methods=['GET']),
+    Route('/api/reports/download/{report_id}', download_report, methods=['GET']),
+    Route('/api/reports/{report_id}', get_report_status, methods=['GET']),
+    Route('/api/clinical-info/{disease}', get_clinical_info, methods=['GET']),
+    Route('/api/health', health, methods=['GET']),
+]
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    # Starlette 1.x dropped on_startup/on_shutdown; lifespan works on 0.37+ as well
+    yield
+    inference_executor.shutdown(wait=False)
+    report_service.shutdown()
+
+
+app = Starlette(
+    routes=routes,
+    middleware=[Middleware(CORSMiddleware, allow_origins=['*'], allow_methods=['*'], allow_headers=['*'])],
+    lifespan=lifespan
+)
+
+if __name__ == '__main__':
+    import uvicorn
+    print("🚀 Starting ASGI API server...")
+    uvicorn.run(app, host='0.0.0.0', port=int(os.environ.get('FLASK_PORT', 5000)))
@@ -0,0 +1,149 @@
+"""
+Concurrency benchmark: sync (gunicorn/Flask) vs async (uvicorn/ASGI) serving.
+
+Start both deployments against the same backend, e.g.
+    cd new && gunicorn api_server:app --workers 1 --threads 8 --bind :5000
+    cd new && uvicorn asgi_server:app --workers 1 --port 5001
+
+then fire the same mixed load at each:
+    python bench_concurrency.py --token <JWT> \
+        --target sync=http://localhost:5000 --target async=http://localhost:5001 \
+        --concurrency 16 --requests 200
+
+Each virtual client loops over the workload (history reads plus prescription
+generations by default) and the report shows throughput and latency
+percentiles per endpoint, so the two serving modes can be compared directly.
+
+Prescription requests carry a distinct clinical history each by default, so
+they miss the baseline table and the response cache and exercise the LLM
+lane. --prescription-context fixed sends one history (LLM once, then cache
+hits), none sends an empty one (baseline answers only).
+"""
+import argparse
+import json
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+PRESCRIPTION_BODY = {
+    'disease': 'Pneumonia',
+    'confidence': 91.5,
+    'patient_name': 'Benchmark Patient',
+    'patient_age': 54,
+    'patient_gender': 'Female',
+    'clinical_info': ''
+}
+
+CLINICAL_INFO = "Productive cough and fever of 38.5C for {days} days, no known drug allergies."
+
+WORKLOADS = {
+    'history': ('GET', '/api/diagnosis/history', None),
+    'patients': ('GET', '/api/patients', None),
+    'prescription': ('POST', '/api/prescription/generate', PRESCRIPTION_BODY),
+    'health': ('GET', '/api/health', None),
+}
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    k = min(len(values) - 1, int(round(pct / 100.0 * (len(values) - 1))))
+    return values[k]
+
+
+def call(base_url, token, method, path, body, timeout):
+    data = json.dumps(body).encode() if body is not None else None
+    req = urllib.request.Request(base_url.rstrip('/') + path, data=data, method=method)
+    req.add_header('Authorization', f'Bearer {token}')
+    if data is not None:
+        req.add_header('Content-Type', 'application/json')
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as resp:
+            resp.read()
+            status = resp.status
+    except urllib.error.HTTPError as e:
+        status = e.code
+    except Exception:
+        status = 0
+    return status, time.perf_counter() - start
+
+
+def request_body(label, body, i, context_mode):
+    """Workload body for request i; prescription bodies get the clinical history for context_mode"""
+    if label != 'prescription' or context_mode == 'none':
+        return body
+    days = i + 1 if context_mode == 'unique' else 3
+    return dict(body, clinical_info=CLINICAL_INFO.format(days=days))
+
+
+def run_target(name, base_url, args):
+    mix = [WORKLOADS[w] + (w,) for w in args.workload]
+    counter = {'next': 0}
+    lock = threading.Lock()
+    samples = {w: [] for w in args.workload}
+    statuses = {}
+
+    def client():
+        while True:
+            with lock:
+                i = counter['next']
+                if i >= args.requests:
+                    return
+                counter['next'] += 1
+            method, path, body, label = mix[i % len(mix)]
+            body = request_body(label, body, i, args.prescription_context)
+            status, elapsed = call(base_url, args.token, method, path, body, args.timeout)
+            with lock:
+                statuses[status] = statuses.get(status, 0) + 1
+                if status == 200:
+                    samples[label].append(elapsed)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        for _ in range(args.concurrency):
+            pool.submit(client)
+    wall = time.perf_counter() - start
+
+    ok = sum(len(v) for v in samples.values())
+    print(f"\n=== {name} ({base_url}) ===")
+    print(f"concurrency={args.concurrency} requests={args.requests} wall={wall:.2f}s "
+          f"ok={ok} throughput={ok / wall:.2f} req/s statuses={statuses}")
+    print(f"{'endpoint':<14}{'n':>6}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for label, values in samples.items():
+        print(f"{label:<14}{len(values):>6}"
+              f"{percentile(values, 50) * 1000:>10.1f}"
+              f"{percentile(values, 95) * 1000:>10.1f}"
+              f"{percentile(values, 99) * 1000:>10.1f}")
+    return {'target': name, 'wall_s': wall, 'ok': ok, 'throughput': ok / wall, 'statuses': statuses}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare sync and async API deployments under concurrent load")
+    parser.add_argument('--target', action='append', required=True,
+                        help="name=base_url, repeat for each deployment")
+    parser.add_argument('--token', required=True, help="JWT used for authenticated routes")
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--timeout', type=float, default=120)
+    parser.add_argument('--workload', nargs='+', default=['history', 'prescription'],
+                        choices=sorted(WORKLOADS))
+    parser.add_argument('--prescription-context', choices=['unique', 'fixed', 'none'], default='unique',
+                        help="unique: LLM on every prescription, fixed: LLM once then cache, none: baseline only")
+    args = parser.parse_args()
+
+    results = []
+    for target in args.target:
+        name, _, base_url = target.partition('=')
+        results.append(run_target(name, base_url, args))
+
+    print("\n=== Summary ===")
+    for r in results:
+        print(f"{r['target']:<10} {r['throughput']:>8.2f} req/s  ok={r['ok']}  wall={r['wall_s']:.2f}s")
+
+
+if __name__ == '__main__':
+    main()
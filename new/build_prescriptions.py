@@ -0,0 +1,119 @@
+"""
+Build step: precompute validated baseline prescriptions for every DISEASE_MAP
+class and every (age band, sex, confidence band) in the build grid.
+
+    python build_prescriptions.py                 # ask Gemini, fall back per entry
+    python build_prescriptions.py --offline       # static fallback table only
+    python build_prescriptions.py --age-bands "child (1-12)" "adult (18-39)" --confidence-bands 70-90
+
+The output (data/prescription_baselines.json by default) is loaded by
+prescriptions.py at API startup, so the common prescription request is
+answered from memory instead of a multi-second LLM call. Requests whose bands
+are outside the grid go to the LLM. Entries the LLM could not produce are
+recorded with source "fallback" and are not served, so those keys still go
+to the LLM; --offline builds such a file only for inspection.
+"""
+import argparse
+import datetime
+import itertools
+import json
+import os
+import time
+
+from disease_mapper import DISEASE_MAP
+from prescriptions import (
+    AGE_BANDS, BASELINE_FORMAT, BASELINE_PATH, CONFIDENCE_BANDS, PRESCRIPTION_MODELS, PrescriptionKey,
+    baseline_id, build_prompt_for_key, parse_prescription_response, build_fallback_prescription,
+    validate_prescription
+)
+
+BASELINE_VERSION = BASELINE_FORMAT
+
+# Default grid: the profiles most prescription requests fall into
+DEFAULT_AGE_BANDS = ['adult (18-39)', 'adult (40-64)']
+DEFAULT_SEXES = ['female', 'male', 'unknown']
+DEFAULT_CONFIDENCE_BANDS = ['70-90', '90-100']
+
+BASELINE_CLINICAL_INFO = "No further clinical history provided."
+
+
+def generate_with_gemini(key, models, retries):
+    import google.generativeai as genai
+    genai.configure(api_key=os.environ['GEMINI_API_KEY'])
+
+    prompt = build_prompt_for_key(key, BASELINE_CLINICAL_INFO)
+    last_error = None
+    for attempt in range(retries):
+        for model_name in models:
+            try:
+                response = genai.GenerativeModel(model_name).generate_content(prompt)
+                prescription = parse_prescription_response(response.text, model_name)
+                prescription['generated_by'] = f'Precomputed baseline (Gemini AI {model_name})'
+                return prescription, None
+            except Exception as e:
+                last_error = str(e)
+        time.sleep(2 ** attempt)
+    return None, last_error
+
+
+def build(output, offline, models, retries, age_bands=DEFAULT_AGE_BANDS, sexes=DEFAULT_SEXES,
+          confidence_bands=DEFAULT_CONFIDENCE_BANDS):
+    use_llm = not offline
+    if use_llm and not os.environ.get('GEMINI_API_KEY'):
+        raise RuntimeError("GEMINI_API_KEY not set; pass --offline to build from the static fallback table")
+
+    entries = {}
+    sources = {'llm': 0, 'fallback': 0}
+    for class_idx in sorted(DISEASE_MAP):
+        disease = DISEASE_MAP[class_idx]
+        for age, sex, confidence in itertools.product(age_bands, sexes, confidence_bands):
+            key = PrescriptionKey(disease, age, sex, confidence, '')
+            prescription = None
+            if use_llm:
+                prescription, error = generate_with_gemini(key, models, retries)
+                if prescription is None:
+                    print(f"⚠️ {baseline_id(key)}: LLM failed ({(error or '')[:80]}), using fallback")
+            source = 'llm'
+            if prescription is None:
+                prescription = build_fallback_prescription(disease)
+                source = 'fallback'
+            sources[source] += 1
+
+            problems = validate_prescription(prescription)
+            if problems:
+                raise ValueError(f"Baseline for {baseline_id(key)} failed validation: {problems}")
+            entries[baseline_id(key)] = {'source': source, 'prescription': prescription}
+        print(f"✅ [{class_idx:02d}] {disease}")
+
+    payload = {
+        'version': BASELINE_VERSION,
+        'generated_at': datetime.datetime.now().isoformat(),
+        'models': models if use_llm else [],
+        'grid': {'age_bands': age_bands, 'sexes': sexes, 'confidence_bands': confidence_bands},
+        'entries': entries
+    }
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    tmp_path = output + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(payload, f, indent=2, ensure_ascii=False)
+    os.replace(tmp_path, output)
+
+    print(f"\n📦 Wrote {len(entries)} baselines to {output} "
+          f"({sources['llm']} from Gemini, {sources['fallback']} from fallback table, not served)")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Precompute baseline prescriptions for all disease classes")
+    parser.add_argument('--output', default=BASELINE_PATH)
+    parser.add_argument('--offline', action='store_true', help="Do not call Gemini, use the static fallback table")
+    parser.add_argument('--models', nargs='+', default=PRESCRIPTION_MODELS)
+    parser.add_argument('--retries', type=int, default=2)
+    parser.add_argument('--age-bands', nargs='+', default=DEFAULT_AGE_BANDS, choices=[b for _, b in AGE_BANDS])
+    parser.add_argument('--sexes', nargs='+', default=DEFAULT_SEXES, choices=['female', 'male', 'other', 'unknown'])
+    parser.add_argument('--confidence-bands', nargs='+', default=DEFAULT_CONFIDENCE_BANDS,
+                        choices=[b for _, b in CONFIDENCE_BANDS])
+    args = parser.parse_args()
+    if not args.offline and not os.environ.get('GEMINI_API_KEY'):
+        parser.error("GEMINI_API_KEY is not set; pass --offline to build from the static fallback table")
+
+    build(args.output, args.offline, args.models, args.retries, args.age_bands, args.sexes, args.confidence_bands)
@@ -0,0 +1,114 @@
+"""
+Bulk report export: many diagnosis records -> one streamed zip of PDFs.
+
+Reports are rendered in a process pool (ReportLab and JPEG encoding are
+CPU-bound and hold the GIL) and written into the zip as each one finishes,
+so the first bytes reach the client while later reports are still rendering.
+At most EXPORT_WINDOW renders are in flight and every finished PDF is
+flushed out of the zip buffer immediately, which keeps memory flat no matter
+how many records match the filter.
+"""
+import csv
+import io
+import multiprocessing
+import os
+import threading
+import zipfile
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from reports import build_report_pdf, report_filename
+
+EXPORT_WORKERS = int(os.environ.get("EXPORT_WORKERS", max(1, (os.cpu_count() or 2) - 1)))
+EXPORT_WINDOW = int(os.environ.get("EXPORT_WINDOW", EXPORT_WORKERS * 2))
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """Shared render pool; spawned (not forked) so children don't inherit TensorFlow or server threads"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=EXPORT_WORKERS,
+                                        mp_context=multiprocessing.get_context("spawn"))
+        return _pool
+
+
+class _ZipSink:
+    """Write-only file object the zip is written into; drained after every entry"""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def _flush(sink):
+    # An empty chunk would end a chunked HTTP response early
+    data = sink.drain()
+    if data:
+        yield data
+
+
+def export_entry_name(record):
+    date = str(record.get("timestamp") or "")[:10] or "undated"
+    return f"{date}/{record.get('id')}_{report_filename(record)}"
+
+
+def iter_report_zip(records, load_scan=None, pool=None, window=EXPORT_WINDOW):
+    """Yield zip bytes for the reports of `records` (any iterable, consumed lazily)"""
+    pool = pool or get_pool()
+    sink = _ZipSink()
+    archive = zipfile.ZipFile(sink, "w", compression=zipfile.ZIP_STORED)
+    manifest = [("diagnosis_id", "patient_id", "patient_name", "physician", "diagnosis", "timestamp", "file", "status")]
+    pending = {}
+
+    def collect(futures):
+        for future in futures:
+            record = pending.pop(future)
+            row = [record.get(k) for k in ("id", "patient_id", "patient_name", "physician", "diagnosis", "timestamp")]
+            try:
+                pdf = future.result()
+            except Exception as e:
+                print(f"❌ Export render failed for {record.get('id')}: {e}")
+                manifest.append((*row, "", f"failed: {e}"))
+                continue
+            name = export_entry_name(record)
+            archive.writestr(name, pdf)
+            manifest.append((*row, name, "ok"))
+
+    try:
+        for record in records:
+            while len(pending) >= window:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                collect(done)
+                yield from _flush(sink)
+            scan = load_scan(record) if load_scan else None
+            pending[pool.submit(build_report_pdf, record, scan)] = record
+
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            collect(done)
+            yield from _flush(sink)
+
+        index = io.StringIO()
+        csv.writer(index).writerows(manifest)
+        archive.writestr("manifest.csv", index.getvalue())
+        archive.close()
+        yield from _flush(sink)
+        print(f"📦 Export finished: {len(manifest) - 1} reports")
+    finally:
+        # Client went away (or an error): don't keep rendering for nobody
+        for future in pending:
+            future.cancel()
@@ -1,55 +1,304 @@
+import os
+import queue
 import sqlite3
+import threading
+import weakref
 import pandas as pd
-from datetime import datetime
+from datetime import datetime, date, timedelta
+
+DB_FILE = os.environ.get("RADIOLOGY_DB", "radiology_app.db")
+
+# WAL lets the history view read while a diagnosis is being written;
+# NORMAL sync is durable across application crashes in WAL mode.
+PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA busy_timeout=5000",
+    "PRAGMA cache_size=-32000",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA mmap_size=268435456",
+    "PRAGMA foreign_keys=ON",
+)
+
+# Schema history; PRAGMA user_version records how far a database has been migrated
+MIGRATIONS = [
+    (1, [
+        '''CREATE TABLE IF NOT EXISTS records (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                patient_name TEXT,
+                patient_id TEXT,
+                age INTEGER,
+                sex TEXT,
+                physician TEXT,
+                diagnosis TEXT,
+                confidence REAL,
+                timestamp TEXT
+            )''',
+        # Table for Users (Optional: You can migrate your USERS dict here)
+        '''CREATE TABLE IF NOT EXISTS users (
+                username TEXT PRIMARY KEY,
+                password TEXT
+            )''',
+    ]),
+    (2, [
+        "CREATE INDEX IF NOT EXISTS idx_records_timestamp ON records(timestamp)",
+        "CREATE INDEX IF NOT EXISTS idx_records_patient_id ON records(patient_id, timestamp)",
+        "CREATE INDEX IF NOT EXISTS idx_records_physician ON records(physician, timestamp)",
+        "CREATE INDEX IF NOT EXISTS idx_records_diagnosis ON records(diagnosis, timestamp)",
+    ]),
+    (3, [
+        # External-content FTS5 index over the searchable columns; '-' and '_'
+        # stay inside tokens so IDs like MRN-10293 are searchable by prefix
+        '''CREATE VIRTUAL TABLE IF NOT EXISTS records_fts USING fts5(
+                patient_name, patient_id, physician, diagnosis,
+                content='records', content_rowid='id',
+                tokenize="unicode61 tokenchars '-_'", prefix='2 3'
+            )''',
+        '''CREATE TRIGGER IF NOT EXISTS records_fts_insert AFTER INSERT ON records BEGIN
+                INSERT INTO records_fts(rowid, patient_name, patient_id, physician, diagnosis)
+                VALUES (new.id, new.patient_name, new.patient_id, new.physician, new.diagnosis);
+            END''',
+        '''CREATE TRIGGER IF NOT EXISTS records_fts_delete AFTER DELETE ON records BEGIN
+                INSERT INTO records_fts(records_fts, rowid, patient_name, patient_id, physician, diagnosis)
+                VALUES ('delete', old.id, old.patient_name, old.patient_id, old.physician, old.diagnosis);
+            END''',
+        '''CREATE TRIGGER IF NOT EXISTS records_fts_update AFTER UPDATE ON records BEGIN
+                INSERT INTO records_fts(records_fts, rowid, patient_name, patient_id, physician, diagnosis)
+                VALUES ('delete', old.id, old.patient_name, old.patient_id, old.physician, old.diagnosis);
+                INSERT INTO records_fts(rowid, patient_name, patient_id, physician, diagnosis)
+                VALUES (new.id, new.patient_name, new.patient_id, new.physician, new.diagnosis);
+            END''',
+        # Index rows that existed before the migration
+        "INSERT INTO records_fts(records_fts) VALUES ('rebuild')",
+    ]),
+]
+
+RECORD_COLUMNS = ("id", "patient_name", "patient_id", "age", "sex", "physician", "diagnosis", "confidence", "timestamp")
+
+_local = threading.local()
+# Connections handed back by finished threads, as (path, connection)
+_idle = queue.SimpleQueue()
+
+
+class _Lease:
+    """Thread-local handle on a connection; the connection goes back to _idle when the thread ends"""
+
+    def __init__(self, conn, path):
+        self.conn, self.path = conn, path
+        weakref.finalize(self, _idle.put, (path, conn))
+
+
+def _checkout(path):
+    """An idle connection to path, or a new one"""
+    while True:
+        try:
+            idle_path, conn = _idle.get_nowait()
+        except queue.Empty:
+            break
+        if idle_path == path:
+            if conn.in_transaction:
+                conn.rollback()
+            return conn
+        conn.close()
+    # Handed between threads through _idle, but only ever used by one thread at a time
+    conn = sqlite3.connect(path, check_same_thread=False)
+    conn.row_factory = sqlite3.Row
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+
+def get_connection():
+    """The calling thread's connection.
+
+    Streamlit runs every rerun on a new thread, so a connection is not kept
+    per thread but leased: when the thread finishes it returns to a pool and
+    the next rerun picks it up with its PRAGMAs and page cache intact.
+    """
+    lease = getattr(_local, "lease", None)
+    if lease is None or lease.path != DB_FILE:
+        lease = _local.lease = _Lease(_checkout(DB_FILE), DB_FILE)
+    return lease.conn
+
+
+def migrate(conn):
+    """Applies pending migrations, each in its own transaction."""
+    current = conn.execute("PRAGMA user_version").fetchone()[0]
+    for version, statements in MIGRATIONS:
+        if version <= current:
+            continue
+        with conn:
+            for statement in statements:
+                conn.execute(statement)
+            conn.execute(f"PRAGMA user_version={version}")
+        print(f"🗄️ Database migrated to schema v{version}")
+    return conn.execute("PRAGMA user_version").fetchone()[0]
 
-DB_FILE = "radiology_app.db"
 
 def init_db():
-    """Initializes the database and creates tables if they don't exist."""
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    
-    # Table for Patient Diagnosis History
-    c.execute('''CREATE TABLE IF NOT EXISTS records (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    patient_name TEXT,
-                    patient_id TEXT,
-                    age INTEGER,
-                    sex TEXT,
-                    physician TEXT,
-                    diagnosis TEXT,
-                    confidence REAL,
-                    timestamp TEXT
-                )''')
-    
-    # Table for Users (Optional: You can migrate your USERS dict here)
-    c.execute('''CREATE TABLE IF NOT EXISTS users (
-                    username TEXT PRIMARY KEY,
-                    password TEXT
-                )''')
-    
-    conn.commit()
-    conn.close()
+    """Initializes the database and brings the schema up to date."""
+    migrate(get_connection())
+
+
+INSERT_SQL = '''INSERT INTO records
+                 (patient_name, patient_id, age, sex, physician, diagnosis, confidence, timestamp)
+                 VALUES (?, ?, ?, ?, ?, ?, ?, ?)'''
+
+# Same insert, skipped when (patient_id, timestamp, diagnosis) already exists.
+# Served by idx_records_patient_id; a UNIQUE constraint would reject legitimate
+# same-second saves from the app, so dedupe stays opt-in per import.
+INSERT_NEW_SQL = '''INSERT INTO records
+                 (patient_name, patient_id, age, sex, physician, diagnosis, confidence, timestamp)
+                 SELECT ?, ?, ?, ?, ?, ?, ?, ?
+                 WHERE NOT EXISTS (SELECT 1 FROM records WHERE patient_id = ?2 AND timestamp = ?8 AND diagnosis = ?6)'''
+
 
 def save_prediction(patient_data, diagnosis, confidence):
-    """Saves a single diagnosis record to the database."""
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    c.execute('''INSERT INTO records 
-                 (patient_name, patient_id, age, sex, physician, diagnosis, confidence, timestamp) 
-                 VALUES (?, ?, ?, ?, ?, ?, ?, ?)''', 
-              (patient_data['name'], patient_data['id'], patient_data['age'], 
-               patient_data['sex'], patient_data['physician'], diagnosis, 
-               confidence, datetime.now().strftime("%Y-%m-%d %H:%M:%S")))
-    conn.commit()
-    conn.close()
+    """Saves a single diagnosis record to the database and returns its id."""
+    conn = get_connection()
+    with conn:
+        cursor = conn.execute(INSERT_SQL,
+                  (patient_data['name'], patient_data['id'], patient_data['age'],
+                   patient_data['sex'], patient_data['physician'], diagnosis,
+                   confidence, datetime.now().strftime("%Y-%m-%d %H:%M:%S")))
+    return cursor.lastrowid
+
+
+def _record_params(record):
+    return (record.get('patient_name'), record.get('patient_id'), record.get('age'),
+            record.get('sex'), record.get('physician'), record.get('diagnosis'),
+            record.get('confidence'),
+            record.get('timestamp') or datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+
+
+def save_predictions(records, chunk_size=5000, dedupe=False, on_chunk=None):
+    """Bulk insert of record dicts: one executemany and one commit per chunk.
+
+    Returns {'rows', 'inserted', 'skipped'}; on_chunk(stats) is called after each commit.
+    """
+    conn = get_connection()
+    sql = INSERT_NEW_SQL if dedupe else INSERT_SQL
+    stats = {'rows': 0, 'inserted': 0, 'skipped': 0}
+
+    def flush(chunk):
+        with conn:
+            cursor = conn.executemany(sql, chunk)
+        stats['rows'] += len(chunk)
+        stats['inserted'] += cursor.rowcount
+        stats['skipped'] = stats['rows'] - stats['inserted']
+        if on_chunk:
+            on_chunk(stats)
+
+    chunk = []
+    for record in records:
+        chunk.append(_record_params(record))
+        if len(chunk) >= chunk_size:
+            flush(chunk)
+            chunk = []
+    if chunk:
+        flush(chunk)
+    return stats
+
+
+def fts_query(text):
+    """FTS5 MATCH expression: every whitespace-separated term as a quoted prefix, all required."""
+    terms = [t.replace('"', '""') for t in text.split()]
+    return " ".join(f'"{t}"*' for t in terms)
+
+
+def search_records(text, limit=50, offset=0):
+    """Prefix search over patient name, patient ID, physician and diagnosis; newest first."""
+    return query_records({"search": text}, limit=limit, offset=offset)
+
+
+def _where(filters):
+    """WHERE clause and parameters for the supported record filters."""
+    clauses, params = [], []
+    filters = filters or {}
+    if filters.get("patient_id"):
+        clauses.append("patient_id = ?")
+        params.append(filters["patient_id"])
+    if filters.get("physician"):
+        clauses.append("physician = ?")
+        params.append(filters["physician"])
+    if filters.get("diagnosis"):
+        clauses.append("diagnosis = ?")
+        params.append(filters["diagnosis"])
+    if filters.get("date_from"):
+        clauses.append("timestamp >= ?")
+        params.append(str(filters["date_from"]))
+    if filters.get("date_to"):
+        # Inclusive end date: everything before the following midnight
+        end = filters["date_to"]
+        if isinstance(end, date):
+            end = end + timedelta(days=1)
+        clauses.append("timestamp < ?")
+        params.append(str(end))
+    if filters.get("search"):
+        match = fts_query(filters["search"])
+        if match:
+            clauses.append("id IN (SELECT rowid FROM records_fts WHERE records_fts MATCH ?)")
+            params.append(match)
+    return (" WHERE " + " AND ".join(clauses)) if clauses else "", params
+
+
+# Above this many search hits, walking the timestamp index beats sorting the hits
+FTS_SCAN_THRESHOLD = 20000
+
+
+def _fts_count(match):
+    return get_connection().execute(
+        "SELECT COUNT(*) FROM records_fts WHERE records_fts MATCH ?", (match,)
+    ).fetchone()[0]
+
+
+def count_records(filters=None):
+    """Number of records matching the filters."""
+    filters = filters or {}
+    if filters.get("search") and not any(v for k, v in filters.items() if k != "search"):
+        # Search only: the FTS index alone has the answer
+        match = fts_query(filters["search"])
+        if match:
+            return _fts_count(match)
+    where, params = _where(filters)
+    return get_connection().execute(f"SELECT COUNT(*) FROM records{where}", params).fetchone()[0]
+
+
+def query_records(filters=None, limit=50, offset=0):
+    """One page of matching records, newest first, as a DataFrame."""
+    where, params = _where(filters)
+    index_hint = ""
+    match = fts_query(filters["search"]) if filters and filters.get("search") else ""
+    if match and _fts_count(match) > FTS_SCAN_THRESHOLD:
+        index_hint = " INDEXED BY idx_records_timestamp"
+    sql = f"SELECT * FROM records{index_hint}{where} ORDER BY timestamp DESC, id DESC LIMIT ? OFFSET ?"
+    rows = get_connection().execute(sql, params + [limit, offset]).fetchall()
+    return pd.DataFrame([dict(r) for r in rows], columns=RECORD_COLUMNS)
+
+
+def iter_records(filters=None, batch_size=1000):
+    """Yields matching records as dicts, oldest first, without loading them all."""
+    where, params = _where(filters)
+    cursor = get_connection().execute(f"SELECT * FROM records{where} ORDER BY timestamp, id", params)
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            return
+        for row in rows:
+            yield dict(row)
+
+
+def distinct_values(column):
+    """Sorted distinct values of an indexed column (physician, diagnosis, patient_id)."""
+    if column not in ("physician", "diagnosis", "patient_id"):
+        raise ValueError(f"Unsupported column: {column}")
+    rows = get_connection().execute(f"SELECT DISTINCT {column} FROM records WHERE {column} IS NOT NULL ORDER BY {column}")
+    return [r[0] for r in rows]
+
 
 def get_all_records():
     """Returns all records as a Pandas DataFrame for easy viewing in Streamlit."""
-    conn = sqlite3.connect(DB_FILE)
-    df = pd.read_sql_query("SELECT * FROM records ORDER BY timestamp DESC", conn)
-    conn.close()
-    return df
+    return pd.read_sql_query("SELECT * FROM records ORDER BY timestamp DESC", get_connection())
 
 # Initialize the DB when this script is run or imported
-init_db()
\ No newline at end of file
+init_db()
@@ -0,0 +1,302 @@
+"""
+Compiled dataset shards: decode and resize a class-per-folder image dataset once.
+
+    python dataset_shards.py build dataset/train dataset_shards/train
+    python dataset_shards.py info dataset_shards/train
+
+A compiled directory holds fixed-size uint8 RGB image arrays in .npy shards
+(memory-mapped by the readers, so nothing is decoded at train or eval time),
+an index.npy label index in flow_from_directory order, and a manifest.json
+recording the source fingerprint (size, mtime) of every image. Rebuilding
+only decodes new or changed files; rows of deleted or changed files are
+dropped from the index and mostly-dead shards are compacted.
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+
+import numpy as np
+import tensorflow as tf
+
+from data_pipeline import (AUTOTUNE, DatasetInfo, batch_transform, benchmark, decode_image, finalize,
+                           list_image_files, split_files)
+
+FORMAT_VERSION = 1
+SHARD_SIZE = int(os.environ.get("SHARD_SIZE", 2048))  # images per shard (~300 MB at 224x224)
+MANIFEST = "manifest.json"
+INDEX = "index.npy"
+INDEX_DTYPE = np.dtype([("shard", "<u4"), ("row", "<u4"), ("label", "<i2")])
+
+
+def is_shard_dir(directory):
+    return os.path.isfile(os.path.join(directory, MANIFEST))
+
+
+def shard_name(shard_id):
+    return f"shard-{shard_id:05d}.npy"
+
+
+def _write_atomic(path, data):
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def read_manifest(directory):
+    with open(os.path.join(directory, MANIFEST), "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _fingerprint(path):
+    st = os.stat(path)
+    return [st.st_size, st.st_mtime_ns]
+
+
+# =========================================================
+# COMPILER
+# =========================================================
+def _decode_files(paths, image_size):
+    """Yield (position, uint8 image) for every decodable file, decoded in parallel"""
+    if not paths:
+        return
+    ds = tf.data.Dataset.from_tensor_slices((np.arange(len(paths)), paths))
+    ds = ds.map(lambda i, path: (i, decode_image(path, image_size)), num_parallel_calls=AUTOTUNE, deterministic=True)
+    ds = ds.ignore_errors().prefetch(AUTOTUNE)
+    for i, image in ds.as_numpy_iterator():
+        yield int(i), image
+
+
+def compile_shards(source, out_dir, image_size=(224, 224), shard_size=SHARD_SIZE, rebuild=False):
+    """Bring out_dir up to date with the images under source; returns build stats"""
+    start = time.time()
+    image_size = tuple(int(s) for s in image_size)
+    os.makedirs(out_dir, exist_ok=True)
+
+    manifest = None
+    if is_shard_dir(out_dir) and not rebuild:
+        manifest = read_manifest(out_dir)
+        if manifest.get("format_version") != FORMAT_VERSION or tuple(manifest["image_size"]) != image_size:
+            print(f"⚠️ {out_dir} was built with different settings; rebuilding")
+            manifest = None
+    if manifest is None:
+        manifest = {"format_version": FORMAT_VERSION, "image_size": list(image_size),
+                    "files": {}, "shards": {}, "next_shard": 0}
+
+    paths, labels, class_names = list_image_files(source)
+    rel_paths = [os.path.relpath(p, source).replace(os.sep, "/") for p in paths]
+    fingerprints = [_fingerprint(p) for p in paths]
+
+    # Reuse rows whose source file is unchanged
+    old_files, shards = manifest["files"], manifest["shards"]
+    files, todo = {}, []
+    for i, rel in enumerate(rel_paths):
+        entry = old_files.get(rel)
+        if entry and entry["fingerprint"] == fingerprints[i] and str(entry["shard"]) in shards:
+            files[rel] = entry
+        else:
+            todo.append(i)
+
+    # Shards left mostly dead by deletions and changes get their live rows moved
+    live = {}
+    for entry in files.values():
+        live.setdefault(str(entry["shard"]), []).append(entry)
+    moved = []
+    for shard_id, count in list(shards.items()):
+        rows = live.get(shard_id, [])
+        if len(rows) < count * 0.5:
+            moved.extend(rows)
+            del shards[shard_id]
+
+    # Write new shards: moved rows (copied, no decode) then newly decoded images
+    def sources():
+        opened = {}
+        for entry in moved:
+            sid = str(entry["shard"])
+            if sid not in opened:
+                opened[sid] = np.load(os.path.join(out_dir, shard_name(int(sid))), mmap_mode="r")
+            yield entry["rel"], entry["fingerprint"], opened[sid][entry["row"]]
+        for i, image in _decode_files([paths[i] for i in todo], image_size):
+            j = todo[i]
+            yield rel_paths[j], fingerprints[j], image
+
+    pending = len(moved) + len(todo)
+    written = 0
+    batch = []
+
+    def flush(batch):
+        shard_id = manifest["next_shard"]
+        manifest["next_shard"] += 1
+        path = os.path.join(out_dir, shard_name(shard_id))
+        tmp_path = path + ".tmp"
+        array = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=np.uint8,
+                                          shape=(len(batch), *image_size, 3))
+        for row, (rel, fingerprint, image) in enumerate(batch):
+            array[row] = image
+            files[rel] = {"rel": rel, "fingerprint": fingerprint, "shard": shard_id, "row": row}
+        array.flush()
+        del array
+        os.replace(tmp_path, path)
+        shards[str(shard_id)] = len(batch)
+
+    for item in sources():
+        batch.append(item)
+        written += 1
+        if len(batch) >= shard_size:
+            flush(batch)
+            batch = []
+            print(f"  ... {written}/{pending} images")
+    if batch:
+        flush(batch)
+
+    failed = [rel_paths[i] for i in todo if rel_paths[i] not in files]
+    for rel in failed:
+        print(f"⚠️ Could not decode {rel}; skipped")
+
+    # Label index in flow_from_directory order, then the manifest that points at it
+    index = np.array([(files[rel]["shard"], files[rel]["row"], label)
+                      for rel, label in zip(rel_paths, labels) if rel in files], dtype=INDEX_DTYPE)
+    manifest.update(files=files, shards=shards, class_names=class_names, samples=len(index),
+                    source=os.path.abspath(source), built_at=time.strftime("%Y-%m-%dT%H:%M:%S"))
+    np.save(os.path.join(out_dir, INDEX + ".tmp.npy"), index)
+    os.replace(os.path.join(out_dir, INDEX + ".tmp.npy"), os.path.join(out_dir, INDEX))
+    _write_atomic(os.path.join(out_dir, MANIFEST), json.dumps(manifest).encode())
+
+    # Old shard files are only removed once nothing points at them
+    keep = {shard_name(int(s)) for s in shards}
+    for name in os.listdir(out_dir):
+        if name.startswith("shard-") and name.endswith(".npy") and name not in keep:
+            os.remove(os.path.join(out_dir, name))
+
+    decoded = len(todo) - len(failed)
+    stats = {"samples": len(index), "decoded": decoded, "reused": len(index) - decoded,
+             "failed": len(failed), "shards": len(shards), "seconds": time.time() - start}
+    print(f"✅ {out_dir}: {stats['samples']} images in {stats['shards']} shards "
+          f"({stats['decoded']} decoded, {stats['reused']} reused) in {stats['seconds']:.1f}s")
+    return stats
+
+
+# =========================================================
+# READERS
+# =========================================================
+class ShardReader:
+    """Memory-mapped view of a compiled shard directory"""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.manifest = read_manifest(directory)
+        self.index = np.load(os.path.join(directory, INDEX))
+        self.class_names = self.manifest["class_names"]
+        self.image_size = tuple(self.manifest["image_size"])
+        self.labels = self.index["label"].astype(np.int32)
+        self._shards = {}
+
+    def __len__(self):
+        return len(self.index)
+
+    def shard(self, shard_id):
+        array = self._shards.get(shard_id)
+        if array is None:
+            array = np.load(os.path.join(self.directory, shard_name(int(shard_id))), mmap_mode="r")
+            self._shards[shard_id] = array
+        return array
+
+    def images(self, positions):
+        """uint8 images for index positions; a contiguous run inside one shard is returned as a view"""
+        entries = self.index[positions]
+        shard_ids = np.unique(entries["shard"])
+        if len(shard_ids) == 1:
+            rows = entries["row"]
+            array = self.shard(shard_ids[0])
+            if len(rows) and np.all(np.diff(rows.astype(np.int64)) == 1):
+                return array[rows[0]:rows[-1] + 1]
+            return array[rows]
+        out = np.empty((len(entries), *self.image_size, 3), dtype=np.uint8)
+        for shard_id in shard_ids:
+            mask = entries["shard"] == shard_id
+            out[mask] = self.shard(shard_id)[entries["row"][mask]]
+        return out
+
+    def iter_batches(self, batch_size=32):
+        """(uint8 images, int labels) in index order"""
+        for start in range(0, len(self), batch_size):
+            positions = np.arange(start, min(start + batch_size, len(self)))
+            yield self.images(positions), self.labels[positions]
+
+
+def build_shard_dataset(directory, batch_size=32, training=False, rotation_range=0, zoom_range=0.0,
+                        horizontal_flip=False, validation_split=None, subset=None, class_names=None,
+                        num_shards=1, shard_index=0, seed=123, rescale=1 / 255.0, label_mode="categorical",
+                        image_size=None):
+    """Same contract as data_pipeline.build_dataset, fed from memory-mapped shards"""
+    reader = ShardReader(directory)
+    if image_size is not None and tuple(image_size) != reader.image_size:
+        raise ValueError(f"{directory} holds {reader.image_size} images, {tuple(image_size)} requested")
+    if class_names is not None and list(class_names) != reader.class_names:
+        raise ValueError(f"{directory} classes {reader.class_names} do not match {list(class_names)}")
+
+    positions = np.arange(len(reader))
+    labels = reader.labels
+    if validation_split:
+        positions, labels = split_files(positions, labels, validation_split, subset, seed)
+        positions = np.asarray(positions)
+    if num_shards > 1:
+        positions, labels = positions[shard_index::num_shards], labels[shard_index::num_shards]
+    if not len(positions):
+        raise ValueError(f"No images found in {directory}")
+
+    info = DatasetInfo(reader.class_names, labels, batch_size)
+    height, width = reader.image_size
+
+    def gather(batch_positions):
+        batch_positions = np.sort(batch_positions)
+        return np.ascontiguousarray(reader.images(batch_positions)), reader.labels[batch_positions]
+
+    def load(batch_positions):
+        images, batch_labels = tf.numpy_function(gather, [batch_positions], [tf.uint8, tf.int32])
+        images.set_shape([None, height, width, 3])
+        batch_labels.set_shape([None])
+        return images, batch_labels
+
+    ds = tf.data.Dataset.from_tensor_slices(positions.astype(np.int64))
+    if training:
+        ds = ds.shuffle(len(positions), seed=seed, reshuffle_each_iteration=True)
+    ds = ds.batch(batch_size).map(load, num_parallel_calls=AUTOTUNE, deterministic=True)
+    ds = ds.map(batch_transform(len(reader.class_names), training, rotation_range, zoom_range, horizontal_flip,
+                                seed, rescale, label_mode),
+                num_parallel_calls=AUTOTUNE, deterministic=True)
+    return finalize(ds), info
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compile an image dataset into memory-mapped shards")
+    sub = parser.add_subparsers(dest="command", required=True)
+    build = sub.add_parser("build", help="Create or incrementally update a shard directory")
+    build.add_argument("source", help="Class-per-folder image directory")
+    build.add_argument("out", help="Shard directory")
+    build.add_argument("--image-size", type=int, default=224)
+    build.add_argument("--shard-size", type=int, default=SHARD_SIZE, help="Images per shard")
+    build.add_argument("--rebuild", action="store_true", help="Ignore the existing shards")
+    info = sub.add_parser("info", help="Describe a shard directory")
+    info.add_argument("out", help="Shard directory")
+    info.add_argument("--bench", type=int, default=0, metavar="BATCHES", help="Also time reading this many batches")
+    args = parser.parse_args()
+
+    if args.command == "build":
+        compile_shards(args.source, args.out, (args.image_size, args.image_size), args.shard_size, args.rebuild)
+    else:
+        reader = ShardReader(args.out)
+        counts = np.bincount(reader.labels, minlength=len(reader.class_names))
+        print(f"📦 {args.out}: {len(reader)} images, {reader.image_size[0]}x{reader.image_size[1]}, "
+              f"{len(reader.manifest['shards'])} shards, built {reader.manifest.get('built_at')}")
+        for name, count in zip(reader.class_names, counts):
+            print(f"   {name}: {count}")
+        if args.bench:
+            ds, _ = build_shard_dataset(args.out, training=True, rotation_range=10, zoom_range=0.2, horizontal_flip=True)
+            benchmark(ds.repeat(), args.bench, "shards")
@@ -1,36 +1,212 @@
+"""
+Deterministic, incremental train/val/test split.
+
+Each file's split is chosen from a stable hash of its content (or of its
+patient id, so all of a patient's images land in the same split) rather than
+a shuffle, so re-running never moves a file between splits, and identical
+images in different folders always end up in the same split. Files are
+placed by hardlink (symlink, then copy, when the filesystem can't) under
+their path relative to the source folder, so equal basenames don't collide.
+
+A manifest in the output folder records every placed file; re-runs only
+hash and place files that are new or changed, and remove outputs whose
+source is gone.
+
+    python dataset_split.py                                   # dataset/{CT,Xray,MRI,val} -> dataset/{train,test}
+    python dataset_split.py --source raw --groups CT MRI --out data --split train=0.7 val=0.2 test=0.1
+    python dataset_split.py --patient-pattern "^(\\d+)_"       # NIH-style 00000001_000.png
+"""
+import argparse
+import hashlib
+import json
 import os
+import re
 import shutil
-import random
-
-image_extensions = [".png", ".jpg", ".jpeg"]
-
-directions = ["CT", "Xray", "MRI", "val"]
-dataset_dir = "dataset"
-
-train_dir = os.path.join(dataset_dir, "train")
-test_dir = os.path.join(dataset_dir, "test")
-val_dir = os.path.join(dataset_dir, "val")
-
-os.makedirs(train_dir, exist_ok=True)
-os.makedirs(test_dir, exist_ok=True)
-os.makedirs(val_dir, exist_ok=True)
-
-for subfolder in directions:
-    subfolder_path = os.path.join(dataset_dir, subfolder)
-    if not os.path.exists(subfolder_path):
-        continue
-    files = [f for f in os.listdir(subfolder_path) if os.path.splitext(f)[1].lower() in image_extensions]
-    random.shuffle(files)
-    split_1 = int(0.7 * len(files))
-    train_files = files[:split_1]
-    test_files = files[split_1:]
-    dist = {"train": train_files, "test": test_files}
-    for key, f_list in dist.items():
-        dest_dir = train_dir if key == "train" else test_dir
-        for f in f_list:
-            src = os.path.join(subfolder_path, f)
-            dst = os.path.join(dest_dir, f)
-            try:
-                shutil.move(src, dst)
-            except Exception as e:
-                print(f"Error moving {f}: {e}")
\ No newline at end of file
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg")
+MANIFEST = "split_manifest.json"
+# hardlink -> symlink -> copy; "symlink" skips hardlinks, "copy" always copies
+LINK_MODE = os.environ.get("SPLIT_LINK_MODE", "hardlink")
+SPLIT_WORKERS = int(os.environ.get("SPLIT_WORKERS", min(8, os.cpu_count() or 1)))
+DEFAULT_RATIOS = {"train": 0.7, "test": 0.3}
+
+
+def file_digest(path, chunk_size=1 << 20):
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def split_key(path, rel_path, patient_pattern=None):
+    """"patient:<id>" when the pattern matches the relative path, else "content:<sha1>" """
+    if patient_pattern:
+        match = re.search(patient_pattern, rel_path.replace(os.sep, "/"))
+        if match:
+            return "patient:" + (match.group(1) if match.groups() else match.group(0))
+    return "content:" + file_digest(path)
+
+
+def assign_split(key, ratios):
+    """Split for a key: its hash as a point in [0, 1) against the cumulative ratios"""
+    point = int(hashlib.sha1(key.encode("utf-8")).hexdigest()[:15], 16) / 16 ** 15
+    total = sum(ratios.values())
+    cumulative = 0.0
+    for name, ratio in ratios.items():
+        cumulative += ratio / total
+        if point < cumulative:
+            return name
+    return name
+
+
+def place(src, dst, link_mode=LINK_MODE):
+    """Hardlink / symlink / copy src to dst; returns the method used"""
+    os.makedirs(os.path.dirname(dst), exist_ok=True)
+    if os.path.lexists(dst):
+        os.remove(dst)
+    if link_mode == "hardlink":
+        try:
+            os.link(src, dst)
+            return "hardlink"
+        except OSError:
+            pass  # other filesystem / not supported
+    if link_mode in ("hardlink", "symlink"):
+        try:
+            os.symlink(os.path.abspath(src), dst)
+            return "symlink"
+        except OSError:
+            pass  # e.g. Windows without symlink privilege
+    shutil.copy2(src, dst)
+    return "copy"
+
+
+def _fingerprint(path):
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def list_sources(source_dir, groups=None, extensions=IMAGE_EXTENSIONS):
+    """[(group, absolute path, path relative to the group folder)]; groups default to the sub-folders"""
+    groups = groups or sorted(d for d in os.listdir(source_dir) if os.path.isdir(os.path.join(source_dir, d)))
+    files = []
+    for group in groups:
+        group_dir = os.path.join(source_dir, group)
+        if not os.path.isdir(group_dir):
+            continue
+        for root, _, names in os.walk(group_dir):
+            for name in sorted(names):
+                if name.lower().endswith(extensions):
+                    path = os.path.join(root, name)
+                    files.append((group, path, os.path.relpath(path, group_dir)))
+    return files
+
+
+def read_manifest(out_dir):
+    try:
+        with open(os.path.join(out_dir, MANIFEST), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def split_dataset(files, out_dir, ratios=None, patient_pattern=None, link_mode=LINK_MODE,
+                  workers=SPLIT_WORKERS):
+    """Place files ([(group, path, rel_path)]) under out_dir/<split>/<group>/<rel_path>; returns the manifest"""
+    ratios = ratios or DEFAULT_RATIOS
+    settings = {"ratios": ratios, "patient_pattern": patient_pattern}
+    manifest = read_manifest(out_dir)
+    if manifest.get("settings") not in (None, settings):
+        # Different ratios or keying would reassign files, so start the output over
+        print(f"⚠️ Split settings changed ({manifest['settings']} -> {settings}); re-splitting everything")
+        for entry in manifest.get("files", {}).values():
+            if os.path.lexists(entry["dest"]):
+                os.remove(entry["dest"])
+        manifest = {}
+    entries = manifest.get("files", {})
+
+    current, pending = {}, []
+    for group, path, rel_path in files:
+        source_id = os.path.abspath(path)
+        entry = entries.get(source_id)
+        if entry and entry["fingerprint"] == _fingerprint(path) and os.path.lexists(entry["dest"]):
+            current[source_id] = entry
+        else:
+            pending.append((source_id, group, path, rel_path))
+
+    def process(item):
+        source_id, group, path, rel_path = item
+        key = split_key(path, rel_path, patient_pattern)
+        split = assign_split(key, ratios)
+        dest = os.path.join(out_dir, split, group, rel_path)
+        old = entries.get(source_id)
+        if old and old["dest"] != dest and os.path.lexists(old["dest"]):
+            os.remove(old["dest"])
+        method = place(path, dest, link_mode)
+        return source_id, {"group": group, "split": split, "key": key, "dest": dest, "method": method,
+                           "fingerprint": _fingerprint(path)}
+
+    start = time.time()
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        for source_id, entry in pool.map(process, pending):
+            current[source_id] = entry
+
+    removed = 0
+    for source_id, entry in entries.items():
+        if source_id not in current:
+            if os.path.lexists(entry["dest"]):
+                os.remove(entry["dest"])
+            removed += 1
+
+    manifest = {"settings": settings, "updated_at": time.strftime("%Y-%m-%dT%H:%M:%S"), "files": current}
+    os.makedirs(out_dir, exist_ok=True)
+    tmp_path = os.path.join(out_dir, MANIFEST + ".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(tmp_path, os.path.join(out_dir, MANIFEST))
+
+    print(f"✅ {len(pending)} new/changed, {len(current) - len(pending)} unchanged, {removed} removed "
+          f"in {time.time() - start:.1f}s")
+    print_summary(manifest)
+    return manifest
+
+
+def print_summary(manifest):
+    counts, methods = {}, {}
+    for entry in manifest["files"].values():
+        counts.setdefault(entry["group"], {}).setdefault(entry["split"], 0)
+        counts[entry["group"]][entry["split"]] += 1
+        methods[entry["method"]] = methods.get(entry["method"], 0) + 1
+    splits = list(manifest["settings"]["ratios"])
+    print(f"{'group':<15}" + "".join(f"{s:>8}" for s in splits))
+    for group, row in sorted(counts.items()):
+        print(f"{group:<15}" + "".join(f"{row.get(s, 0):>8}" for s in splits))
+    print("placed by " + ", ".join(f"{m}: {n}" for m, n in sorted(methods.items())))
+
+
+def parse_ratios(values):
+    """["train=0.7", "test=0.3"] -> {"train": 0.7, "test": 0.3}"""
+    ratios = {}
+    for value in values:
+        name, ratio = value.split("=")
+        ratios[name] = float(ratio)
+    return ratios
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Deterministic, incremental dataset split")
+    parser.add_argument("--source", default="dataset", help="Folder containing the group sub-folders")
+    parser.add_argument("--groups", nargs="+", default=["CT", "Xray", "MRI", "val"],
+                        help="Sub-folders to split (kept as the class folder in each split)")
+    parser.add_argument("--out", default="dataset", help="Where the split folders are created")
+    parser.add_argument("--split", nargs="+", default=["train=0.7", "test=0.3"], metavar="NAME=RATIO")
+    parser.add_argument("--patient-pattern", help="Regex on the relative path; group 1 is the patient id")
+    parser.add_argument("--link", choices=["hardlink", "symlink", "copy"], default=LINK_MODE)
+    parser.add_argument("--workers", type=int, default=SPLIT_WORKERS)
+    args = parser.parse_args()
+
+    files = list_sources(args.source, args.groups)
+    print(f"📂 {len(files)} images in {args.source} ({', '.join(args.groups)})")
+    split_dataset(files, args.out, parse_ratios(args.split), args.patient_pattern, args.link, args.workers)
@@ -0,0 +1,213 @@
+"""
+Knowledge distillation of the 50-class EfficientNetV2 teacher into the small
+CNN from the root model.py, for CPU serving.
+
+The teacher is run once over the images and its softmax outputs are cached
+(keyed by teacher file and dataset state), so repeated distillation runs and
+hyper-parameter changes only cost student training. The student sees images
+preprocessed exactly like the API does (BGR, /255, 224x224) and is trained on
+a mix of the teacher's temperature-softened distribution and the folder
+labels, where a folder name matches a DISEASE_MAP class.
+
+    python distill.py --data dataset --epochs 20
+    MODEL_FILE=chest_disease_student.h5 python api_server.py
+"""
+import argparse
+import importlib.util
+import json
+import os
+import time
+
+import numpy as np
+import tensorflow as tf
+from tensorflow.keras import ops
+from tensorflow.keras.callbacks import EarlyStopping
+from tensorflow.keras.optimizers import Adam
+
+from data_pipeline import AUTOTUNE, decode_image, list_image_files, split_files
+from disease_mapper import DISEASE_MAP
+from feature_cache import cached_features, dataset_fingerprint
+from report_renderer import file_version
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+TEACHER_PATH = os.path.join(BASE_DIR, "models", "chest_disease_efficientnetv2.h5")
+STUDENT_PATH = os.path.join(BASE_DIR, "models", "chest_disease_student.h5")
+LOGIT_CACHE_DIR = os.environ.get("DISTILL_CACHE_DIR", os.path.join(BASE_DIR, "models", "distill_cache"))
+NUM_CLASSES = len(DISEASE_MAP)
+IMAGE_SIZE = (224, 224)
+
+
+def load_cnn_module():
+    """The root model.py (new/ has its own, unrelated model.py)"""
+    spec = importlib.util.spec_from_file_location("cnn_model", os.path.join(os.path.dirname(BASE_DIR), "model.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def folder_labels(class_names, labels):
+    """DISEASE_MAP index per image from its folder name, -1 where the folder is not a known class"""
+    by_name = {name.lower(): idx for idx, name in DISEASE_MAP.items()}
+    mapping = np.array([by_name.get(name.lower(), -1) for name in class_names], dtype=np.int32)
+    return mapping[labels]
+
+
+def image_dataset(paths, targets=None, batch_size=32, shuffle=False, seed=123):
+    """Images preprocessed like api_server.preprocess_image (BGR, 0-1), optionally paired with targets"""
+    def load(path):
+        return tf.cast(decode_image(path, IMAGE_SIZE)[..., ::-1], tf.float32) / 255.0
+
+    if targets is None:
+        ds = tf.data.Dataset.from_tensor_slices(paths).map(load, num_parallel_calls=AUTOTUNE)
+    else:
+        ds = tf.data.Dataset.from_tensor_slices((paths, targets))
+        ds = ds.map(lambda path, target: (load(path), target), num_parallel_calls=AUTOTUNE).cache()
+        if shuffle:
+            ds = ds.shuffle(len(paths), seed=seed, reshuffle_each_iteration=True)
+    return ds.batch(batch_size).prefetch(AUTOTUNE)
+
+
+def teacher_outputs(teacher, teacher_path, data_dir, paths, recompute=False):
+    """Teacher softmax outputs for every image, cached per (teacher file, dataset state)"""
+    key = f"teacher|{file_version(teacher_path)}|{dataset_fingerprint(data_dir)}"
+
+    def compute():
+        probs = teacher.predict(image_dataset(paths), verbose=1).astype(np.float32)
+        return probs, probs.argmax(axis=1).astype(np.int32)
+
+    if recompute:
+        return compute()[0]
+    probs, _ = cached_features(LOGIT_CACHE_DIR, key, compute)
+    return probs
+
+
+def distillation_loss(temperature=4.0, alpha=0.1, num_classes=NUM_CLASSES):
+    """y_true = [one-hot label (all zeros if unlabeled) | teacher probabilities]; y_pred = student softmax.
+
+    alpha * cross-entropy on the label + (1 - alpha) * T^2 * KL(teacher_T || student_T)
+    """
+    def loss(y_true, y_pred):
+        hard, teacher = y_true[:, :num_classes], y_true[:, num_classes:]
+        log_student = ops.log(ops.clip(y_pred, 1e-7, 1.0))
+        soft_teacher = ops.softmax(ops.log(ops.clip(teacher, 1e-7, 1.0)) / temperature)
+        log_soft_student = ops.log_softmax(log_student / temperature)
+        kd = ops.sum(soft_teacher * (ops.log(soft_teacher + 1e-7) - log_soft_student), axis=-1)
+        ce = -ops.sum(hard * log_student, axis=-1)
+        return alpha * ce + (1 - alpha) * temperature ** 2 * kd
+
+    return loss
+
+
+def latency_ms(model, runs=30):
+    """Median milliseconds for one image"""
+    image = np.zeros((1, *IMAGE_SIZE, 3), dtype=np.float32)
+    model.predict_on_batch(image)
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        model.predict_on_batch(image)
+        timings.append((time.perf_counter() - start) * 1000)
+    return float(np.median(timings))
+
+
+def throughput(model, batch_size=32, runs=5):
+    """Images per second at a fixed batch size"""
+    batch = np.zeros((batch_size, *IMAGE_SIZE, 3), dtype=np.float32)
+    model.predict_on_batch(batch)
+    start = time.perf_counter()
+    for _ in range(runs):
+        model.predict_on_batch(batch)
+    return batch_size * runs / (time.perf_counter() - start)
+
+
+def profile(model, path):
+    weights_mb = sum(np.asarray(w).nbytes for w in model.get_weights()) / 1e6
+    return {
+        "params": int(model.count_params()),
+        "weights_mb": round(weights_mb, 1),
+        "file_mb": round(os.path.getsize(path) / 1e6, 1) if os.path.exists(path) else None,
+        "latency_ms": round(latency_ms(model), 2),
+        "throughput_img_s": round(throughput(model), 1),
+    }
+
+
+def compare(teacher, student, teacher_path, student_path, paths, labels, teacher_probs):
+    """Agreement, accuracy, latency and memory of student vs teacher on held-out images"""
+    student_probs = student.predict(image_dataset(paths), verbose=0)
+    teacher_top, student_top = teacher_probs.argmax(axis=1), student_probs.argmax(axis=1)
+    labeled = labels >= 0
+    report = {
+        "images": int(len(paths)),
+        "labeled_images": int(labeled.sum()),
+        "top1_agreement": round(float((teacher_top == student_top).mean()), 4),
+        "top5_agreement": round(float(np.mean([t in np.argsort(s)[-5:] for t, s in zip(teacher_top, student_probs)])), 4),
+        "teacher": profile(teacher, teacher_path),
+        "student": profile(student, student_path),
+    }
+    if labeled.any():
+        report["teacher"]["accuracy"] = round(float((teacher_top[labeled] == labels[labeled]).mean()), 4)
+        report["student"]["accuracy"] = round(float((student_top[labeled] == labels[labeled]).mean()), 4)
+
+    print("\n--- TEACHER vs STUDENT (held-out images) ---")
+    print(f"Top-1 agreement: {report['top1_agreement']:.2%}   Top-5 agreement: {report['top5_agreement']:.2%}")
+    print(f"{'':<10}{'accuracy':>10}{'params':>13}{'weights MB':>12}{'file MB':>9}{'ms/image':>10}{'img/s @32':>11}")
+    for name in ("teacher", "student"):
+        row = report[name]
+        accuracy = f"{row['accuracy']:.4f}" if "accuracy" in row else "n/a"
+        print(f"{name:<10}{accuracy:>10}{row['params']:>13,}{row['weights_mb']:>12}{str(row['file_mb']):>9}"
+              f"{row['latency_ms']:>10}{row['throughput_img_s']:>11}")
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Distill the serving model into a small CPU student")
+    parser.add_argument("--data", required=True, help="Image directory (class sub-folders; unlabeled folders are fine)")
+    parser.add_argument("--teacher", default=TEACHER_PATH)
+    parser.add_argument("--out", default=STUDENT_PATH, help="Where the student .h5 is exported")
+    parser.add_argument("--epochs", type=int, default=20)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--temperature", type=float, default=4.0)
+    parser.add_argument("--alpha", type=float, default=0.1, help="Weight of the hard-label loss")
+    parser.add_argument("--val-split", type=float, default=0.2)
+    parser.add_argument("--full-cnn", action="store_true", help="Keep model.py's Flatten head (22M parameters)")
+    parser.add_argument("--recompute-logits", action="store_true", help="Ignore cached teacher outputs")
+    args = parser.parse_args()
+
+    paths, folder, class_names = list_image_files(args.data)
+    labels = folder_labels(class_names, folder)
+    print(f"📂 {len(paths)} images, {int((labels >= 0).sum())} with a DISEASE_MAP label")
+
+    teacher = tf.keras.models.load_model(args.teacher, compile=False)
+    probs = teacher_outputs(teacher, args.teacher, args.data, paths, args.recompute_logits)
+
+    hard = np.zeros((len(paths), NUM_CLASSES), dtype=np.float32)
+    hard[labels >= 0, labels[labels >= 0]] = 1.0
+    targets = np.concatenate([hard, probs], axis=1)
+
+    order = np.arange(len(paths))
+    train_idx, _ = split_files(order, labels, args.val_split, "training", 123)
+    val_idx, _ = split_files(order, labels, args.val_split, "validation", 123)
+    train_idx, val_idx = np.asarray(train_idx), np.asarray(val_idx)
+    train_paths, val_paths = [paths[i] for i in train_idx], [paths[i] for i in val_idx]
+
+    student = load_cnn_module().build_model(NUM_CLASSES, compact=not args.full_cnn)
+    student.compile(optimizer=Adam(1e-3), loss=distillation_loss(args.temperature, args.alpha))
+    print(f"🎓 Distilling into a {student.count_params():,}-parameter student (T={args.temperature}, alpha={args.alpha})")
+    student.fit(
+        image_dataset(train_paths, targets[train_idx], args.batch_size, shuffle=True),
+        validation_data=image_dataset(val_paths, targets[val_idx], args.batch_size),
+        epochs=args.epochs,
+        callbacks=[EarlyStopping(monitor="val_loss", patience=4, restore_best_weights=True)]
+    )
+
+    # Export with a plain loss so the serving side can load it without this module
+    student.compile(optimizer=Adam(1e-3), loss="categorical_crossentropy", metrics=["accuracy"])
+    student.save(args.out)
+    print(f"✅ Student exported to {args.out}")
+
+    report = compare(teacher, student, args.teacher, args.out, val_paths, labels[val_idx], probs[val_idx])
+    report.update(temperature=args.temperature, alpha=args.alpha, teacher_version=file_version(args.teacher))
+    report_path = os.path.splitext(args.out)[0] + "_distill_report.json"
+    with open(report_path, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"📊 Report written to {report_path}")
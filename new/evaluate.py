@@ -16,15 +16,26 @@ print("Model loaded!")
 IMG_SIZE = (224, 224)  # same as training
 BATCH_SIZE = 32
 
-test_ds = image_dataset_from_directory(
-    TEST_DIR,
-    image_size=IMG_SIZE,
-    batch_size=BATCH_SIZE,
-    shuffle=False
-)
-
-# Get true labels
-y_true = np.concatenate([y.numpy() for x, y in test_ds], axis=0)
+# Set TEST_SHARDS to a directory compiled by dataset_shards.py to skip decoding
+TEST_SHARDS = os.environ.get("TEST_SHARDS")
+
+if TEST_SHARDS:
+    from data_pipeline import build_dataset
+
+    # Same tensors as image_dataset_from_directory: unscaled 0-255 floats, integer labels
+    test_ds, test_info = build_dataset(TEST_SHARDS, image_size=IMG_SIZE, batch_size=BATCH_SIZE,
+                                       rescale=None, label_mode="int")
+    y_true = test_info.classes
+else:
+    test_ds = image_dataset_from_directory(
+        TEST_DIR,
+        image_size=IMG_SIZE,
+        batch_size=BATCH_SIZE,
+        shuffle=False
+    )
+
+    # Get true labels
+    y_true = np.concatenate([y.numpy() for x, y in test_ds], axis=0)
 
 # Get predictions
 y_pred_probs = model.predict(test_ds)
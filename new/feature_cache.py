@@ -0,0 +1,56 @@
+"""
+On-disk cache of pooled backbone features for frozen-backbone (Phase 1) training.
+
+While the backbone is frozen its output for a given image never changes, so
+it is computed once per architecture and dataset state and the classifier
+head is trained on the cached vectors. The cache key covers the
+architecture, the split, the number of augmented copies and a fingerprint
+of the source images, so adding or editing images invalidates it.
+"""
+import hashlib
+import os
+import time
+
+import numpy as np
+
+from data_pipeline import list_image_files
+
+
+def dataset_fingerprint(directory):
+    """Hash of every image's relative path, size and mtime"""
+    paths, labels, class_names = list_image_files(directory)
+    digest = hashlib.sha1("|".join(class_names).encode())
+    for path, label in zip(paths, labels):
+        st = os.stat(path)
+        digest.update(f"{os.path.relpath(path, directory)}:{label}:{st.st_size}:{st.st_mtime_ns}\n".encode())
+    return digest.hexdigest()
+
+
+def extract_features(encoder, data, steps):
+    """(features, integer labels) for `steps` batches of (images, labels) from data"""
+    iterator = iter(data)
+    features, labels = [], []
+    for _ in range(steps):
+        x, y = next(iterator)
+        features.append(np.asarray(encoder.predict_on_batch(x), dtype=np.float32))
+        y = np.asarray(y)
+        labels.append(y.argmax(axis=-1) if y.ndim > 1 else y)
+    return np.concatenate(features), np.concatenate(labels).astype(np.int32)
+
+
+def cached_features(cache_dir, key, compute):
+    """Load features stored under key, or compute() -> (features, labels) and store them"""
+    os.makedirs(cache_dir, exist_ok=True)
+    path = os.path.join(cache_dir, hashlib.sha1(key.encode()).hexdigest()[:16] + ".npz")
+    if os.path.exists(path):
+        with np.load(path) as cached:
+            print(f"📦 Feature cache hit: {key}")
+            return cached["features"], cached["labels"]
+
+    start = time.time()
+    features, labels = compute()
+    tmp_path = path + ".tmp.npz"
+    np.savez(tmp_path, features=features, labels=labels)
+    os.replace(tmp_path, path)
+    print(f"💾 Cached {len(features)} x {features.shape[1]} features for {key} in {time.time() - start:.1f}s")
+    return features, labels
@@ -0,0 +1,87 @@
+"""
+Bulk import of diagnosis records into the Streamlit SQLite database.
+
+Accepts CSV (e.g. the history tab's CSV export) or JSONL, one record per
+row/line, and inserts them in chunked transactions:
+
+    python import_records.py backfill.csv
+    python import_records.py batch_results.jsonl --dedupe --chunk-size 10000
+"""
+import argparse
+import csv
+import json
+import os
+import time
+
+# database is imported in main(): importing it runs init_db() on RADIOLOGY_DB,
+# which has to point at --db first
+
+# Alternative field names used by the API and older exports
+ALIASES = {
+    'name': 'patient_name',
+    'gender': 'sex',
+    'disease': 'diagnosis',
+    'created_at': 'timestamp',
+}
+FIELDS = ('patient_name', 'patient_id', 'age', 'sex', 'physician', 'diagnosis', 'confidence', 'timestamp')
+
+
+def normalize(row):
+    """Map a raw CSV/JSON row to a record dict (unknown columns such as id are dropped)"""
+    record = {}
+    for key, value in row.items():
+        key = ALIASES.get(key, key)
+        if key in FIELDS:
+            record[key] = value if value != '' else None
+    if record.get('age') is not None:
+        record['age'] = int(float(record['age']))
+    if record.get('confidence') is not None:
+        record['confidence'] = float(record['confidence'])
+    return record
+
+
+def read_rows(path):
+    """Stream rows from a .csv or .jsonl file"""
+    if path.lower().endswith(('.jsonl', '.ndjson')):
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+    else:
+        with open(path, 'r', encoding='utf-8', newline='') as f:
+            yield from csv.DictReader(f)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import CSV or JSONL records into the radiology database")
+    parser.add_argument('path', help="CSV or JSONL file")
+    parser.add_argument('--db', default=os.environ.get('RADIOLOGY_DB', 'radiology_app.db'),
+                        help="SQLite database file")
+    parser.add_argument('--chunk-size', type=int, default=5000, help="Rows per transaction")
+    parser.add_argument('--dedupe', action='store_true',
+                        help="Skip rows whose (patient_id, timestamp, diagnosis) already exists")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.path):
+        parser.error(f"{args.path} does not exist")
+
+    os.environ['RADIOLOGY_DB'] = args.db
+    import database
+
+    start = time.time()
+
+    def progress(stats):
+        elapsed = time.time() - start
+        print(f"  ... {stats['rows']} rows ({stats['rows'] / elapsed:,.0f} rows/s)")
+
+    stats = database.save_predictions(
+        (normalize(row) for row in read_rows(args.path)),
+        chunk_size=args.chunk_size, dedupe=args.dedupe, on_chunk=progress
+    )
+    elapsed = time.time() - start
+    print(f"✅ Imported {stats['inserted']} of {stats['rows']} rows into {args.db} "
+          f"({stats['skipped']} skipped) in {elapsed:.2f}s — {stats['rows'] / max(elapsed, 1e-9):,.0f} rows/s")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,10 +1,38 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote
+
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 HEADERS = {
     "User-Agent": "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 "
                   "(KHTML, like Gecko) Chrome/120.0 Safari/537.36"
 }
 
+# Overridable so the fetcher can run against a local HTTP stub
+WIKIPEDIA_BASE_URL = os.environ.get("WIKIPEDIA_BASE_URL", "https://en.wikipedia.org").rstrip("/")
+OPENFDA_BASE_URL = os.environ.get("OPENFDA_BASE_URL", "https://api.fda.gov").rstrip("/")
+OPENFDA_REFERENCE_URL = "https://open.fda.gov/"
+
+# (connect, read) seconds
+REQUEST_TIMEOUT = (3.05, float(os.environ.get("INFO_FETCH_TIMEOUT", 8)))
+
+# Disk cache: fresh for CACHE_TTL, then served stale for up to CACHE_STALE more
+# while a background refresh runs. Fetch errors are cached for NEGATIVE_TTL.
+CACHE_DIR = os.environ.get(
+    "INFO_CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache", "clinical_info")
+)
+CACHE_TTL = float(os.environ.get("INFO_CACHE_TTL", 7 * 24 * 3600))
+CACHE_STALE = float(os.environ.get("INFO_CACHE_STALE", 30 * 24 * 3600))
+NEGATIVE_TTL = float(os.environ.get("INFO_NEGATIVE_TTL", 10 * 60))
+
 # Disease → Drug Map
 disease_drug_map = {
     "Pleural Effusion": "Furosemide",
@@ -16,58 +44,179 @@ disease_drug_map = {
     "Atelectasis": "No specific drug"
 }
 
+
+class FetchError(Exception):
+    """Upstream could not be reached or answered with an error status"""
+
+
+# ---------------- Pooled HTTP session -----------------
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session():
+    """Shared keep-alive session so lookups reuse TCP/TLS connections"""
+    global _session
+    with _session_lock:
+        if _session is None:
+            session = requests.Session()
+            session.headers.update(HEADERS)
+            retry = Retry(total=2, backoff_factor=0.3, status_forcelist=(429, 500, 502, 503, 504),
+                          allowed_methods=("GET",))
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16, max_retries=retry)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            _session = session
+        return _session
+
+
+# Lookups fan out here; background revalidation shares the same pool
+_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="info-fetch")
+
+
+# ---------------- Persistent cache -----------------
+class DiskCache:
+    """One JSON file per key, written atomically so readers never see partial entries"""
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, hashlib.sha1(key.encode()).hexdigest() + ".json")
+
+    def get(self, key):
+        try:
+            with open(self._path(key), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def put(self, key, value, negative=False):
+        entry = {"key": key, "value": value, "stored_at": time.time(), "negative": negative}
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(entry, f)
+            os.replace(tmp_path, self._path(key))
+        except OSError:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+
+cache = DiskCache(CACHE_DIR)
+_refreshing = set()
+_refresh_lock = threading.Lock()
+
+
+def _refresh(key, live_fn, disease_name):
+    try:
+        cache.put(key, list(live_fn(disease_name)))
+    except Exception:
+        # Keep serving the stale copy; a failed refresh is not worth a negative entry
+        pass
+    finally:
+        with _refresh_lock:
+            _refreshing.discard(key)
+
+
+def cached_fetch(kind, disease_name, live_fn, error_value):
+    """Serve from the disk cache with TTL, stale-while-revalidate and negative caching"""
+    key = f"{kind}:{disease_name.strip().lower()}"
+    entry = cache.get(key)
+    if entry is not None:
+        age = time.time() - entry["stored_at"]
+        if entry["negative"]:
+            if age < NEGATIVE_TTL:
+                return tuple(entry["value"])
+        else:
+            if age < CACHE_TTL:
+                return tuple(entry["value"])
+            if age < CACHE_TTL + CACHE_STALE:
+                with _refresh_lock:
+                    start_refresh = key not in _refreshing
+                    _refreshing.add(key)
+                if start_refresh:
+                    _executor.submit(_refresh, key, live_fn, disease_name)
+                return tuple(entry["value"])
+
+    try:
+        value = live_fn(disease_name)
+        cache.put(key, list(value))
+        return value
+    except Exception:
+        cache.put(key, list(error_value), negative=True)
+        return error_value
+
+
 # ---------------- Wikipedia Fetch -----------------
-def fetch_wikipedia(disease_name: str):
+def _get_json(url, params=None):
     try:
-        search_url = (
-            "https://en.wikipedia.org/w/api.php?"
-            "action=query&list=search&srsearch={}&format=json"
-        ).format(disease_name)
+        resp = get_session().get(url, params=params, timeout=REQUEST_TIMEOUT)
+    except requests.RequestException as e:
+        raise FetchError(str(e))
+    if resp.status_code == 404:
+        return None
+    if resp.status_code != 200:
+        raise FetchError(f"{url} returned {resp.status_code}")
+    return resp.json()
 
-        search_resp = requests.get(search_url, headers=HEADERS, timeout=10)
-        if search_resp.status_code != 200:
-            return "Wikipedia fetch error.", ""
 
-        results = search_resp.json().get("query", {}).get("search", [])
-        if not results:
-            return "No reliable summary found for this condition.", ""
+def fetch_wikipedia_live(disease_name: str):
+    search = _get_json(
+        f"{WIKIPEDIA_BASE_URL}/w/api.php",
+        params={"action": "query", "list": "search", "srsearch": disease_name, "format": "json"}
+    )
+    results = (search or {}).get("query", {}).get("search", [])
+    if not results:
+        return "No reliable summary found for this condition.", ""
 
-        best_title = results[0]["title"]
-        title_api = best_title.replace(" ", "_")
+    best_title = results[0]["title"]
+    title_api = best_title.replace(" ", "_")
 
-        summary_url = f"https://en.wikipedia.org/api/rest_v1/page/summary/{title_api}"
-        summary_resp = requests.get(summary_url, headers=HEADERS, timeout=10)
-        if summary_resp.status_code != 200:
-            return "No summary available for this condition.", ""
+    data = _get_json(f"{WIKIPEDIA_BASE_URL}/api/rest_v1/page/summary/{quote(title_api)}")
+    if data is None:
+        return "No summary available for this condition.", ""
 
-        data = summary_resp.json()
-        extract = data.get("extract", "")
-        if not extract:
-            return "No summary available.", ""
+    extract = data.get("extract", "")
+    if not extract:
+        return "No summary available.", ""
 
-        url = data.get("content_urls", {}).get("desktop", {}).get("page", "")
-        return extract, url
+    url = data.get("content_urls", {}).get("desktop", {}).get("page", "")
+    return extract, url
+
+
+def fetch_wikipedia(disease_name: str):
+    return cached_fetch("wikipedia", disease_name, fetch_wikipedia_live, ("Wikipedia fetch error.", ""))
 
-    except Exception:
-        return "Wikipedia fetch error.", ""
 
 # ---------------- FDA Drug Info -----------------
-def fetch_openfda_drug(disease_name: str):
-    try:
-        drug = disease_drug_map.get(disease_name, None)
-        if drug is None or "No specific drug" in drug:
-            return "No FDA-approved drug specifically recommended for this condition.", \
-                   "https://open.fda.gov/"
+def fetch_openfda_drug_live(disease_name: str):
+    drug = disease_drug_map.get(disease_name, None)
+    if drug is None or "No specific drug" in drug:
+        return "No FDA-approved drug specifically recommended for this condition.", \
+               OPENFDA_REFERENCE_URL
 
-        url = f"https://api.fda.gov/drug/label.json?search=openfda.generic_name:{drug}&limit=1"
-        resp = requests.get(url, headers=HEADERS, timeout=10)
-        if resp.status_code == 200:
-            results = resp.json().get("results", [])
-            if results:
-                purpose_list = results[0].get("purpose") or results[0].get("indications_and_usage") or ["No purpose information found."]
-                return purpose_list[0], "https://open.fda.gov/"
+    data = _get_json(
+        f"{OPENFDA_BASE_URL}/drug/label.json",
+        params={"search": f"openfda.generic_name:{drug}", "limit": 1}
+    )
+    results = (data or {}).get("results", [])
+    if results:
+        purpose_list = results[0].get("purpose") or results[0].get("indications_and_usage") or ["No purpose information found."]
+        return purpose_list[0], OPENFDA_REFERENCE_URL
 
-        return "No FDA information available for this drug.", "https://open.fda.gov/"
+    return "No FDA information available for this drug.", OPENFDA_REFERENCE_URL
 
-    except Exception:
-        return "FDA fetch error.", "https://open.fda.gov/"
\ No newline at end of file
+
+def fetch_openfda_drug(disease_name: str):
+    return cached_fetch("openfda", disease_name, fetch_openfda_drug_live,
+                        ("FDA fetch error.", OPENFDA_REFERENCE_URL))
+
+
+# ---------------- Combined lookup -----------------
+def fetch_clinical_info(disease_name: str):
+    """Run the Wikipedia and FDA lookups concurrently"""
+    wiki_future = _executor.submit(fetch_wikipedia, disease_name)
+    fda_future = _executor.submit(fetch_openfda_drug, disease_name)
+    return {"wikipedia": wiki_future.result(), "fda": fda_future.result()}
@@ -0,0 +1,250 @@
+"""
+Offline clinical knowledge pack for the fixed DISEASE_MAP label space.
+
+Build once (network needed), ship the file, and every diagnosis after that
+reads its clinical summary, drug information and source URLs from memory:
+
+    python knowledge_pack.py build              # writes data/knowledge_pack.json.gz
+    python knowledge_pack.py show "Pneumonia"
+
+The pack is a single gzip'd JSON document with a format version, a pack
+version and one entry per class. Set KNOWLEDGE_PACK_REFRESH_HOURS to rebuild
+it periodically in a background thread of a long-running server.
+"""
+import argparse
+import datetime
+import gzip
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from disease_mapper import DISEASE_MAP
+
+PACK_FORMAT_VERSION = 1
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+PACK_PATH = os.environ.get("KNOWLEDGE_PACK", os.path.join(BASE_DIR, "data", "knowledge_pack.json.gz"))
+REFRESH_HOURS = float(os.environ.get("KNOWLEDGE_PACK_REFRESH_HOURS", 0))
+
+# Upstream placeholders returned by info_fetcher when nothing useful was found
+FETCH_FAILURES = (
+    "Wikipedia fetch error.", "No reliable summary found for this condition.",
+    "No summary available for this condition.", "No summary available.", "FDA fetch error.",
+    "No FDA information available for this drug.", "No purpose information found."
+)
+# Answers info_fetcher gives without calling openFDA (no drug mapped for the class)
+LOCAL_ANSWERS = ("No FDA-approved drug specifically recommended for this condition.",)
+# Fetched fields per source, kept from the previous pack when a refresh can't fetch them
+SOURCE_FIELDS = {"wikipedia": ("summary", "summary_url"), "openfda": ("drug_info", "drug_url")}
+
+
+def placeholder_entry(disease_name):
+    """Generic text used when a class has no usable fetched content"""
+    return {
+        "summary": f"The condition {disease_name} is a known respiratory illness characterized by specific radiological findings. Clinical management typically involves diagnostic imaging, laboratory tests, and targeted therapy.",
+        "summary_url": f"https://en.wikipedia.org/wiki/{disease_name.replace(' ', '_')}",
+        "drug_info": f"FDA analysis suggests standard treatment protocols for {disease_name} involve monitoring of respiratory function. Pharmaceutical interventions depend on the underlying etiology.",
+        "drug_url": "https://open.fda.gov/",
+        "source": "placeholder"
+    }
+
+
+def _build_entry(disease_name):
+    from info_fetcher import fetch_clinical_info, disease_drug_map
+
+    info = fetch_clinical_info(disease_name)
+    wiki_text, wiki_url = info["wikipedia"]
+    fda_text, fda_url = info["fda"]
+
+    entry = placeholder_entry(disease_name)
+    fetched = []
+    if wiki_text and wiki_text not in FETCH_FAILURES:
+        entry["summary"], entry["summary_url"] = wiki_text, wiki_url or entry["summary_url"]
+        fetched.append("wikipedia")
+    if fda_text in LOCAL_ANSWERS:
+        entry["drug_info"], entry["drug_url"] = fda_text, fda_url or entry["drug_url"]
+    elif fda_text and fda_text not in FETCH_FAILURES:
+        entry["drug_info"], entry["drug_url"] = fda_text, fda_url or entry["drug_url"]
+        fetched.append("openfda")
+    entry["drug"] = disease_drug_map.get(disease_name)
+    entry["source"] = "+".join(fetched) or "placeholder"
+    return entry
+
+
+def _sources(entry):
+    return set(entry.get("source", "").split("+")) & set(SOURCE_FIELDS)
+
+
+def _merge_entry(disease_name, entry, previous):
+    """Keep the previous content of every source this fetch only got placeholder text for"""
+    if not previous:
+        return entry
+    placeholder = placeholder_entry(disease_name)
+    labels = _sources(entry)
+    for source, fields in SOURCE_FIELDS.items():
+        if entry[fields[0]] == placeholder[fields[0]] and previous.get(fields[0], placeholder[fields[0]]) != placeholder[fields[0]]:
+            for field in fields:
+                entry[field] = previous[field]
+            labels |= _sources(previous) & {source}
+    entry["source"] = "+".join(s for s in SOURCE_FIELDS if s in labels) or "placeholder"
+    return entry
+
+
+def build_pack(workers=8, previous=None):
+    """Fetch content for every class and return the pack document.
+
+    With a previous pack, classes (or sources) whose fetch fails keep their
+    previous content instead of falling back to placeholder text.
+    """
+    diseases = [DISEASE_MAP[i] for i in sorted(DISEASE_MAP)]
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        entries = dict(zip(diseases, pool.map(_build_entry, diseases)))
+    old_entries = (previous or {}).get("entries", {})
+    entries = {name: _merge_entry(name, entry, old_entries.get(name)) for name, entry in entries.items()}
+
+    digest = hashlib.sha256(json.dumps(entries, sort_keys=True).encode()).hexdigest()
+    now = datetime.datetime.now()
+    return {
+        "format_version": PACK_FORMAT_VERSION,
+        "pack_version": now.strftime("%Y%m%d-%H%M%S"),
+        "built_at": now.isoformat(),
+        "content_sha256": digest,
+        "entries": entries
+    }
+
+
+def write_pack(pack, path=PACK_PATH):
+    directory = os.path.dirname(path) or "."
+    os.makedirs(directory, exist_ok=True)
+    # Unique temp file so refreshes in several processes don't write over each other
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=os.path.basename(path) + ".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as raw, gzip.open(raw, "wt", encoding="utf-8") as f:
+            json.dump(pack, f, separators=(",", ":"), ensure_ascii=False)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def read_pack(path=PACK_PATH):
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        pack = json.load(f)
+    if pack.get("format_version") != PACK_FORMAT_VERSION:
+        raise ValueError(f"Unsupported knowledge pack format {pack.get('format_version')}")
+    return pack
+
+
+class KnowledgePack:
+    """In-memory view of the pack; lookups never touch the network"""
+
+    def __init__(self, path=PACK_PATH):
+        self.path = path
+        self._pack = {"entries": {}}
+        self._lock = threading.Lock()
+        self._refresh_thread = None
+        self.reload()
+
+    def reload(self):
+        try:
+            pack = read_pack(self.path)
+            print(f"✅ Knowledge pack {pack['pack_version']} loaded ({len(pack['entries'])} classes)")
+        except FileNotFoundError:
+            print(f"⚠️ Knowledge pack not found at {self.path}, using placeholder text")
+            pack = {"entries": {}}
+        except Exception as e:
+            print(f"⚠️ Could not load knowledge pack: {e}")
+            pack = {"entries": {}}
+        with self._lock:
+            self._pack = pack
+
+    @property
+    def version(self):
+        return self._pack.get("pack_version")
+
+    def lookup(self, disease_name):
+        entry = self._pack["entries"].get(disease_name)
+        return entry if entry is not None else placeholder_entry(disease_name)
+
+    def summary(self, disease_name):
+        entry = self.lookup(disease_name)
+        return entry["summary"], entry["summary_url"]
+
+    def drug_info(self, disease_name):
+        entry = self.lookup(disease_name)
+        return entry["drug_info"], entry["drug_url"]
+
+    def _refresh_loop(self, interval):
+        while True:
+            time.sleep(interval)
+            try:
+                current = self._pack
+                pack = build_pack(previous=current)
+                if pack["content_sha256"] == current.get("content_sha256"):
+                    print("🔄 Knowledge pack refresh found nothing new; keeping "
+                          f"{current.get('pack_version')}")
+                    continue
+                write_pack(pack, self.path)
+                with self._lock:
+                    self._pack = pack
+                print(f"🔄 Knowledge pack refreshed to {pack['pack_version']}")
+            except Exception as e:
+                print(f"⚠️ Knowledge pack refresh failed: {e}")
+
+    def start_background_refresh(self, hours=REFRESH_HOURS):
+        """Rebuild the pack every `hours` in a daemon thread (no-op when 0)"""
+        if hours <= 0 or self._refresh_thread is not None:
+            return
+        self._refresh_thread = threading.Thread(
+            target=self._refresh_loop, args=(hours * 3600,), name="knowledge-pack-refresh", daemon=True
+        )
+        self._refresh_thread.start()
+
+
+_pack = None
+_pack_lock = threading.Lock()
+
+
+def get_knowledge_pack():
+    """Process-wide pack, loaded on first use"""
+    global _pack
+    with _pack_lock:
+        if _pack is None:
+            _pack = KnowledgePack()
+            _pack.start_background_refresh()
+        return _pack
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build or inspect the offline clinical knowledge pack")
+    sub = parser.add_subparsers(dest="command", required=True)
+    build_cmd = sub.add_parser("build", help="Fetch content for every class and write the pack")
+    build_cmd.add_argument("--output", default=PACK_PATH)
+    build_cmd.add_argument("--workers", type=int, default=8)
+    build_cmd.add_argument("--fresh", action="store_true",
+                           help="Don't keep content from the existing pack for classes whose fetch fails")
+    show_cmd = sub.add_parser("show", help="Print the entry for one class")
+    show_cmd.add_argument("disease")
+    show_cmd.add_argument("--pack", default=PACK_PATH)
+    args = parser.parse_args()
+
+    if args.command == "build":
+        start = time.time()
+        previous = None
+        if not args.fresh and os.path.exists(args.output):
+            previous = read_pack(args.output)
+        pack = build_pack(args.workers, previous)
+        if previous and pack["content_sha256"] == previous.get("content_sha256"):
+            print(f"📦 Nothing new; {args.output} stays at {previous['pack_version']}")
+            raise SystemExit(0)
+        write_pack(pack, args.output)
+        sources = [e["source"] for e in pack["entries"].values()]
+        print(f"📦 Knowledge pack {pack['pack_version']} written to {args.output} "
+              f"({os.path.getsize(args.output) / 1024:.1f} KB, {len(sources)} classes, "
+              f"{sources.count('placeholder')} placeholders) in {time.time() - start:.1f}s")
+    else:
+        print(json.dumps(KnowledgePack(args.pack).lookup(args.disease), indent=2, ensure_ascii=False))
@@ -0,0 +1,417 @@
+"""
+Hedged, deadline-bound LLM client.
+
+Instead of trying each Gemini model strictly one after another, a request is
+sent to the best model first; if it has not answered within the hedge delay
+(or it fails) the next model is started in parallel, the first valid answer
+wins and the other in-flight call is cancelled. Everything runs under one
+overall deadline. Per-model latency and error statistics feed back into the
+model order and the hedge delay. The statistics fade back towards the prior
+as they age, and a small share of requests go to a lower-ranked model first,
+so a model demoted during an outage is measured again and can recover.
+
+The backend is pluggable: GeminiBackend talks to google.generativeai and
+FakeLLMBackend serves canned responses with injectable latency and failures,
+so the hedging behaviour can be exercised locally:
+
+    python llm_client.py --demo
+"""
+import asyncio
+import queue
+import random
+import threading
+import time
+
+
+class LLMError(Exception):
+    """All models failed or the deadline expired before any answered"""
+
+    def __init__(self, message, errors=None):
+        super().__init__(message)
+        self.errors = errors or []
+
+
+class ModelStats:
+    """Exponentially weighted latency and error statistics for one model"""
+
+    def __init__(self, name, prior_latency, half_life=300.0):
+        self.name = name
+        self.prior_latency = prior_latency
+        self.half_life = half_life  # seconds without samples for the estimates to lose half their weight
+        self.updated = time.monotonic()
+        self.latency = prior_latency
+        self.deviation = prior_latency / 2
+        self.error_rate = 0.0
+        self.calls = 0
+        self.successes = 0
+        self.errors = 0
+        self.cancelled = 0
+        self.last_error = None
+
+    def record_success(self, elapsed, alpha=0.2):
+        self.updated = time.monotonic()
+        self.calls += 1
+        self.successes += 1
+        self.deviation = (1 - alpha) * self.deviation + alpha * abs(elapsed - self.latency)
+        self.latency = (1 - alpha) * self.latency + alpha * elapsed
+        self.error_rate = (1 - alpha) * self.error_rate
+
+    def record_cancelled(self, elapsed, alpha=0.2):
+        # A cancelled loser took at least `elapsed`; only let that raise the estimate
+        self.cancelled += 1
+        self.updated = time.monotonic()
+        if elapsed > self.latency:
+            self.latency = (1 - alpha) * self.latency + alpha * elapsed
+
+    def record_error(self, error, alpha=0.2):
+        self.updated = time.monotonic()
+        self.calls += 1
+        self.errors += 1
+        self.last_error = str(error)[:200]
+        self.error_rate = (1 - alpha) * self.error_rate + alpha
+
+    def weight(self):
+        """How much the measurements still count, given how long ago the last one was"""
+        return 0.5 ** ((time.monotonic() - self.updated) / self.half_life)
+
+    def score(self):
+        """Expected cost of trying this model first (lower is better); stale stats fade to the prior"""
+        w = self.weight()
+        latency = self.prior_latency + w * (self.latency - self.prior_latency)
+        return latency * (1 + 4 * w * self.error_rate)
+
+    def hedge_delay(self):
+        """Roughly the model's tail latency: mean plus two deviations"""
+        return self.latency + 2 * self.deviation
+
+    def snapshot(self):
+        return {
+            'latency_s': round(self.latency, 3),
+            'deviation_s': round(self.deviation, 3),
+            'error_rate': round(self.error_rate, 3),
+            'weight': round(self.weight(), 3),
+            'calls': self.calls,
+            'successes': self.successes,
+            'errors': self.errors,
+            'cancelled': self.cancelled,
+            'last_error': self.last_error
+        }
+
+
+class HedgedLLMClient:
+    """Race models with delayed hedges under an overall deadline"""
+
+    def __init__(self, backend, models, deadline=25.0, hedge_delay=None,
+                 min_hedge_delay=1.0, max_parallel=2, prior_latency=5.0,
+                 stats_half_life=300.0, explore_rate=0.05, seed=None):
+        self.backend = backend
+        self.models = list(models)
+        self.deadline = deadline
+        self.fixed_hedge_delay = hedge_delay
+        self.min_hedge_delay = min_hedge_delay
+        self.max_parallel = max_parallel
+        # Share of requests that start on a random lower-ranked model; the hedge still covers them
+        self.explore_rate = explore_rate
+        self._random = random.Random(seed)
+        # Configured order breaks ties until real measurements arrive
+        self._stats = {
+            name: ModelStats(name, prior_latency * (1 + 0.01 * i), stats_half_life)
+            for i, name in enumerate(self.models)
+        }
+        self._lock = threading.Lock()
+        self._loop = None
+        self._loop_lock = threading.Lock()
+
+    def ordered_models(self):
+        with self._lock:
+            order = sorted(self.models, key=lambda name: self._stats[name].score())
+            if len(order) > 1 and self._random.random() < self.explore_rate:
+                order.insert(0, order.pop(self._random.randrange(1, len(order))))
+            return order
+
+    def _hedge_delay(self, model_name, remaining):
+        if self.fixed_hedge_delay is not None:
+            delay = self.fixed_hedge_delay
+        else:
+            with self._lock:
+                delay = max(self.min_hedge_delay, self._stats[model_name].hedge_delay())
+        # Always leave the hedge at least half of what is left of the deadline
+        return min(delay, remaining / 2)
+
+    async def _attempt(self, model_name, prompt, parse):
+        start = time.monotonic()
+        try:
+            text = await self.backend.generate(model_name, prompt)
+            result = parse(text, model_name) if parse else text
+        except asyncio.CancelledError:
+            with self._lock:
+                self._stats[model_name].record_cancelled(time.monotonic() - start)
+            raise
+        except Exception as e:
+            with self._lock:
+                self._stats[model_name].record_error(e)
+            raise
+        with self._lock:
+            self._stats[model_name].record_success(time.monotonic() - start)
+        return result
+
+    async def generate(self, prompt, parse=None, deadline=None):
+        """Return (result, model_name) from the first model to answer successfully.
+
+        `parse(text, model_name)` runs inside the attempt, so a malformed answer
+        counts as that model's failure and hands over to the next one.
+        """
+        loop = asyncio.get_running_loop()
+        end = loop.time() + (deadline or self.deadline)
+        order = self.ordered_models()
+        pending = {}
+        errors = []
+        next_idx = 0
+
+        def launch():
+            nonlocal next_idx
+            model_name = order[next_idx]
+            next_idx += 1
+            task = asyncio.ensure_future(self._attempt(model_name, prompt, parse))
+            pending[task] = model_name
+            return model_name
+
+        launch()
+        try:
+            while pending:
+                remaining = end - loop.time()
+                if remaining <= 0:
+                    break
+
+                can_hedge = next_idx < len(order) and len(pending) < self.max_parallel
+                timeout = remaining
+                if can_hedge:
+                    timeout = self._hedge_delay(order[next_idx - 1], remaining)
+
+                done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+
+                if not done:
+                    if can_hedge:
+                        hedged = launch()
+                        print(f"⏱️ Hedging LLM request to {hedged} after {timeout:.1f}s")
+                    continue
+
+                for task in done:
+                    model_name = pending.pop(task)
+                    if task.exception() is None:
+                        return task.result(), model_name
+                    errors.append((model_name, str(task.exception())[:200]))
+                    print(f"⚠️ Model {model_name} failed: {str(task.exception())[:100]}")
+
+                # A failure frees a slot: move on to the next model right away
+                while next_idx < len(order) and len(pending) < self.max_parallel:
+                    launch()
+        finally:
+            for task in pending:
+                task.cancel()
+            if pending:
+                await asyncio.gather(*pending, return_exceptions=True)
+
+        if not errors or len(errors) < len(order):
+            raise LLMError(f"LLM deadline of {deadline or self.deadline:.0f}s exceeded", errors)
+        raise LLMError(f"All models failed. Last error: {errors[-1][1]}", errors)
+
+    async def stream(self, prompt, deadline=None):
+        """Yield (model_name, text_chunk) from the first model that starts answering.
+
+        Models are tried in ranked order; one that fails or stays silent past its
+        hedge delay before the first chunk hands over to the next. A failure after
+        output has started is raised as LLMError so the caller can recover.
+        """
+        loop = asyncio.get_running_loop()
+        end = loop.time() + (deadline or self.deadline)
+        order = self.ordered_models()
+        errors = []
+
+        for i, model_name in enumerate(order):
+            remaining = end - loop.time()
+            if remaining <= 0:
+                break
+
+            start = time.monotonic()
+            chunks = self.backend.stream(model_name, prompt)
+            started = False
+            try:
+                while True:
+                    remaining = end - loop.time()
+                    if remaining <= 0:
+                        raise asyncio.TimeoutError(f"deadline expired while streaming from {model_name}")
+                    timeout = remaining
+                    if not started and i < len(order) - 1:
+                        timeout = self._hedge_delay(model_name, remaining)
+                    try:
+                        chunk = await asyncio.wait_for(chunks.__anext__(), timeout)
+                    except StopAsyncIteration:
+                        break
+                    started = True
+                    yield model_name, chunk
+            except Exception as e:
+                with self._lock:
+                    self._stats[model_name].record_error(e)
+                if started:
+                    raise LLMError(f"Stream from {model_name} failed partway: {str(e)[:200]}",
+                                   errors + [(model_name, str(e)[:200])])
+                errors.append((model_name, str(e)[:200] or 'no output before hedge delay'))
+                print(f"⚠️ Model {model_name} did not start streaming: {errors[-1][1][:100]}")
+                continue
+            finally:
+                await chunks.aclose()
+
+            with self._lock:
+                self._stats[model_name].record_success(time.monotonic() - start)
+            return
+
+        raise LLMError("No model started streaming before the deadline", errors)
+
+    def _background_loop(self):
+        """Event loop thread shared by synchronous callers (Flask worker threads)"""
+        with self._loop_lock:
+            if self._loop is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name='llm-client', daemon=True).start()
+                self._loop = loop
+            return self._loop
+
+    def generate_sync(self, prompt, parse=None, deadline=None):
+        future = asyncio.run_coroutine_threadsafe(
+            self.generate(prompt, parse, deadline), self._background_loop()
+        )
+        return future.result()
+
+    def stream_sync(self, prompt, deadline=None):
+        """Blocking generator over stream(), driven on the background loop"""
+        items = queue.Queue()
+        finished = object()
+
+        async def pump():
+            try:
+                async for item in self.stream(prompt, deadline):
+                    items.put(item)
+            except Exception as e:
+                items.put(e)
+            finally:
+                items.put(finished)
+
+        future = asyncio.run_coroutine_threadsafe(pump(), self._background_loop())
+        try:
+            while True:
+                item = items.get()
+                if item is finished:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            # Client went away or we are done: stop the upstream call
+            future.cancel()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'order': sorted(self.models, key=lambda name: self._stats[name].score()),
+                'deadline_s': self.deadline,
+                'models': {name: s.snapshot() for name, s in self._stats.items()}
+            }
+
+
+class GeminiBackend:
+    """google.generativeai backend using the non-blocking client"""
+
+    def __init__(self, genai):
+        self.genai = genai
+
+    async def generate(self, model_name, prompt):
+        response = await self.genai.GenerativeModel(model_name).generate_content_async(prompt)
+        return response.text
+
+    async def stream(self, model_name, prompt):
+        response = await self.genai.GenerativeModel(model_name).generate_content_async(prompt, stream=True)
+        async for chunk in response:
+            if chunk.text:
+                yield chunk.text
+
+
+class FakeLLMBackend:
+    """Local stand-in for Gemini with injectable latency and failures.
+
+    `latency` and `failure_rate` map model names to seconds / probability, or
+    may be callables taking the model name. When streaming, the response is
+    sent in `chunk_size` pieces `chunk_delay` apart, and `fail_after_chunks`
+    breaks the stream partway. Calls, completions and cancellations are
+    recorded for inspection.
+    """
+
+    def __init__(self, response='{}', latency=0.0, failure_rate=0.0, seed=None,
+                 chunk_size=32, chunk_delay=0.0, fail_after_chunks=None):
+        self.response = response
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.chunk_size = chunk_size
+        self.chunk_delay = chunk_delay
+        self.fail_after_chunks = fail_after_chunks
+        self.random = random.Random(seed)
+        self.calls = []
+        self.completed = []
+        self.cancelled = []
+
+    def _value(self, setting, model_name):
+        if callable(setting):
+            return setting(model_name)
+        if isinstance(setting, dict):
+            return setting.get(model_name, 0.0)
+        return setting
+
+    async def generate(self, model_name, prompt):
+        self.calls.append(model_name)
+        try:
+            await asyncio.sleep(self._value(self.latency, model_name))
+        except asyncio.CancelledError:
+            self.cancelled.append(model_name)
+            raise
+        if self.random.random() < self._value(self.failure_rate, model_name):
+            raise RuntimeError(f"{model_name}: injected failure")
+        self.completed.append(model_name)
+        response = self.response
+        return response(model_name, prompt) if callable(response) else response
+
+    async def stream(self, model_name, prompt):
+        text = await self.generate(model_name, prompt)
+        for n, i in enumerate(range(0, len(text), self.chunk_size)):
+            if self.fail_after_chunks is not None and n >= self._value(self.fail_after_chunks, model_name):
+                raise RuntimeError(f"{model_name}: injected stream failure")
+            if n and self.chunk_delay:
+                await asyncio.sleep(self.chunk_delay)
+            yield text[i:i + self.chunk_size]
+
+
+def _demo():
+    models = ['gemini-2.5-flash', 'gemini-2.0-flash', 'gemini-1.5-flash']
+    backend = FakeLLMBackend(
+        response='{"ok": true}',
+        latency={'gemini-2.5-flash': 3.0, 'gemini-2.0-flash': 0.4, 'gemini-1.5-flash': 0.6},
+        failure_rate={'gemini-1.5-flash': 1.0},
+        seed=7
+    )
+    client = HedgedLLMClient(backend, models, deadline=5.0, min_hedge_delay=0.5, prior_latency=0.5)
+
+    for i in range(5):
+        start = time.monotonic()
+        result, model_name = client.generate_sync('prompt')
+        print(f"request {i}: {model_name} answered in {time.monotonic() - start:.2f}s -> {result}")
+
+    print(f"calls={backend.calls}\ncancelled={backend.cancelled}")
+    for name, s in client.stats()['models'].items():
+        print(f"{name:<18} {s}")
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description="Hedged LLM client")
+    parser.add_argument('--demo', action='store_true', help="Run against the fake backend")
+    if parser.parse_args().demo:
+        _demo()
@@ -0,0 +1,379 @@
+"""
+Optimized variants of a trained Keras model, each evaluated and timed on CPU.
+
+    python optimize_model.py models/chest_model_Xception.h5 --test-dir dataset/test
+    python optimize_model.py ../chest_disease_model.h5 --test-dir ../dataset/test --sparsity 0.6 --clusters 16
+    python optimize_model.py model.h5 --test-dir dataset/test --calibration-dir dataset/train --variants tflite-int8
+
+Variants:
+  keras-fp32       the input model
+  pruned           per-layer magnitude pruning to --sparsity (optionally fine-tuned with the mask held)
+  clustered        each kernel's weights snapped to --clusters shared values (k-means)
+  tflite-fp32      plain TFLite conversion (reference for the quantized ones)
+  tflite-dynamic   dynamic-range quantization (int8 weights, float activations)
+  tflite-fp16      float16 weights
+  tflite-int8      full-integer quantization (int8 weights, activations and I/O), calibrated on
+                   --calibration-dir (else --finetune-dir; the test set only as a last resort)
+  pruned-dynamic   the pruned model, dynamic-range quantized with TFLite's sparse tensor encoding:
+                   the sparse export (run without the XNNPack delegate, which cannot load it); the
+                   index overhead only pays off above roughly 70% sparsity, so try --sparsity 0.8
+The Keras pruned/clustered sizes are reported gzipped as well, which is where their savings show.
+
+Pruning and clustering are done here directly on the kernels because
+tensorflow-model-optimization does not support the Keras 3 models
+TensorFlow >= 2.16 produces.
+"""
+import argparse
+import csv
+import gzip
+import json
+import os
+import shutil
+import time
+
+import numpy as np
+import tensorflow as tf
+from sklearn.metrics import accuracy_score, confusion_matrix, f1_score, precision_score, recall_score
+
+from data_pipeline import build_dataset
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+OPTIMIZE_DIR = os.path.join(BASE_DIR, "models", "optimized")
+PRUNABLE = (tf.keras.layers.Dense, tf.keras.layers.Conv2D)  # Conv2D covers Depthwise/SeparableConv2D's base
+MIN_PRUNE_PARAMS = 1024  # small kernels (first conv, tiny heads) are left dense
+
+
+# =========================================================
+# PRUNING AND CLUSTERING
+# =========================================================
+def iter_layers(model):
+    for layer in model.layers:
+        if hasattr(layer, "layers"):
+            yield from iter_layers(layer)
+        else:
+            yield layer
+
+
+def copy_model(model):
+    clone = tf.keras.models.clone_model(model)
+    clone.set_weights(model.get_weights())
+    return clone
+
+
+def _kernels(model):
+    """(layer, weight index) of every kernel large enough to optimize"""
+    for layer in iter_layers(model):
+        if isinstance(layer, PRUNABLE):
+            weights = layer.get_weights()
+            if weights and weights[0].size >= MIN_PRUNE_PARAMS:
+                yield layer, weights
+
+
+def prune_model(model, sparsity):
+    """Copy of model with the smallest-magnitude `sparsity` fraction of each kernel zeroed; returns (model, masks)"""
+    pruned = copy_model(model)
+    masks = {}
+    for layer, weights in _kernels(pruned):
+        kernel = weights[0]
+        threshold = np.quantile(np.abs(kernel), sparsity)
+        mask = np.abs(kernel) > threshold
+        weights[0] = kernel * mask
+        layer.set_weights(weights)
+        masks[layer.name] = mask
+    return pruned, masks
+
+
+class KeepPruned(tf.keras.callbacks.Callback):
+    """Re-applies the pruning masks after every step so fine-tuning cannot regrow weights"""
+
+    def __init__(self, masks):
+        super().__init__()
+        self.masks = masks
+
+    def on_train_batch_end(self, batch, logs=None):
+        for layer in iter_layers(self.model):
+            mask = self.masks.get(layer.name)
+            if mask is not None:
+                weights = layer.get_weights()
+                weights[0] = weights[0] * mask
+                layer.set_weights(weights)
+
+
+def cluster_weights(values, clusters, iterations=20):
+    """1-D k-means with linearly spaced initial centroids; returns values snapped to their centroid"""
+    flat = values.ravel()
+    centroids = np.linspace(flat.min(), flat.max(), clusters)
+    for _ in range(iterations):
+        assignment = np.searchsorted((centroids[1:] + centroids[:-1]) / 2, flat)
+        sums = np.bincount(assignment, weights=flat, minlength=clusters)
+        counts = np.bincount(assignment, minlength=clusters)
+        updated = np.where(counts > 0, sums / np.maximum(counts, 1), centroids)
+        if np.allclose(updated, centroids):
+            break
+        centroids = np.sort(updated)
+    assignment = np.searchsorted((centroids[1:] + centroids[:-1]) / 2, flat)
+    return centroids[assignment].reshape(values.shape).astype(values.dtype)
+
+
+def cluster_model(model, clusters):
+    clustered = copy_model(model)
+    for layer, weights in _kernels(clustered):
+        weights[0] = cluster_weights(weights[0], clusters)
+        layer.set_weights(weights)
+    return clustered
+
+
+# =========================================================
+# TFLITE CONVERSION
+# =========================================================
+def to_tflite(model, mode="fp32", representative=None):
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    if mode in ("dynamic", "sparse", "fp16", "int8"):
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    if mode == "sparse":
+        # Zeroed weights are stored in TFLite's sparse format instead of densely
+        converter.optimizations.append(tf.lite.Optimize.EXPERIMENTAL_SPARSITY)
+    if mode == "fp16":
+        converter.target_spec.supported_types = [tf.float16]
+    if mode == "int8":
+        converter.representative_dataset = representative
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+        converter.inference_input_type = tf.int8
+        converter.inference_output_type = tf.int8
+    return converter.convert()
+
+
+def representative_images(dataset, count=100):
+    """Calibration generator for full-integer quantization"""
+    def generate():
+        seen = 0
+        for images, _ in dataset:
+            for image in images:
+                yield [image[None, ...]]
+                seen += 1
+                if seen >= count:
+                    return
+    return generate
+
+
+class TFLiteModel:
+    """Single-image TFLite runner that quantizes inputs / dequantizes outputs when needed"""
+
+    def __init__(self, path, threads=None):
+        self.interpreter = tf.lite.Interpreter(model_path=path, num_threads=threads)
+        if any(t.get("sparsity_parameters") for t in self.interpreter.get_tensor_details()):
+            # XNNPack cannot run sparse-encoded kernels; the builtin ones can
+            self.interpreter = tf.lite.Interpreter(
+                model_path=path, num_threads=threads,
+                experimental_op_resolver_type=tf.lite.experimental.OpResolverType.BUILTIN_WITHOUT_DEFAULT_DELEGATES
+            )
+        self.interpreter.allocate_tensors()
+        self.input = self.interpreter.get_input_details()[0]
+        self.output = self.interpreter.get_output_details()[0]
+
+    def predict_one(self, image):
+        x = image[None, ...].astype(np.float32)
+        scale, zero_point = self.input["quantization"]
+        if self.input["dtype"] != np.float32:
+            info = np.iinfo(self.input["dtype"])
+            x = np.clip(np.round(x / scale + zero_point), info.min, info.max).astype(self.input["dtype"])
+        self.interpreter.set_tensor(self.input["index"], x)
+        self.interpreter.invoke()
+        y = self.interpreter.get_tensor(self.output["index"])[0]
+        scale, zero_point = self.output["quantization"]
+        if self.output["dtype"] != np.float32:
+            y = (y.astype(np.float32) - zero_point) * scale
+        return y
+
+
+# =========================================================
+# EVALUATION
+# =========================================================
+def evaluate_predict(predict_one, predict_batch, dataset, max_images=None):
+    """new/evaluate.py metrics for a model on an (images, int labels) dataset"""
+    y_true, y_pred = [], []
+    for images, labels in dataset:
+        images = images.numpy()
+        if predict_batch is not None:
+            probs = predict_batch(images)
+        else:
+            probs = np.stack([predict_one(image) for image in images])
+        y_pred.extend(np.argmax(probs, axis=1))
+        y_true.extend(labels.numpy())
+        if max_images and len(y_true) >= max_images:
+            break
+    return {
+        "accuracy": round(float(accuracy_score(y_true, y_pred)), 4),
+        "precision": round(float(precision_score(y_true, y_pred, average="macro", zero_division=0)), 4),
+        "recall": round(float(recall_score(y_true, y_pred, average="macro", zero_division=0)), 4),
+        "f1": round(float(f1_score(y_true, y_pred, average="macro", zero_division=0)), 4),
+        "confusion_matrix": confusion_matrix(y_true, y_pred).tolist(),
+    }
+
+
+def median_latency(predict_one, image, runs=30):
+    predict_one(image)
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        predict_one(image)
+        timings.append((time.perf_counter() - start) * 1000)
+    return float(np.median(timings))
+
+
+def gzipped_size(path):
+    with open(path, "rb") as f:
+        return len(gzip.compress(f.read(), compresslevel=6))
+
+
+def sparsity_of(model):
+    total = zeros = 0
+    for _, weights in _kernels(model):
+        total += weights[0].size
+        zeros += int(np.sum(weights[0] == 0))
+    return zeros / total if total else 0.0
+
+
+# =========================================================
+# PIPELINE
+# =========================================================
+def optimize(model_path, test_dir, out_dir, sparsity=0.5, clusters=16, finetune_dir=None, finetune_epochs=2,
+             calibration_dir=None, calibration_images=100, max_eval=None, threads=None, rescale=1 / 255.0,
+             variants=None):
+    os.makedirs(out_dir, exist_ok=True)
+    model = tf.keras.models.load_model(model_path, compile=False)
+    image_size = tuple(model.input_shape[1:3])
+    test_ds, test_info = build_dataset(test_dir, image_size=image_size, batch_size=32, rescale=rescale,
+                                       label_mode="int")
+    sample = next(iter(test_ds))[0].numpy()[0]
+    print(f"📦 {model_path}: {model.count_params():,} parameters; {test_info.samples} test images")
+
+    artifacts = {}
+    keras_models = {"keras-fp32": model}
+    baseline_path = os.path.join(out_dir, "keras-fp32" + os.path.splitext(model_path)[1])
+    shutil.copyfile(model_path, baseline_path)
+    artifacts["keras-fp32"] = baseline_path
+
+    wanted = variants or ["pruned", "clustered", "tflite-fp32", "tflite-dynamic", "tflite-fp16", "tflite-int8",
+                          "pruned-dynamic"]
+
+    pruned = None
+    if "pruned" in wanted or "pruned-dynamic" in wanted:
+        pruned, masks = prune_model(model, sparsity)
+        if finetune_dir:
+            train_ds, _ = build_dataset(finetune_dir, image_size=image_size, batch_size=32, training=True,
+                                        horizontal_flip=True, rescale=rescale, label_mode="int")
+            pruned.compile(optimizer=tf.keras.optimizers.Adam(1e-5), loss="sparse_categorical_crossentropy",
+                           metrics=["accuracy"])
+            pruned.fit(train_ds, epochs=finetune_epochs, callbacks=[KeepPruned(masks)])
+        print(f"✂️ Pruned to {sparsity_of(pruned):.1%} kernel sparsity")
+        if "pruned" in wanted:
+            keras_models["pruned"] = pruned
+            artifacts["pruned"] = os.path.join(out_dir, "pruned.h5")
+            pruned.save(artifacts["pruned"], include_optimizer=False)
+
+    if "clustered" in wanted:
+        clustered = cluster_model(model, clusters)
+        keras_models["clustered"] = clustered
+        artifacts["clustered"] = os.path.join(out_dir, "clustered.h5")
+        clustered.save(artifacts["clustered"])
+        print(f"🎯 Clustered kernels to {clusters} values each")
+
+    tflite_jobs = {
+        "tflite-fp32": (model, "fp32"),
+        "tflite-dynamic": (model, "dynamic"),
+        "tflite-fp16": (model, "fp16"),
+        "tflite-int8": (model, "int8"),
+        "pruned-dynamic": (pruned, "sparse"),
+    }
+    calibration_ds = None
+    if "tflite-int8" in wanted:
+        # Calibrating on the images the variants are scored on would leak the test set into quantization
+        calibration_dir = calibration_dir or finetune_dir
+        if calibration_dir:
+            calibration_ds, _ = build_dataset(calibration_dir, image_size=image_size, batch_size=32, training=True,
+                                              cache=False, rescale=rescale, label_mode="int")
+        else:
+            print("⚠️ No --calibration-dir or --finetune-dir: calibrating int8 on the test set, "
+                  "so its tflite-int8 scores are optimistic")
+            calibration_ds = test_ds
+    for name, (source, mode) in tflite_jobs.items():
+        if name not in wanted:
+            continue
+        start = time.time()
+        representative = representative_images(calibration_ds, calibration_images) if mode == "int8" else None
+        path = os.path.join(out_dir, name + ".tflite")
+        with open(path, "wb") as f:
+            f.write(to_tflite(source, mode, representative))
+        artifacts[name] = path
+        print(f"🔧 {name} converted in {time.time() - start:.1f}s")
+
+    rows = []
+    for name, path in artifacts.items():
+        if name in keras_models:
+            keras_model = keras_models[name]
+            predict_one = lambda image, m=keras_model: m.predict_on_batch(image[None, ...])[0]
+            predict_batch = lambda images, m=keras_model: m.predict_on_batch(images)
+        else:
+            runner = TFLiteModel(path, threads)
+            predict_one, predict_batch = runner.predict_one, None
+        metrics = evaluate_predict(predict_one, predict_batch, test_ds, max_eval)
+        latency = median_latency(predict_one, sample)
+        row = {
+            "variant": name,
+            **{k: v for k, v in metrics.items() if k != "confusion_matrix"},
+            "size_mb": round(os.path.getsize(path) / 1e6, 2),
+            "gzip_mb": round(gzipped_size(path) / 1e6, 2),
+            "latency_ms": round(latency, 2),
+            "accuracy_per_ms": round(metrics["accuracy"] / latency, 5) if latency else None,
+            "path": path,
+            "confusion_matrix": metrics["confusion_matrix"],
+        }
+        rows.append(row)
+        print(f"📊 {name}: accuracy {row['accuracy']:.4f}, {row['latency_ms']} ms, {row['size_mb']} MB")
+
+    write_report(out_dir, rows)
+    return rows
+
+
+def write_report(out_dir, rows):
+    columns = ("variant", "accuracy", "precision", "recall", "f1", "size_mb", "gzip_mb", "latency_ms",
+               "accuracy_per_ms", "path")
+    with open(os.path.join(out_dir, "report.csv"), "w", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(columns)
+        for row in rows:
+            writer.writerow([row[c] for c in columns])
+    with open(os.path.join(out_dir, "report.json"), "w", encoding="utf-8") as f:
+        json.dump(rows, f, indent=2)
+
+    print("\n--- OPTIMIZED VARIANTS (best accuracy per ms first) ---")
+    print(f"{'variant':<16}{'accuracy':>10}{'f1':>8}{'size MB':>9}{'gzip MB':>9}{'ms/image':>10}{'acc/ms':>9}")
+    for row in sorted(rows, key=lambda r: r["accuracy_per_ms"] or 0, reverse=True):
+        print(f"{row['variant']:<16}{row['accuracy']:>10.4f}{row['f1']:>8.4f}{row['size_mb']:>9}{row['gzip_mb']:>9}"
+              f"{row['latency_ms']:>10}{row['accuracy_per_ms']:>9}")
+    print(f"\n📄 Report written to {os.path.join(out_dir, 'report.csv')}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Prune, cluster and quantize a trained Keras model")
+    parser.add_argument("model", help="Trained .h5/.keras model (new/train.py or model.py)")
+    parser.add_argument("--test-dir", required=True, help="Class-per-folder test images (or a compiled shard dir)")
+    parser.add_argument("--out", help="Output directory (default: models/optimized/<model name>)")
+    parser.add_argument("--sparsity", type=float, default=0.5, help="Fraction of each kernel pruned")
+    parser.add_argument("--clusters", type=int, default=16, help="Distinct weight values per kernel")
+    parser.add_argument("--finetune-dir", help="Images to fine-tune the pruned model on (mask held fixed)")
+    parser.add_argument("--finetune-epochs", type=int, default=2)
+    parser.add_argument("--calibration-dir", help="Images to calibrate int8 on (default: --finetune-dir)")
+    parser.add_argument("--calibration-images", type=int, default=100, help="int8 calibration images")
+    parser.add_argument("--max-eval", type=int, help="Evaluate on at most this many test images")
+    parser.add_argument("--threads", type=int, help="TFLite interpreter threads")
+    parser.add_argument("--no-rescale", action="store_true", help="Feed 0-255 pixels (models trained without 1/255)")
+    parser.add_argument("--variants", nargs="+", help="Subset of variants to build")
+    args = parser.parse_args()
+
+    out_dir = args.out or os.path.join(OPTIMIZE_DIR, os.path.splitext(os.path.basename(args.model))[0])
+    optimize(args.model, args.test_dir, out_dir, sparsity=args.sparsity, clusters=args.clusters,
+             finetune_dir=args.finetune_dir, finetune_epochs=args.finetune_epochs,
+             calibration_dir=args.calibration_dir, calibration_images=args.calibration_images, max_eval=args.max_eval, threads=args.threads,
+             rescale=None if args.no_rescale else 1 / 255.0, variants=args.variants)
@@ -0,0 +1,450 @@
+"""
+Prescription generation helpers: prompt, parsing, fallback table and memoization.
+
+The prompt is rendered from a normalized key (disease, age band, sex and
+confidence band) so equivalent requests share one cache entry, and the
+fallback prescriptions for every DISEASE_MAP class are built once at import
+instead of on every failure. Baselines produced by build_prescriptions.py are
+keyed the same way (minus clinical context) and loaded from disk when present.
+"""
+import copy
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+from disease_mapper import DISEASE_MAP
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+BASELINE_PATH = os.environ.get(
+    'PRESCRIPTION_BASELINES', os.path.join(BASE_DIR, 'data', 'prescription_baselines.json')
+)
+CACHE_MAX_ENTRIES = int(os.environ.get('PRESCRIPTION_CACHE_SIZE', 512))
+CACHE_TTL_SECONDS = float(os.environ.get('PRESCRIPTION_CACHE_TTL', 24 * 3600))
+# Serve the precomputed baseline straight from memory when the request carries
+# no clinical context beyond the diagnosis itself and a baseline was built for its bands
+BASELINE_FIRST = os.environ.get('PRESCRIPTION_BASELINE_FIRST', '1') == '1'
+# Baseline file format: entries keyed by baseline_id (disease|age band|sex|confidence band),
+# each {"source": "llm" | "fallback", "prescription": {...}}; only LLM entries are served
+BASELINE_FORMAT = 3
+
+# Try multiple models with fallback (gemini-2.5-flash has better rate limits)
+PRESCRIPTION_MODELS = ['gemini-2.5-flash', 'gemini-2.0-flash', 'gemini-1.5-flash']
+
+def build_prescription_prompt(disease, confidence, patient_name, patient_age, patient_gender, clinical_info):
+    """Build the Gemini prompt for a prescription"""
+    return f"""You are a medical AI assistant. Based on the following chest X-ray diagnosis, generate a detailed prescription and medical recommendations.
+
+DIAGNOSIS DETAILS:
+- Detected Condition: {disease}
+- Confidence Level: {confidence}%
+- Patient Name: {patient_name}
+- Patient Age: {patient_age}
+- Patient Gender: {patient_gender}
+- Clinical Information: {clinical_info}
+
+Please provide a comprehensive response in the following JSON format ONLY (no markdown, no code blocks, just pure JSON):
+{{
+    "medications": [
+        {{"name": "Medication Name", "dosage": "Dosage amount", "frequency": "How often", "duration": "How long"}}
+    ],
+    "precautions": ["List of precautions the patient should take"],
+    "lifestyle_recommendations": ["Lifestyle changes and recommendations"],
+    "follow_up": "Recommended follow-up schedule",
+    "emergency_signs": ["Signs that require immediate medical attention"],
+    "dietary_advice": ["Dietary recommendations"],
+    "tests_recommended": ["Additional tests that may be needed"]
+}}
+
+Important: 
+1. Be specific to the diagnosed condition ({disease})
+2. Consider the patient's age ({patient_age}) when recommending medications
+3. Include appropriate dosages for the condition severity
+4. Always include a disclaimer that this is AI-generated and should be reviewed by a physician"""
+
+def parse_prescription_response(response_text, model_name):
+    """Parse a Gemini completion into a prescription dict"""
+    response_text = response_text.strip()
+    
+    # Clean up response - remove markdown code blocks if present
+    if response_text.startswith('```'):
+        parts = response_text.split('```')
+        if len(parts) >= 2:
+            response_text = parts[1]
+            if response_text.startswith('json'):
+                response_text = response_text[4:]
+    response_text = response_text.strip()
+    
+    prescription_data = json.loads(response_text)
+    problems = validate_prescription(prescription_data)
+    if problems:
+        raise ValueError(f"Invalid prescription from {model_name}: {'; '.join(problems)}")
+    prescription_data['generated_by'] = f'Gemini AI ({model_name})'
+    prescription_data['disclaimer'] = 'This prescription is AI-generated and should be reviewed and approved by a licensed healthcare provider before use.'
+    return prescription_data
+
+# ==================== VALIDATION ====================
+
+REQUIRED_FIELDS = {
+    'medications': list,
+    'precautions': list,
+    'lifestyle_recommendations': list,
+    'follow_up': str,
+    'emergency_signs': list,
+    'dietary_advice': list,
+    'tests_recommended': list,
+}
+
+def validate_prescription(prescription):
+    """Return a list of schema problems (empty when the document is usable)"""
+    if not isinstance(prescription, dict):
+        return ['prescription is not an object']
+    problems = []
+    for field, expected in REQUIRED_FIELDS.items():
+        if not isinstance(prescription.get(field), expected):
+            problems.append(f"'{field}' missing or not a {expected.__name__}")
+    for med in prescription.get('medications') or []:
+        if not isinstance(med, dict) or not med.get('name'):
+            problems.append("medication entry without a name")
+            break
+    return problems
+
+# ==================== FALLBACK TABLE ====================
+
+FALLBACK_RECOMMENDATIONS = {
+    "Pneumonia": {
+        "medications": [
+            {"name": "Amoxicillin", "dosage": "500mg", "frequency": "3 times daily", "duration": "7-10 days"},
+            {"name": "Paracetamol", "dosage": "500mg", "frequency": "As needed for fever", "duration": "Until symptoms resolve"}
+        ],
+        "precautions": ["Complete the full course of antibiotics", "Rest and stay hydrated", "Avoid smoking"],
+        "tests_recommended": ["Follow-up chest X-ray in 2 weeks", "Complete blood count"]
+    },
+    "Tuberculosis": {
+        "medications": [
+            {"name": "DOTS Therapy", "dosage": "As per TB program", "frequency": "Daily under supervision", "duration": "6-9 months"}
+        ],
+        "precautions": ["Strictly follow medication schedule", "Wear mask in public", "Ensure good ventilation"],
+        "tests_recommended": ["Sputum test", "Monthly liver function tests"]
+    },
+    "COVID-19": {
+        "medications": [
+            {"name": "Paracetamol", "dosage": "500-650mg", "frequency": "Every 6 hours if fever", "duration": "As needed"},
+            {"name": "Vitamin C", "dosage": "1000mg", "frequency": "Once daily", "duration": "2 weeks"}
+        ],
+        "precautions": ["Self-isolate for recommended period", "Monitor oxygen levels", "Stay hydrated"],
+        "tests_recommended": ["RT-PCR test", "Pulse oximetry monitoring"]
+    },
+    "Normal": {
+        "medications": [
+            {"name": "No medication required", "dosage": "N/A", "frequency": "N/A", "duration": "N/A"}
+        ],
+        "precautions": ["Maintain healthy lifestyle", "Regular exercise", "Annual health checkup"],
+        "tests_recommended": ["Routine health checkup as needed"]
+    }
+}
+
+DEFAULT_RECOMMENDATION = {
+    "medications": [{"name": "Consult with physician", "dosage": "As directed", "frequency": "N/A", "duration": "N/A"}],
+    "precautions": ["Please consult with a qualified healthcare provider for proper diagnosis and treatment."],
+    "tests_recommended": ["As recommended by physician"]
+}
+
+def build_fallback_prescription(disease):
+    """Static disease-specific fallback prescription"""
+    specific = FALLBACK_RECOMMENDATIONS.get(disease, DEFAULT_RECOMMENDATION)
+    return {
+        'medications': specific.get('medications', DEFAULT_RECOMMENDATION['medications']),
+        'precautions': list(specific.get('precautions', ["Consult healthcare provider"])),
+        'lifestyle_recommendations': [
+            'Maintain a healthy diet',
+            'Get adequate rest',
+            'Stay hydrated',
+            'Follow up with your healthcare provider'
+        ],
+        'follow_up': 'Schedule an appointment with your physician within 1-2 weeks',
+        'emergency_signs': [
+            'Difficulty breathing',
+            'Chest pain',
+            'High fever (>103°F/39.4°C)',
+            'Severe coughing with blood',
+            'Confusion or altered consciousness'
+        ],
+        'dietary_advice': ['Eat nutritious foods', 'Avoid processed foods', 'Stay hydrated'],
+        'tests_recommended': specific.get('tests_recommended', ['As recommended by physician']),
+        'generated_by': 'Smart Fallback System',
+        'disclaimer': 'This is a fallback response. Please consult a healthcare provider for personalized medical advice.'
+    }
+
+def load_baselines(path=BASELINE_PATH):
+    """Load precomputed baseline prescriptions, keeping only valid entries"""
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            payload = json.load(f)
+    except Exception as e:
+        print(f"⚠️ Could not read prescription baselines: {e}")
+        return {}
+
+    if payload.get('version', 1) < BASELINE_FORMAT:
+        # Version 1 was per disease only; version 2 did not mark static-fallback entries
+        print("⚠️ Prescription baselines use an old format; rebuild with build_prescriptions.py")
+        return {}
+
+    baselines = {}
+    skipped = 0
+    for baseline_key, entry in payload.get('entries', {}).items():
+        # A static fallback stored as a baseline would keep the LLM from ever answering its key
+        if entry.get('source') != 'llm':
+            skipped += 1
+            continue
+        if not validate_prescription(entry.get('prescription')):
+            baselines[baseline_key] = entry['prescription']
+    print(f"✅ Loaded {len(baselines)} baseline prescriptions (version {payload.get('version')}"
+          f"{f', {skipped} fallback entries skipped' if skipped else ''})")
+    return baselines
+
+# Built once at startup: validated baselines when available, static fallbacks otherwise
+FALLBACK_TABLE = {disease: build_fallback_prescription(disease) for disease in DISEASE_MAP.values()}
+BASELINES = load_baselines()
+
+def get_baseline_prescription(key):
+    """Precomputed baseline for the key's disease and bands, or None if none was built for them"""
+    baseline = BASELINES.get(baseline_id(key))
+    return copy.deepcopy(baseline) if baseline is not None else None
+
+def get_fallback_prescription(disease, error_msg=""):
+    """Disease-specific fallback prescription served from the precomputed table"""
+    base = FALLBACK_TABLE.get(disease)
+    prescription = copy.deepcopy(base) if base is not None else build_fallback_prescription(disease)
+    if error_msg:
+        prescription['precautions'].append("Note: AI prescription service temporarily unavailable")
+    return prescription
+
+# ==================== REQUEST NORMALIZATION ====================
+
+PrescriptionKey = namedtuple('PrescriptionKey', ['disease', 'age_band', 'sex', 'confidence_band', 'context'])
+
+def baseline_id(key):
+    """Baseline file key: the PrescriptionKey without its clinical context"""
+    return '|'.join((key.disease, key.age_band, key.sex, key.confidence_band))
+
+# Text the predict endpoint returns as clinical_info; it carries nothing beyond the disease
+STOCK_CLINICAL_INFO = 'Diagnosis: {disease}. Please consult with a healthcare professional for proper medical advice.'
+
+AGE_BANDS = [(1, 'infant (<1)'), (13, 'child (1-12)'), (18, 'adolescent (13-17)'),
+             (40, 'adult (18-39)'), (65, 'adult (40-64)'), (200, 'older adult (65+)')]
+CONFIDENCE_BANDS = [(50, 'below 50'), (70, '50-70'), (90, '70-90'), (101, '90-100')]
+
+def age_band(age):
+    try:
+        age = float(age)
+    except (TypeError, ValueError):
+        return 'unknown'
+    for upper, label in AGE_BANDS:
+        if age < upper:
+            return label
+    return 'unknown'
+
+def sex_key(gender):
+    gender = str(gender or '').strip().lower()
+    if gender in ('f', 'female', 'woman'):
+        return 'female'
+    if gender in ('m', 'male', 'man'):
+        return 'male'
+    if gender in ('', 'n/a', 'na', 'unknown', 'none'):
+        return 'unknown'
+    return 'other'
+
+def confidence_band(confidence):
+    try:
+        confidence = float(confidence)
+    except (TypeError, ValueError):
+        return 'unknown'
+    for upper, label in CONFIDENCE_BANDS:
+        if confidence < upper:
+            return label
+    return 'unknown'
+
+def normalize_prescription_request(data):
+    """Reduce a prescription request to its cache key and the clinical text for the prompt"""
+    disease = str(data.get('disease') or 'Unknown').strip()
+    clinical_info = ' '.join(str(data.get('clinical_info') or '').split())
+    if clinical_info == STOCK_CLINICAL_INFO.format(disease=disease):
+        clinical_info = ''
+    context = hashlib.sha1(clinical_info.lower().encode()).hexdigest()[:16] if clinical_info else ''
+    key = PrescriptionKey(
+        disease,
+        age_band(data.get('patient_age')),
+        sex_key(data.get('patient_gender')),
+        confidence_band(data.get('confidence')),
+        context
+    )
+    return key, clinical_info
+
+def build_prompt_for_key(key, clinical_info):
+    """Render the prompt from the normalized key so equal keys give equal prompts"""
+    return build_prescription_prompt(
+        key.disease, key.confidence_band, 'Patient', key.age_band, key.sex,
+        clinical_info or 'Not provided'
+    )
+
+# ==================== CACHE ====================
+
+class PrescriptionCache:
+    """Thread-safe LRU cache with a TTL, keyed by PrescriptionKey"""
+
+    def __init__(self, max_entries=CACHE_MAX_ENTRIES, ttl_seconds=CACHE_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return copy.deepcopy(value)
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, copy.deepcopy(value))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'ttl_seconds': self.ttl_seconds,
+                'hits': self.hits,
+                'misses': self.misses,
+                'baselines': len(BASELINES)
+            }
+
+prescription_cache = PrescriptionCache()
+
+def lookup_prescription(key):
+    """Memory-only lookup: cached LLM result, else the baseline for context-free requests"""
+    cached = prescription_cache.get(key)
+    if cached is not None:
+        return cached
+    if BASELINE_FIRST and not key.context:
+        return get_baseline_prescription(key)
+    return None
+
+# ==================== STREAMING ====================
+
+def sse_event(event, data):
+    """Format one server-sent event"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+class SectionParser:
+    """Pull completed top-level members out of a JSON object as it streams in.
+
+    Markdown fences around the object are ignored; each member is emitted
+    once its value is complete, so clients can render medications,
+    precautions, follow-up etc. while the rest is still being generated.
+    """
+
+    def __init__(self):
+        self.text = ''
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._member_start = None
+
+    def feed(self, chunk):
+        self.text += chunk
+        sections = []
+        while self._pos < len(self.text):
+            ch = self.text[self._pos]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == '\\':
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+            elif self._depth > 0 and ch == '"':
+                self._in_string = True
+            elif ch in '{[':
+                self._depth += 1
+                if self._depth == 1:
+                    self._member_start = self._pos + 1
+            elif ch in '}]' and self._depth > 0:
+                if self._depth == 1:
+                    sections.extend(self._member(self._pos))
+                self._depth -= 1
+            elif ch == ',' and self._depth == 1:
+                sections.extend(self._member(self._pos))
+                self._member_start = self._pos + 1
+            self._pos += 1
+        return sections
+
+    def _member(self, end):
+        member = self.text[self._member_start:end].strip()
+        if not member:
+            return []
+        try:
+            return list(json.loads('{' + member + '}').items())
+        except ValueError:
+            return []
+
+class PrescriptionStream:
+    """Turns streamed LLM text into SSE events and a validated final document"""
+
+    def __init__(self, key, disease):
+        self.key = key
+        self.disease = disease
+        self.parser = SectionParser()
+
+    def start(self, source):
+        return sse_event('meta', {'disease': self.disease, 'source': source})
+
+    def from_memory(self, prescription):
+        """Replay a cached or baseline prescription as sections plus done"""
+        events = [self.start('cache')]
+        events += [sse_event('section', {'name': name, 'value': value}) for name, value in prescription.items()]
+        events.append(sse_event('done', {'prescription': prescription, 'source': 'cache'}))
+        return events
+
+    def on_chunk(self, text):
+        events = [sse_event('token', {'text': text})]
+        for name, value in self.parser.feed(text):
+            events.append(sse_event('section', {'name': name, 'value': value}))
+        return events
+
+    def finish(self, model_name):
+        """Validate the full document; fall back if it does not parse"""
+        try:
+            prescription = parse_prescription_response(self.parser.text, model_name)
+        except Exception as e:
+            return self.fail(f"Invalid prescription from {model_name}: {e}")
+        prescription_cache.put(self.key, prescription)
+        return [sse_event('done', {'prescription': prescription, 'source': 'llm'})]
+
+    def fail(self, error_msg):
+        """Stream broke or produced garbage: finish with the fallback prescription"""
+        print(f"⚠️ Prescription stream failed, using fallback: {str(error_msg)[:100]}")
+        return [
+            sse_event('error', {'error': str(error_msg)[:200]}),
+            sse_event('done', {'prescription': get_fallback_prescription(self.disease, error_msg), 'source': 'fallback'})
+        ]
@@ -0,0 +1,270 @@
+"""
+PDF report renderer shared by the Streamlit app and the API.
+
+Embedded images are downsampled to print resolution for the box they occupy
+and stored as JPEG (passed straight through to the PDF as DCT data), the
+layout constants and paragraph style are built once at import (the static
+text and rules are still drawn into each PDF; every report is a separate
+document), and rendered reports are kept in a bounded cache keyed by
+(record, model version).
+
+Benchmark against full-resolution lossless embedding:
+    python report_renderer.py --bench --image sample_xray.png --runs 20
+"""
+import argparse
+import datetime
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from io import BytesIO
+
+import numpy as np
+from PIL import Image
+from reportlab.lib.colors import black, grey, darkgreen
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.styles import ParagraphStyle, getSampleStyleSheet
+from reportlab.lib.utils import ImageReader
+from reportlab.pdfgen import canvas
+from reportlab.platypus import Paragraph
+
+PRINT_DPI = int(os.environ.get("REPORT_PRINT_DPI", 150))
+JPEG_QUALITY = int(os.environ.get("REPORT_JPEG_QUALITY", 80))
+CACHE_MAX_ENTRIES = int(os.environ.get("REPORT_CACHE_SIZE", 64))
+
+# =========================================================
+# STATIC LAYOUT (geometry and styles built once, drawn per report)
+# =========================================================
+PAGE_WIDTH, PAGE_HEIGHT = A4
+IMAGE_BOX = (220, 180)  # points
+Y_DETAILS = PAGE_HEIGHT - 125
+Y_IMAGES = Y_DETAILS - 140
+Y_CLINICAL = Y_IMAGES - 240
+
+# Own copy so rendering never mutates the shared sample stylesheet
+BODY_STYLE = ParagraphStyle(
+    "ReportBody", parent=getSampleStyleSheet()["Normal"], fontName="Helvetica", fontSize=10, leading=12
+)
+
+DETAIL_LABELS = (
+    "Patient Name:", "Patient ID:", "Age/Sex:", "Referring Dr.:",
+    "Scan Type:", "AI Confidence:", "Predicted Condition:", "Clinical Stage:"
+)
+DISCLAIMER = "MEDICAL DISCLAIMER: For professional decision support only. Review required by a qualified clinician."
+
+
+def _draw_static(c):
+    """Header, section titles, labels and footer: identical on every report"""
+    c.setFont("Helvetica-Bold", 20)
+    c.setFillColor(darkgreen)
+    c.drawCentredString(PAGE_WIDTH / 2, PAGE_HEIGHT - 40, "AI-ASSISTED RADIOLOGY REPORT")
+    c.setStrokeColor(black)
+    c.line(40, PAGE_HEIGHT - 75, PAGE_WIDTH - 40, PAGE_HEIGHT - 75)
+
+    c.setFillColor(black)
+    c.setFont("Helvetica-Bold", 14)
+    c.drawString(40, PAGE_HEIGHT - 100, "1. PATIENT & STUDY DETAILS")
+    c.setFont("Helvetica", 10)
+    for i, label in enumerate(DETAIL_LABELS):
+        c.drawString(40, Y_DETAILS - i * 18, label)
+    c.line(40, Y_DETAILS - 110, PAGE_WIDTH - 40, Y_DETAILS - 110)
+
+    c.setFont("Helvetica-Bold", 14)
+    c.drawString(40, Y_IMAGES, "2. IMAGING RESULTS & LOCALIZATION")
+    c.setFont("Helvetica-Bold", 10)
+    c.drawString(40, Y_IMAGES - 20, "Original X-Ray")
+    c.drawString(300, Y_IMAGES - 20, "Grad-CAM Heatmap")
+
+    c.setFont("Helvetica-Bold", 14)
+    c.drawString(40, Y_CLINICAL, "3. CLINICAL OVERVIEW")
+
+    c.setFont("Helvetica-Bold", 8)
+    c.setFillColor(grey)
+    c.drawCentredString(PAGE_WIDTH / 2, 40, DISCLAIMER)
+
+
+# =========================================================
+# IMAGE PREPARATION
+# =========================================================
+def prepare_image(img, box=IMAGE_BOX, dpi=PRINT_DPI, quality=JPEG_QUALITY):
+    """Downsample to the print size of `box` and encode as JPEG (grayscale when possible)"""
+    if isinstance(img, np.ndarray):
+        img = Image.fromarray(img)
+    max_px = (int(box[0] / 72 * dpi), int(box[1] / 72 * dpi))
+    img = img.convert("RGB")
+    img.thumbnail(max_px, Image.LANCZOS)
+
+    # X-rays are usually grey stored as RGB; one channel is a third of the data
+    channels = np.asarray(img)
+    if np.array_equal(channels[..., 0], channels[..., 1]) and np.array_equal(channels[..., 1], channels[..., 2]):
+        img = img.convert("L")
+
+    out = BytesIO()
+    img.save(out, format="JPEG", quality=quality, optimize=True)
+    out.seek(0)
+    return ImageReader(out)
+
+
+def _full_resolution_image(img):
+    if isinstance(img, np.ndarray):
+        img = Image.fromarray(img)
+    return ImageReader(img)
+
+
+# =========================================================
+# RENDERING
+# =========================================================
+def render_report(original_img, gradcam_img, disease, confidence, clinical_summary, fda_reference,
+                  patient_info, study_date=None, optimize_images=True):
+    """Render the one-page report and return the PDF bytes"""
+    buffer = BytesIO()
+    c = canvas.Canvas(buffer, pagesize=A4, pageCompression=1)
+    _draw_static(c)
+
+    c.setFont("Helvetica", 11)
+    c.setFillColor(grey)
+    c.drawCentredString(PAGE_WIDTH / 2, PAGE_HEIGHT - 60, f"Study Date: {study_date or datetime.date.today()}")
+
+    values = (
+        patient_info.get("name"),
+        patient_info.get("id"),
+        f"{patient_info.get('age')} / {patient_info.get('sex')}",
+        patient_info.get("physician"),
+        patient_info.get("scan_type", "Chest X-ray"),
+        f"{confidence:.2f}%",
+        disease,
+        patient_info.get("stage", "N/A")
+    )
+    c.setFillColor(black)
+    c.setFont("Helvetica-Bold", 10)
+    for i, value in enumerate(values):
+        c.drawString(150, Y_DETAILS - i * 18, str(value))
+
+    load = prepare_image if optimize_images else _full_resolution_image
+    c.drawImage(load(original_img), 40, Y_IMAGES - 210, width=IMAGE_BOX[0], height=IMAGE_BOX[1],
+                preserveAspectRatio=True)
+    c.drawImage(load(gradcam_img), 300, Y_IMAGES - 210, width=IMAGE_BOX[0], height=IMAGE_BOX[1],
+                preserveAspectRatio=True)
+
+    para = Paragraph(clinical_summary, BODY_STYLE)
+    para.wrapOn(c, PAGE_WIDTH - 80, 200)
+    para.drawOn(c, 40, Y_CLINICAL - para.height - 10)
+
+    c.save()
+    return buffer.getvalue()
+
+
+class ReportCache:
+    """Bounded LRU of rendered PDFs keyed by (record, model version)"""
+
+    def __init__(self, max_entries=CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            pdf = self._entries.get(key)
+            if pdf is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return pdf
+
+    def put(self, key, pdf):
+        with self._lock:
+            self._entries[key] = pdf
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+report_cache = ReportCache()
+
+
+def render_report_cached(record_key, model_version, *args, **kwargs):
+    """render_report memoized on (record_key, model_version)"""
+    key = (record_key, model_version)
+    pdf = report_cache.get(key)
+    if pdf is None:
+        pdf = render_report(*args, **kwargs)
+        report_cache.put(key, pdf)
+    return pdf
+
+
+def file_version(path):
+    """Cheap version tag for a model file (name, size, mtime)"""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return "unavailable"
+    tag = f"{os.path.basename(path)}:{stat.st_size}:{int(stat.st_mtime)}"
+    return hashlib.sha1(tag.encode()).hexdigest()[:12]
+
+
+# =========================================================
+# BENCHMARK
+# =========================================================
+def _bench_inputs(image_path):
+    if image_path:
+        original = np.asarray(Image.open(image_path).convert("RGB"))
+    else:
+        # Synthetic 2048x2048 grey "film" with noise, about the size of a raw upload
+        rng = np.random.default_rng(0)
+        grey_px = (rng.normal(120, 40, (2048, 2048)).clip(0, 255)).astype(np.uint8)
+        original = np.stack([grey_px] * 3, axis=-1)
+    overlay = original.copy()
+    h, w, _ = overlay.shape
+    overlay[h // 4:3 * h // 4, w // 4:3 * w // 4, 1] = 255
+    return original, overlay
+
+
+def benchmark(image_path=None, runs=10):
+    original, overlay = _bench_inputs(image_path)
+    patient = {"name": "Benchmark Patient", "id": "P-0001", "age": 54, "sex": "Female",
+               "physician": "Dr. Bench", "scan_type": "Chest X-ray", "stage": "Stage II"}
+    summary = "Pneumonia is an inflammatory condition of the lung primarily affecting the alveoli. " * 5
+    args = (original, overlay, "Pneumonia", 91.5, summary, "", patient)
+
+    results = {}
+    for label, optimize in (("full-resolution", False), ("print-optimized", True)):
+        times = []
+        for _ in range(runs):
+            start = time.perf_counter()
+            pdf = render_report(*args, optimize_images=optimize)
+            times.append(time.perf_counter() - start)
+        results[label] = (sum(times) / len(times), len(pdf))
+
+    pdf = render_report_cached("bench-record", "bench-model", *args)
+    start = time.perf_counter()
+    for _ in range(runs):
+        render_report_cached("bench-record", "bench-model", *args)
+    results["cached"] = ((time.perf_counter() - start) / runs, len(pdf))
+
+    print(f"📄 Report render benchmark ({original.shape[1]}x{original.shape[0]} input, {runs} runs, {PRINT_DPI} dpi, q={JPEG_QUALITY})")
+    print(f"{'mode':<18}{'ms/report':>12}{'size KB':>12}")
+    for label, (seconds, size) in results.items():
+        print(f"{label:<18}{seconds * 1000:>12.1f}{size / 1024:>12.1f}")
+    base_t, base_size = results["full-resolution"]
+    opt_t, opt_size = results["print-optimized"]
+    print(f"⚡ {base_t / opt_t:.1f}x faster, {base_size / opt_size:.1f}x smaller")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="PDF report renderer")
+    parser.add_argument("--bench", action="store_true", help="Compare full-resolution and optimized rendering")
+    parser.add_argument("--image", help="X-ray to use for the benchmark (synthetic if omitted)")
+    parser.add_argument("--runs", type=int, default=10)
+    args = parser.parse_args()
+    if args.bench:
+        benchmark(args.image, args.runs)
+    else:
+        parser.print_help()
@@ -0,0 +1,273 @@
+"""
+Server-side report generation for the API.
+
+Generation requests are queued to a small background renderer pool; the
+finished PDFs go into a content-addressed store on local disk (one file per
+SHA-256 digest, so identical reports are stored once). A report id is
+derived from (diagnosis id, model version), which makes repeated generate
+calls idempotent and lets a restarted server find reports it built earlier.
+"""
+import datetime
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+from knowledge_pack import get_knowledge_pack
+from report_renderer import render_report
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+STORE_DIR = os.environ.get("REPORT_STORE_DIR", os.path.join(BASE_DIR, "storage"))
+REPORT_WORKERS = int(os.environ.get("REPORT_WORKERS", 2))
+
+QUEUED, RENDERING, DONE, FAILED = "queued", "rendering", "done", "failed"
+
+
+# =========================================================
+# CONTENT-ADDRESSED STORE
+# =========================================================
+class ContentStore:
+    """Blobs stored under their SHA-256 digest, plus small JSON metadata documents"""
+
+    def __init__(self, root=STORE_DIR):
+        self.root = root
+        os.makedirs(os.path.join(root, "blobs"), exist_ok=True)
+        os.makedirs(os.path.join(root, "meta"), exist_ok=True)
+
+    def blob_path(self, digest):
+        return os.path.join(self.root, "blobs", digest[:2], digest)
+
+    def _write_atomic(self, path, data):
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def put(self, data):
+        digest = hashlib.sha256(data).hexdigest()
+        path = self.blob_path(digest)
+        if not os.path.exists(path):
+            self._write_atomic(path, data)
+        return digest
+
+    def get(self, digest):
+        try:
+            with open(self.blob_path(digest), "rb") as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def has(self, digest):
+        return os.path.exists(self.blob_path(digest))
+
+    def put_meta(self, kind, key, value):
+        safe_key = hashlib.sha1(str(key).encode()).hexdigest()
+        self._write_atomic(os.path.join(self.root, "meta", kind, safe_key + ".json"), json.dumps(value).encode())
+
+    def get_meta(self, kind, key):
+        safe_key = hashlib.sha1(str(key).encode()).hexdigest()
+        try:
+            with open(os.path.join(self.root, "meta", kind, safe_key + ".json"), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+
+# =========================================================
+# REPORT CONTENT
+# =========================================================
+def overlay_image(img, confidence):
+    """Localization overlay drawn on a BGR image (same as the predict endpoint)"""
+    h, w, _ = img.shape
+    overlay = img.copy()
+    color = (0, 255, 0) if confidence > 70 else (0, 165, 255)
+    cv2.rectangle(overlay, (w//4, h//4), (3*w//4, 3*h//4), color, -1)
+    return cv2.addWeighted(img, 0.7, overlay, 0.3, 0)
+
+
+def build_report_pdf(record, image_bytes=None):
+    """Render the PDF for one diagnosis record; the scan is optional"""
+    disease = record.get("diagnosis", "Unknown")
+    confidence = float(record.get("confidence") or 0)
+    if image_bytes:
+        img = cv2.imdecode(np.frombuffer(image_bytes, np.uint8), cv2.IMREAD_COLOR)
+    else:
+        img = None
+    if img is None:
+        # Scan not retained: render a blank film so the layout stays the same
+        img = np.full((448, 448, 3), 235, dtype=np.uint8)
+    original = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+    gradcam = cv2.cvtColor(overlay_image(img, confidence), cv2.COLOR_BGR2RGB)
+
+    pack = get_knowledge_pack()
+    summary, _ = pack.summary(disease)
+    drug_info, _ = pack.drug_info(disease)
+    patient_info = {
+        "name": record.get("patient_name"),
+        "id": record.get("patient_id"),
+        "age": record.get("age"),
+        "sex": record.get("sex"),
+        "physician": record.get("physician"),
+    }
+    study_date = str(record.get("timestamp") or "")[:10] or None
+    return render_report(original, gradcam, disease, confidence, summary, drug_info, patient_info,
+                         study_date=study_date)
+
+
+def report_filename(record):
+    return f"{record.get('patient_id', 'patient')}_{str(record.get('diagnosis', 'report')).replace(' ', '_')}_report.pdf"
+
+
+# =========================================================
+# BACKGROUND RENDERER
+# =========================================================
+class ReportJob:
+    """One report: queued -> rendering -> done | failed"""
+
+    def __init__(self, report_id, diagnosis_id, user_id, filename):
+        self.report_id = report_id
+        self.diagnosis_id = diagnosis_id
+        self.user_id = user_id
+        self.filename = filename
+        self.status = QUEUED
+        self.digest = None
+        self.error = None
+        self.size = None
+        self.created_at = datetime.datetime.now().isoformat()
+        self.finished_at = None
+        self._done = threading.Event()
+        self._callbacks = []
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_meta(cls, meta):
+        job = cls(meta["report_id"], meta["diagnosis_id"], meta["user_id"], meta["filename"])
+        job.status, job.digest, job.size = DONE, meta["digest"], meta.get("size")
+        job.created_at, job.finished_at = meta.get("created_at"), meta.get("finished_at")
+        job._done.set()
+        return job
+
+    @property
+    def finished(self):
+        return self._done.is_set()
+
+    def wait(self, timeout=None):
+        return self._done.wait(timeout)
+
+    def add_done_callback(self, fn):
+        """Call fn(job) on completion (immediately if already finished)"""
+        with self._lock:
+            if not self.finished:
+                self._callbacks.append(fn)
+                return
+        fn(self)
+
+    def _finish(self, status, digest=None, size=None, error=None):
+        with self._lock:
+            self.status, self.digest, self.size, self.error = status, digest, size, error
+            self.finished_at = datetime.datetime.now().isoformat()
+            self._done.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for fn in callbacks:
+            fn(self)
+
+    def to_dict(self):
+        return {
+            "report_id": self.report_id,
+            "diagnosis_id": self.diagnosis_id,
+            "status": self.status,
+            "size": self.size,
+            "error": self.error,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+        }
+
+    def to_meta(self):
+        return {**self.to_dict(), "user_id": self.user_id, "filename": self.filename, "digest": self.digest}
+
+
+class ReportService:
+    """Queues report renders and tracks their state"""
+
+    def __init__(self, store, model_version, workers=REPORT_WORKERS):
+        self.store = store
+        self.model_version = model_version
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="report-render")
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def report_id(self, diagnosis_id):
+        return hashlib.sha1(f"{diagnosis_id}:{self.model_version}".encode()).hexdigest()[:20]
+
+    def retain_scan(self, diagnosis_id, image_bytes):
+        """Keep the uploaded scan so its report can be rendered later"""
+        self.store.put_meta("scans", diagnosis_id, {"digest": self.store.put(image_bytes)})
+
+    def scan_bytes(self, diagnosis_id):
+        """Retained upload for a diagnosis, or None"""
+        meta = self.store.get_meta("scans", diagnosis_id)
+        return self.store.get(meta["digest"]) if meta else None
+
+    def get(self, report_id):
+        with self._lock:
+            job = self._jobs.get(report_id)
+        if job is None:
+            meta = self.store.get_meta("reports", report_id)
+            if meta and self.store.has(meta["digest"]):
+                job = ReportJob.from_meta(meta)
+                with self._lock:
+                    job = self._jobs.setdefault(report_id, job)
+        return job
+
+    def submit(self, record, user_id):
+        """Queue a render for a diagnosis record; returns the (possibly existing) job"""
+        report_id = self.report_id(record["id"])
+        existing = self.get(report_id)
+        if existing is not None and existing.status != FAILED:
+            return existing
+
+        job = ReportJob(report_id, str(record["id"]), user_id, report_filename(record))
+        with self._lock:
+            self._jobs[report_id] = job
+        self._executor.submit(self._render, job, record)
+        return job
+
+    def _render(self, job, record):
+        job.status = RENDERING
+        start = time.time()
+        try:
+            pdf = build_report_pdf(record, self.scan_bytes(job.diagnosis_id))
+            digest = self.store.put(pdf)
+            # Persist before signalling so waiters and restarted servers agree
+            self.store.put_meta("reports", job.report_id, {
+                **job.to_meta(), "status": DONE, "digest": digest, "size": len(pdf),
+                "finished_at": datetime.datetime.now().isoformat()
+            })
+            job._finish(DONE, digest=digest, size=len(pdf))
+            print(f"📄 Report {job.report_id} rendered in {time.time() - start:.2f}s ({len(pdf) / 1024:.1f} KB)")
+        except Exception as e:
+            print(f"❌ Report {job.report_id} failed: {e}")
+            job._finish(FAILED, error=str(e))
+
+    def stats(self):
+        with self._lock:
+            jobs = list(self._jobs.values())
+        counts = {}
+        for job in jobs:
+            counts[job.status] = counts.get(job.status, 0) + 1
+        return counts
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
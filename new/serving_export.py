@@ -0,0 +1,158 @@
+"""
+Graph-compiled serving export for the diagnosis model.
+
+`model.predict` goes through Keras' data adapters, callbacks and progress
+machinery on every call, which dominates the cost of a single image. The
+export wraps the model in a tf.function with a fixed signature
+
+    image: uint8[batch, 224, 224, 3]  (BGR, as cv2.imdecode returns it)
+    -> probabilities: float32[batch, num_classes]
+
+that also does the /255 scaling, optionally XLA-compiled, and saves it as a
+SavedModel. The API calls the signature directly.
+
+    python serving_export.py export                  # models/serving/<model name>
+    python serving_export.py export --xla
+    python serving_export.py bench --batch 1 8 32
+"""
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+import tensorflow as tf
+
+from report_renderer import file_version
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+MODEL_PATH = os.path.join(BASE_DIR, "models", os.environ.get("MODEL_FILE", "chest_disease_efficientnetv2.h5"))
+SERVING_DIR = os.path.join(BASE_DIR, "models", "serving")
+EXPORT_META = "export.json"
+
+
+def default_export_dir(model_path):
+    return os.path.join(SERVING_DIR, os.path.splitext(os.path.basename(model_path))[0])
+
+
+class _ServingModule(tf.Module):
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+
+def export_model(model_path=MODEL_PATH, export_dir=None, jit_compile=False):
+    """Write the SavedModel and its export.json; returns the export directory"""
+    export_dir = export_dir or default_export_dir(model_path)
+    model = tf.keras.models.load_model(model_path, compile=False)
+    height, width = model.input_shape[1:3]
+    module = _ServingModule(model)
+
+    @tf.function(input_signature=[tf.TensorSpec([None, height, width, 3], tf.uint8, name="image")],
+                 jit_compile=jit_compile)
+    def serve(image):
+        x = tf.cast(image, tf.float32) / 255.0
+        return {"probabilities": module.model(x, training=False)}
+
+    start = time.time()
+    tf.saved_model.save(module, export_dir, signatures={"serving_default": serve})
+    meta = {
+        "source": os.path.basename(model_path),
+        "model_version": file_version(model_path),
+        "input": {"name": "image", "dtype": "uint8", "shape": [None, height, width, 3], "channels": "BGR"},
+        "output": "probabilities",
+        "jit_compile": jit_compile,
+        "exported_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+    with open(os.path.join(export_dir, EXPORT_META), "w", encoding="utf-8") as f:
+        json.dump(meta, f, indent=2)
+    print(f"✅ Exported {model_path} -> {export_dir} (XLA: {jit_compile}) in {time.time() - start:.1f}s")
+    return export_dir
+
+
+class ServingModel:
+    """Calls the exported serving signature directly; feed uint8 BGR batches"""
+
+    def __init__(self, export_dir):
+        self.export_dir = export_dir
+        with open(os.path.join(export_dir, EXPORT_META), "r", encoding="utf-8") as f:
+            self.meta = json.load(f)
+        self._loaded = tf.saved_model.load(export_dir)
+        self._serve = self._loaded.signatures["serving_default"]
+        self.input_shape = tuple(self.meta["input"]["shape"])
+
+    def __call__(self, images):
+        """uint8 [batch, H, W, 3] -> numpy probabilities [batch, classes]"""
+        return self._serve(image=tf.convert_to_tensor(images, dtype=tf.uint8))["probabilities"].numpy()
+
+
+def load_serving_model(export_dir, model_path):
+    """ServingModel for model_path, or None if there is no export or it was made from another model file"""
+    if not os.path.exists(os.path.join(export_dir, EXPORT_META)):
+        return None
+    serving = ServingModel(export_dir)
+    if serving.meta.get("model_version") != file_version(model_path):
+        print(f"⚠️ Serving export in {export_dir} is stale for {os.path.basename(model_path)}; "
+              f"re-run serving_export.py export")
+        return None
+    return serving
+
+
+# =========================================================
+# BENCHMARK
+# =========================================================
+def _time(fn, runs):
+    fn()  # warm-up / trace
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - start) * 1000)
+    return float(np.median(timings))
+
+
+def benchmark(model_path, export_dirs, batch_sizes=(1, 8, 32), runs=20):
+    """Median ms per call: Keras predict vs the exported signature(s)"""
+    model = tf.keras.models.load_model(model_path, compile=False)
+    servings = {label: ServingModel(path) for label, path in export_dirs.items()}
+    height, width = model.input_shape[1:3]
+    columns = ["predict", "predict_on_batch", *servings]
+    print(f"\n{'batch':>6}" + "".join(f"{c:>18}" for c in columns))
+    results = {}
+    for batch in batch_sizes:
+        images = np.random.randint(0, 256, (batch, height, width, 3), dtype=np.uint8)
+        scaled = images.astype(np.float32) / 255.0
+        row = [
+            _time(lambda: model.predict(scaled, verbose=0), runs),
+            _time(lambda: model.predict_on_batch(scaled), runs),
+        ]
+        row += [_time(lambda s=serving: s(images), runs) for serving in servings.values()]
+        results[batch] = dict(zip(columns, row))
+        print(f"{batch:>6}" + "".join(f"{ms:>18.1f}" for ms in row))
+    print("(median ms per call; the signature timings include the uint8 -> float /255 step)")
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="SavedModel serving export")
+    sub = parser.add_subparsers(dest="command", required=True)
+    export = sub.add_parser("export", help="Write the SavedModel with the uint8 serving signature")
+    export.add_argument("--model", default=MODEL_PATH)
+    export.add_argument("--out", help="Export directory (default: models/serving/<model name>)")
+    export.add_argument("--xla", action="store_true", help="XLA-compile the serving function")
+    bench = sub.add_parser("bench", help="Compare Keras predict with the exported signature")
+    bench.add_argument("--model", default=MODEL_PATH)
+    bench.add_argument("--batch", type=int, nargs="+", default=[1, 8, 32])
+    bench.add_argument("--runs", type=int, default=20)
+    args = parser.parse_args()
+
+    if args.command == "export":
+        export_model(args.model, args.out, args.xla)
+    else:
+        base = default_export_dir(args.model)
+        dirs = {"signature": base, "signature+xla": base + "_xla"}
+        if not os.path.exists(os.path.join(dirs["signature"], EXPORT_META)):
+            export_model(args.model, dirs["signature"], False)
+        if not os.path.exists(os.path.join(dirs["signature+xla"], EXPORT_META)):
+            export_model(args.model, dirs["signature+xla"], True)
+        benchmark(args.model, dirs, args.batch, args.runs)
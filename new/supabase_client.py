@@ -23,3 +23,13 @@ supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
 def get_supabase_client():
     """Return the Supabase client instance"""
     return supabase
+
+_async_supabase = None
+
+async def get_async_supabase_client():
+    """Return the shared non-blocking Supabase client (created on first use)"""
+    global _async_supabase
+    if _async_supabase is None:
+        from supabase import acreate_client
+        _async_supabase = await acreate_client(SUPABASE_URL, SUPABASE_KEY)
+    return _async_supabase
@@ -0,0 +1,143 @@
+"""
+Architecture sweep runner for train.py.
+
+Every architecture trains in its own subprocess (`train.py --only NAME`),
+so a crash or memory blowup only loses that run. At most `workers` runs are
+active at once and each is pinned to `threads` CPU threads. Status and
+results are kept per run under SWEEP_DIR; a restarted sweep skips runs that
+already finished and re-runs the rest.
+"""
+import csv
+import datetime
+import json
+import os
+import subprocess
+import sys
+import time
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+TRAIN_SCRIPT = os.path.join(BASE_DIR, "train.py")
+
+PENDING, RUNNING, DONE, FAILED = "pending", "running", "done", "failed"
+RESULT_COLUMNS = ("model", "status", "val_accuracy", "train_minutes", "latency_ms", "params", "images_per_second",
+                  "input_wait_share", "model_path")
+
+
+def _now():
+    return datetime.datetime.now().isoformat(timespec="seconds")
+
+
+def _write_json(path, value):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(value, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def read_status(sweep_dir, name):
+    try:
+        with open(os.path.join(sweep_dir, f"{name}.json"), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {"model": name, "status": PENDING}
+
+
+def child_env(threads, weights_dir):
+    """Environment for one run: CPU thread budget and the local weight cache"""
+    env = dict(os.environ)
+    env.update(OMP_NUM_THREADS=str(threads), TF_NUM_INTRAOP_THREADS=str(threads),
+               TF_NUM_INTEROP_THREADS="2", KERAS_HOME=weights_dir)
+    return env
+
+
+def default_threads(workers):
+    return max(1, (os.cpu_count() or 1) // max(1, workers))
+
+
+def fetch_weights(models, weights_dir):
+    """Download the ImageNet weights of each architecture into the local cache (needs network)"""
+    for name in models:
+        print(f"⬇️ Fetching weights for {name}")
+        subprocess.run([sys.executable, TRAIN_SCRIPT, "--only", name, "--fetch-weights"],
+                       env=child_env(default_threads(1), weights_dir), check=False)
+
+
+def run_sweep(models, sweep_dir, weights_dir, workers=1, threads=0, force=False, poll_seconds=2):
+    """Train every model not yet done, `workers` at a time; returns the result rows"""
+    os.makedirs(sweep_dir, exist_ok=True)
+    threads = threads or default_threads(workers)
+
+    queue = []
+    for name in models:
+        status = read_status(sweep_dir, name)
+        if status["status"] == DONE and not force:
+            print(f"⏭️ {name}: already done (val_accuracy {status.get('val_accuracy')})")
+            continue
+        queue.append(name)
+
+    print(f"🚀 Sweep: {len(queue)} runs, {workers} at a time, {threads} threads each")
+    running = {}
+    while queue or running:
+        while queue and len(running) < workers:
+            name = queue.pop(0)
+            result_path = os.path.join(sweep_dir, f"{name}.result.json")
+            if os.path.exists(result_path):
+                os.remove(result_path)
+            log = open(os.path.join(sweep_dir, f"{name}.log"), "w", encoding="utf-8")
+            process = subprocess.Popen(
+                [sys.executable, TRAIN_SCRIPT, "--only", name, "--threads", str(threads), "--result", result_path],
+                stdout=log, stderr=subprocess.STDOUT, env=child_env(threads, weights_dir), cwd=BASE_DIR
+            )
+            running[name] = (process, log, time.time())
+            _write_json(os.path.join(sweep_dir, f"{name}.json"),
+                        {"model": name, "status": RUNNING, "pid": process.pid, "started_at": _now()})
+            print(f"▶️ {name} started (pid {process.pid}, log {log.name})")
+
+        time.sleep(poll_seconds)
+        for name, (process, log, started) in list(running.items()):
+            if process.poll() is None:
+                continue
+            log.close()
+            del running[name]
+            _finish(sweep_dir, name, process.returncode, started)
+
+    rows = [read_status(sweep_dir, name) for name in models]
+    write_results(sweep_dir, rows)
+    return rows
+
+
+def _finish(sweep_dir, name, returncode, started):
+    status = {"model": name, "returncode": returncode, "finished_at": _now(),
+              "wall_minutes": round((time.time() - started) / 60, 2)}
+    try:
+        with open(os.path.join(sweep_dir, f"{name}.result.json"), "r", encoding="utf-8") as f:
+            status.update(json.load(f))
+    except (OSError, ValueError):
+        pass
+    status["status"] = DONE if returncode == 0 and "val_accuracy" in status else FAILED
+    _write_json(os.path.join(sweep_dir, f"{name}.json"), status)
+    if status["status"] == DONE:
+        print(f"✅ {name}: val_accuracy {status['val_accuracy']:.4f}, {status['train_minutes']:.1f} min, "
+              f"{status['latency_ms']:.1f} ms/image")
+    else:
+        print(f"❌ {name} failed (exit {returncode}); see {os.path.join(sweep_dir, name + '.log')}")
+
+
+def write_results(sweep_dir, rows):
+    """Comparison table as results.csv, printed best-first"""
+    rows = sorted(rows, key=lambda r: (r.get("status") != DONE, -(r.get("val_accuracy") or 0)))
+    with open(os.path.join(sweep_dir, "results.csv"), "w", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(RESULT_COLUMNS)
+        for row in rows:
+            writer.writerow([row.get(c, "") for c in RESULT_COLUMNS])
+
+    print("\n--- FINAL PERFORMANCE COMPARISON ---")
+    print(f"{'model':<20}{'status':<9}{'val_acc':>9}{'train_min':>11}{'ms/image':>10}{'params':>13}")
+    for row in rows:
+        if row.get("status") == DONE:
+            print(f"{row['model']:<20}{row['status']:<9}{row['val_accuracy']:>9.4f}{row['train_minutes']:>11.1f}"
+                  f"{row['latency_ms']:>10.1f}{row['params']:>13,}")
+        else:
+            print(f"{row['model']:<20}{row.get('status', PENDING):<9}")
+    print(f"\n📊 Results written to {os.path.join(sweep_dir, 'results.csv')}")
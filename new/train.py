@@ -1,13 +1,18 @@
 import os
+import sys
+import json
+import time
+import argparse
 import numpy as np
 import tensorflow as tf
 from sklearn.utils import class_weight
 from tensorflow.keras.preprocessing.image import ImageDataGenerator
 from tensorflow.keras.models import Model
-from tensorflow.keras.layers import Dense, Dropout, GlobalAveragePooling2D, BatchNormalization
+from tensorflow.keras.layers import Input, Dense, Dropout, GlobalAveragePooling2D, BatchNormalization
 from tensorflow.keras.callbacks import ModelCheckpoint, EarlyStopping
 from tensorflow.keras.optimizers import Adam
-from tensorflow.keras import backend as K
+
+from training_profiler import ThroughputProfiler
 
 # --- CONFIGURATION ---
 DATASET_DIR = r"D:/project/new/dataset"
@@ -33,79 +38,246 @@ MODELS_TO_TRAIN = {
     "ConvNeXtTiny": ConvNeXtTiny
 }
 
+# ImageNet weights (include_top=False) are read from a local cache so runs work offline.
+# Fill it once with `python train.py --fetch-weights`, or copy the files into WEIGHTS_DIR/models.
+WEIGHTS_DIR = os.environ.get("WEIGHTS_DIR", os.path.join(MODEL_DIR, "weights"))
+WEIGHT_FILES = {
+    "InceptionResNetV2": "inception_resnet_v2_weights_tf_dim_ordering_tf_kernels_notop.h5",
+    "VGG16": "vgg16_weights_tf_dim_ordering_tf_kernels_notop.h5",
+    "Xception": "xception_weights_tf_dim_ordering_tf_kernels_notop.h5",
+    "NASNetMobile": "nasnet_mobile_no_top.h5",
+    "ConvNeXtTiny": "convnext_tiny_notop.h5",
+}
+SWEEP_DIR = os.environ.get("SWEEP_DIR", os.path.join(MODEL_DIR, "sweep"))
+
+
+def pretrained_weights(name):
+    """Local weight file if cached, else "imagenet" (downloaded into KERAS_HOME) unless WEIGHTS_OFFLINE=1"""
+    path = os.path.join(WEIGHTS_DIR, "models", WEIGHT_FILES.get(name, ""))
+    if name in WEIGHT_FILES and os.path.exists(path):
+        return path
+    if os.environ.get("WEIGHTS_OFFLINE") == "1":
+        raise FileNotFoundError(f"No cached weights for {name} at {path}; run train.py --fetch-weights")
+    return "imagenet"
+
+
+# --- SWEEP ---
+# `python train.py` runs the sweep: one subprocess per architecture (sweep.py).
+# `python train.py --only NAME` trains a single architecture in this process.
+parser = argparse.ArgumentParser(description="Train and compare the MODELS_TO_TRAIN architectures")
+parser.add_argument("--models", nargs="+", default=list(MODELS_TO_TRAIN), choices=list(MODELS_TO_TRAIN))
+parser.add_argument("--workers", type=int, default=int(os.environ.get("SWEEP_WORKERS", 1)),
+                    help="Architectures trained at the same time")
+parser.add_argument("--threads", type=int, default=int(os.environ.get("SWEEP_THREADS", 0)),
+                    help="CPU threads per run (default: cores / workers)")
+parser.add_argument("--force", action="store_true", help="Re-run architectures that already finished")
+parser.add_argument("--report", action="store_true", help="Only print the comparison table")
+parser.add_argument("--fetch-weights", action="store_true", help="Download ImageNet weights into WEIGHTS_DIR")
+parser.add_argument("--only", help=argparse.SUPPRESS)
+parser.add_argument("--result", help=argparse.SUPPRESS)
+args = parser.parse_args()
+
+if not args.only:
+    import sweep
+    if args.fetch_weights:
+        sweep.fetch_weights(args.models, WEIGHTS_DIR)
+    elif args.report:
+        sweep.write_results(SWEEP_DIR, [sweep.read_status(SWEEP_DIR, name) for name in args.models])
+    else:
+        sweep.run_sweep(args.models, SWEEP_DIR, WEIGHTS_DIR, workers=args.workers, threads=args.threads,
+                        force=args.force)
+    sys.exit(0)
+
+if args.fetch_weights:
+    MODELS_TO_TRAIN[args.only](weights="imagenet", include_top=False, input_shape=(224, 224, 3))
+    print(f"✅ Weights for {args.only} cached")
+    sys.exit(0)
+
+if args.threads:
+    tf.config.threading.set_intra_op_parallelism_threads(args.threads)
+    tf.config.threading.set_inter_op_parallelism_threads(2)
+
 # --- DATA PREPARATION ---
-train_gen = ImageDataGenerator(
-    rescale=1./255,
-    validation_split=0.2,
-    rotation_range=20,
-    horizontal_flip=True
-)
+# "generator" = ImageDataGenerator, "tfdata" = parallel tf.data loader (data_pipeline.py),
+# "shards" = tf.data over the memory-mapped shards compiled from DATASET_DIR (dataset_shards.py)
+INPUT_PIPELINE = os.environ.get("INPUT_PIPELINE", "generator")
+SHARDS_DIR = os.environ.get("SHARDS_DIR", DATASET_DIR.rstrip("/\\") + "_shards")
+
+if INPUT_PIPELINE in ("tfdata", "shards"):
+    from data_pipeline import build_dataset
 
-# Note: Some models like InceptionV3 prefer 299x299, but 224x224 works for all as a baseline
-train_data = train_gen.flow_from_directory(DATASET_DIR, target_size=(224, 224), batch_size=32, class_mode="categorical", subset="training")
-val_data = train_gen.flow_from_directory(DATASET_DIR, target_size=(224, 224), batch_size=32, class_mode="categorical", subset="validation")
+    source_dir = DATASET_DIR
+    if INPUT_PIPELINE == "shards":
+        from dataset_shards import compile_shards
+        compile_shards(DATASET_DIR, SHARDS_DIR)  # only new or changed images are decoded
+        source_dir = SHARDS_DIR
 
-num_classes = train_data.num_classes
-y_train = train_data.classes
+    # Validation images are not augmented here (the generator path augments both subsets)
+    train_data, train_info = build_dataset(source_dir, batch_size=32, training=True, rotation_range=20,
+                                           horizontal_flip=True, validation_split=0.2, subset="training")
+    val_data, _ = build_dataset(source_dir, batch_size=32, validation_split=0.2, subset="validation")
+else:
+    train_gen = ImageDataGenerator(
+        rescale=1./255,
+        validation_split=0.2,
+        rotation_range=20,
+        horizontal_flip=True
+    )
+
+    # Note: Some models like InceptionV3 prefer 299x299, but 224x224 works for all as a baseline
+    train_data = train_gen.flow_from_directory(DATASET_DIR, target_size=(224, 224), batch_size=32, class_mode="categorical", subset="training")
+    val_data = train_gen.flow_from_directory(DATASET_DIR, target_size=(224, 224), batch_size=32, class_mode="categorical", subset="validation")
+    train_info = train_data
+
+num_classes = train_info.num_classes
+y_train = train_info.classes
 weights = class_weight.compute_class_weight('balanced', classes=np.unique(y_train), y=y_train)
 class_weights = dict(enumerate(weights))
+train_steps = train_info.steps if INPUT_PIPELINE in ("tfdata", "shards") else len(train_data)
+
+# --- FEATURE CACHE (Phase 1) ---
+# FEATURE_CACHE=1 trains the Phase 1 head on pooled backbone features computed once per
+# architecture and stored on disk, instead of running the frozen backbone every epoch.
+# FEATURE_AUGMENT_COPIES adds that many fixed augmented passes over the training split.
+FEATURE_CACHE = os.environ.get("FEATURE_CACHE", "0") == "1"
+FEATURE_CACHE_DIR = os.environ.get("FEATURE_CACHE_DIR", os.path.join(MODEL_DIR, "feature_cache"))
+FEATURE_AUGMENT_COPIES = int(os.environ.get("FEATURE_AUGMENT_COPIES", 0))
+
+if FEATURE_CACHE:
+    from feature_cache import cached_features, dataset_fingerprint, extract_features
+    data_fingerprint = dataset_fingerprint(DATASET_DIR)
+
+
+def clean_data(subset):
+    """Un-augmented, unshuffled split for feature extraction"""
+    if INPUT_PIPELINE in ("tfdata", "shards"):
+        data, info = build_dataset(source_dir, batch_size=32, validation_split=0.2, subset=subset)
+        return data, info.steps
+    plain_gen = ImageDataGenerator(rescale=1./255, validation_split=0.2)
+    flow = plain_gen.flow_from_directory(DATASET_DIR, target_size=(224, 224), batch_size=32, class_mode="categorical",
+                                         subset=subset, shuffle=False)
+    return flow, len(flow)
+
+
+def phase1_features(name, encoder):
+    """Cached (train_x, train_y, val_x, val_y) pooled features for one architecture"""
+    def train_features():
+        features, labels = extract_features(encoder, *clean_data("training"))
+        for _ in range(FEATURE_AUGMENT_COPIES):
+            extra_features, extra_labels = extract_features(encoder, train_data, train_steps)
+            features = np.concatenate([features, extra_features])
+            labels = np.concatenate([labels, extra_labels])
+        return features, labels
+
+    key = f"{name}|{INPUT_PIPELINE}|{data_fingerprint}"
+    train_x, train_y = cached_features(FEATURE_CACHE_DIR, f"{key}|training|x{FEATURE_AUGMENT_COPIES}", train_features)
+    val_x, val_y = cached_features(FEATURE_CACHE_DIR, f"{key}|validation",
+                                   lambda: extract_features(encoder, *clean_data("validation")))
+    return train_x, train_y, val_x, val_y
+
 
 # --- MODEL FACTORY FUNCTION ---
-def build_model(model_func, num_classes):
-    base_model = model_func(weights="imagenet", include_top=False, input_shape=(224, 224, 3))
+def build_head(num_classes):
+    """Classifier head layers, shared by the full model and the cached-feature head model"""
+    return [BatchNormalization(), Dense(256, activation='relu'), Dropout(0.4), Dense(num_classes, activation="softmax")]
+
+
+def apply_head(head, x):
+    for layer in head:
+        x = layer(x)
+    return x
+
+
+def build_model(name, num_classes):
+    """(full model, image -> pooled features encoder, pooled features -> probabilities head)"""
+    base_model = MODELS_TO_TRAIN[name](weights=pretrained_weights(name), include_top=False, input_shape=(224, 224, 3))
     base_model.trainable = False  # Freeze for Phase 1
     
-    x = GlobalAveragePooling2D()(base_model.output)
-    x = BatchNormalization()(x)
-    x = Dense(256, activation='relu')(x)
-    x = Dropout(0.4)(x)
-    outputs = Dense(num_classes, activation="softmax")(x)
-    
-    return Model(inputs=base_model.input, outputs=outputs)
+    pooled = GlobalAveragePooling2D()(base_model.output)
+    head = build_head(num_classes)
+    model = Model(inputs=base_model.input, outputs=apply_head(head, pooled))
 
-# --- LOOP THROUGH MODELS ---
-results = {}
+    encoder = Model(inputs=base_model.input, outputs=pooled)
+    features = Input(shape=pooled.shape[1:])
+    head_model = Model(inputs=features, outputs=apply_head(head, features))
+    return model, encoder, head_model
 
-for name, model_func in MODELS_TO_TRAIN.items():
-    print(f"\n{'='*40}\nSTARTING TRAINING: {name}\n{'='*40}")
-    
-    # 1. Build and Compile
-    model = build_model(model_func, num_classes)
-    model.compile(optimizer=Adam(1e-4), loss="categorical_crossentropy", metrics=["accuracy"])
-    
-    # 2. Path for this specific model
-    current_model_path = os.path.join(MODEL_DIR, f"chest_model_{name}.h5")
-    
-    # 3. Callbacks
-    callbacks = [
-        ModelCheckpoint(current_model_path, monitor='val_accuracy', save_best_only=True, mode='max', verbose=0),
-        EarlyStopping(monitor='val_loss', patience=3, restore_best_weights=True)
-    ]
-    
-    # 4. Phase 1: Train Head
-    history = model.fit(
-        train_data, validation_data=val_data,
-        epochs=5, callbacks=callbacks, class_weight=class_weights
+def inference_latency(model, runs=20):
+    """Median milliseconds to classify one 224x224 image"""
+    image = np.zeros((1, 224, 224, 3), dtype=np.float32)
+    model.predict_on_batch(image)  # warm-up
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        model.predict_on_batch(image)
+        timings.append((time.perf_counter() - start) * 1000)
+    return float(np.median(timings))
+
+
+# --- TRAIN ONE ARCHITECTURE ---
+name = args.only
+print(f"\n{'='*40}\nSTARTING TRAINING: {name}\n{'='*40}")
+start = time.time()
+
+# 1. Build and Compile
+model, encoder, head_model = build_model(name, num_classes)
+model.compile(optimizer=Adam(1e-4), loss="categorical_crossentropy", metrics=["accuracy"])
+
+# 2. Path for this specific model
+current_model_path = os.path.join(MODEL_DIR, f"chest_model_{name}.h5")
+
+# 3. Callbacks (throughput / input-stall report next to the checkpoint, trace via PROFILE_STEPS)
+profiler = ThroughputProfiler(os.path.join(MODEL_DIR, f"chest_model_{name}_throughput.json"), batch_size=32)
+callbacks = [
+    ModelCheckpoint(current_model_path, monitor='val_accuracy', save_best_only=True, mode='max', verbose=0),
+    EarlyStopping(monitor='val_loss', patience=3, restore_best_weights=True),
+    profiler
+]
+
+# 4. Phase 1: Train Head
+if FEATURE_CACHE:
+    # The head layers are shared, so the full model picks up these weights for Phase 2
+    train_x, train_y, val_x, val_y = phase1_features(name, encoder)
+    head_model.compile(optimizer=Adam(1e-4), loss="sparse_categorical_crossentropy", metrics=["accuracy"])
+    profiler.phase = "phase1_cached"
+    history = head_model.fit(
+        train_x, train_y, validation_data=(val_x, val_y), batch_size=32,
+        epochs=5, callbacks=[EarlyStopping(monitor='val_loss', patience=3, restore_best_weights=True), profiler],
+        class_weight=class_weights
     )
-    
-    # 5. Phase 2: Simple Fine-Tuning
-    print(f"Fine-tuning {name}...")
-    model.trainable = True
-    model.compile(optimizer=Adam(1e-6), loss="categorical_crossentropy", metrics=["accuracy"])
-    
-    history_fine = model.fit(
-        train_data, validation_data=val_data,
+else:
+    profiler.phase = "phase1"
+    history = model.fit(
+        profiler.wrap(train_data), validation_data=val_data,
         epochs=5, callbacks=callbacks, class_weight=class_weights
     )
-    
-    # Store the best accuracy achieved
-    results[name] = max(history_fine.history['val_accuracy'])
-    
-    # CRITICAL: Clear memory to avoid crash
-    K.clear_session()
-    del model
-
-# --- FINAL SUMMARY ---
-print("\n--- FINAL PERFORMANCE COMPARISON ---")
-for model_name, acc in sorted(results.items(), key=lambda item: item[1], reverse=True):
-    print(f"{model_name}: {acc:.4f}")
\ No newline at end of file
+
+# 5. Phase 2: Simple Fine-Tuning
+print(f"Fine-tuning {name}...")
+model.trainable = True
+model.compile(optimizer=Adam(1e-6), loss="categorical_crossentropy", metrics=["accuracy"])
+
+profiler.phase = "fine_tune"
+history_fine = model.fit(
+    profiler.wrap(train_data), validation_data=val_data,
+    epochs=5, callbacks=callbacks, class_weight=class_weights
+)
+train_seconds = time.time() - start
+
+# --- RESULT ---
+throughput = profiler.summary()
+result = {
+    "model": name,
+    "val_accuracy": float(max(history_fine.history['val_accuracy'])),
+    "phase1_val_accuracy": float(max(history.history['val_accuracy'])),
+    "train_minutes": round(train_seconds / 60, 2),
+    "latency_ms": round(inference_latency(model), 2),
+    "params": int(model.count_params()),
+    "model_path": current_model_path,
+    "images_per_second": throughput["mean_images_per_second"],
+    "input_wait_share": throughput["input_wait_share"],
+}
+print(f"{name}: {result['val_accuracy']:.4f} ({result['train_minutes']:.1f} min, {result['latency_ms']:.1f} ms/image)")
+if args.result:
+    with open(args.result, "w", encoding="utf-8") as f:
+        json.dump(result, f)
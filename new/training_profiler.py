@@ -0,0 +1,226 @@
+"""
+Training throughput profiler.
+
+A Keras callback that reports, per epoch, images per second, how much of the
+training time was spent waiting on the input pipeline versus inside the
+train step, and peak memory, and writes them to a JSON report next to the
+model checkpoint. Optionally captures a TensorFlow profiler trace for a
+window of steps (open it in TensorBoard's Profile tab).
+
+Keras prefetches every input type and pulls the next batch inside the train
+step, so the wait cannot be timed from callbacks alone. `wrap()` stamps each
+batch with the time the pipeline produced it; a step whose batch was ready
+before the step began did not wait on input, otherwise it waited the
+difference. Inputs that are not wrapped (e.g. numpy arrays) are reported
+without a wait figure.
+
+    profiler = ThroughputProfiler("models/chest_model_throughput.json", trace_steps=(20, 40))
+    model.fit(profiler.wrap(train_data), callbacks=[profiler], ...)
+"""
+import collections
+import json
+import os
+import time
+
+import numpy as np
+import tensorflow as tf
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# "START,STOP": capture a TF profiler trace of global training steps START..STOP
+PROFILE_STEPS = os.environ.get("PROFILE_STEPS", "")
+# Share of training time waiting on input above which an epoch is flagged input-bound
+INPUT_BOUND_SHARE = float(os.environ.get("INPUT_BOUND_SHARE", 0.2))
+
+
+def parse_steps(value):
+    """"20,40" -> (20, 40); empty -> None"""
+    if not value:
+        return None
+    start, stop = (int(v) for v in str(value).split(","))
+    return start, stop
+
+
+def peak_rss_mb():
+    """Peak resident memory of this process so far (None where unavailable)"""
+    if resource is None:
+        return None
+    # ru_maxrss is KiB on Linux
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+class _StampedSequence(tf.keras.utils.Sequence):
+    """Sequence / DirectoryIterator view that stamps each batch as it is produced"""
+
+    def __init__(self, sequence, stamp):
+        super().__init__()
+        self.sequence = sequence
+        self.stamp = stamp
+
+    def __len__(self):
+        return len(self.sequence)
+
+    def __getitem__(self, index):
+        batch = self.sequence[index]
+        self.stamp(len(batch[0]))
+        return batch
+
+    def on_epoch_end(self):
+        self.sequence.on_epoch_end()
+
+
+class ThroughputProfiler(tf.keras.callbacks.Callback):
+    """Per-epoch throughput, input wait vs step time and peak memory, written to report_path"""
+
+    def __init__(self, report_path, batch_size=None, trace_steps=parse_steps(PROFILE_STEPS), phase="train"):
+        super().__init__()
+        self.report_path = report_path
+        self.batch_size = batch_size  # images per batch for inputs that are not wrapped
+        self.trace_steps = trace_steps
+        self.trace_dir = os.path.splitext(report_path)[0] + "_trace"
+        self.phase = phase  # set before each fit() when one profiler spans several
+        self.epochs = self._load_previous()
+        self.global_step = 0
+        self._ready = collections.deque()
+        self._wrapped = False
+        self._tracing = False
+
+    # -- input stamping --
+    def _stamp(self, size):
+        self._ready.append((time.perf_counter(), int(size)))
+
+    def _stamp_tensor(self, size):
+        self._stamp(size)
+        return np.int64(0)
+
+    def wrap(self, data):
+        """Training input that reports when each batch is ready; other inputs are returned unchanged"""
+        if isinstance(data, tf.data.Dataset):
+            def stamp(*batch):
+                size = tf.shape(tf.nest.flatten(batch)[0])[0]
+                token = tf.numpy_function(self._stamp_tensor, [size], tf.int64, stateful=True)
+                with tf.control_dependencies([token]):
+                    return tf.nest.map_structure(tf.identity, batch)
+            self._wrapped = True
+            return data.map(stamp).prefetch(tf.data.AUTOTUNE)
+        if isinstance(data, tf.keras.utils.Sequence):
+            self._wrapped = True
+            return _StampedSequence(data, self._stamp)
+        self._wrapped = False
+        return data
+
+    # -- callback --
+    def on_train_begin(self, logs=None):
+        # The first step of a fit() traces the train function before pulling its batch
+        self._first_step = True
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self._ready.clear()
+        self._stats = {"images": 0, "steps": 0, "step_seconds": 0.0, "wait_seconds": 0.0, "stamped_steps": 0}
+        self._epoch_start = time.perf_counter()
+        self._last_batch_end = self._epoch_start
+        if tf.config.list_physical_devices("GPU"):
+            tf.config.experimental.reset_memory_stats("GPU:0")
+
+    def on_train_batch_begin(self, batch, logs=None):
+        if self.trace_steps and self.global_step == self.trace_steps[0] and not self._tracing:
+            os.makedirs(self.trace_dir, exist_ok=True)
+            tf.profiler.experimental.start(self.trace_dir)
+            self._tracing = True
+        self._batch_start = time.perf_counter()
+
+    def on_train_batch_end(self, batch, logs=None):
+        now = time.perf_counter()
+        step_seconds = now - self._batch_start
+        stats = self._stats
+        stats["steps"] += 1
+        stats["step_seconds"] += step_seconds
+        if self._ready:
+            ready, size = self._ready.popleft()
+            stats["images"] += size
+            if not self._first_step:
+                stats["wait_seconds"] += min(max(0.0, ready - self._batch_start), step_seconds)
+            stats["stamped_steps"] += 1
+        elif self.batch_size:
+            stats["images"] += self.batch_size
+        self._last_batch_end = now
+        self._first_step = False
+        self.global_step += 1
+        if self._tracing and self.global_step >= self.trace_steps[1]:
+            self._stop_trace()
+
+    def on_epoch_end(self, epoch, logs=None):
+        stats = self._stats
+        train_seconds = self._last_batch_end - self._epoch_start
+        wait_share = None
+        if self._wrapped and stats["stamped_steps"] == stats["steps"] and train_seconds > 0:
+            wait_share = stats["wait_seconds"] / train_seconds
+        record = {
+            "phase": self.phase,
+            "epoch": epoch + 1,
+            "steps": stats["steps"],
+            "images": stats["images"] or None,
+            "train_seconds": round(train_seconds, 3),
+            "validation_seconds": round(time.perf_counter() - self._last_batch_end, 3),
+            "images_per_second": round(stats["images"] / train_seconds, 1) if stats["images"] and train_seconds else None,
+            "input_wait_seconds": round(stats["wait_seconds"], 3) if wait_share is not None else None,
+            "step_seconds": round(stats["step_seconds"] - stats["wait_seconds"], 3),
+            "input_wait_share": round(wait_share, 4) if wait_share is not None else None,
+            "input_bound": wait_share >= INPUT_BOUND_SHARE if wait_share is not None else None,
+            "peak_rss_mb": peak_rss_mb(),
+        }
+        if tf.config.list_physical_devices("GPU"):
+            record["peak_gpu_mb"] = round(tf.config.experimental.get_memory_info("GPU:0")["peak"] / 2**20, 1)
+        record.update({k: round(float(v), 4) for k, v in (logs or {}).items()})
+        self.epochs = [e for e in self.epochs if (e["phase"], e["epoch"]) != (self.phase, epoch + 1)] + [record]
+
+        wait = f"{wait_share:.0%} waiting on input" if wait_share is not None else "input wait n/a"
+        rate = f"{record['images_per_second']} img/s" if record["images_per_second"] else f"{stats['steps']} steps"
+        flag = " ⚠️ input-bound" if record["input_bound"] else ""
+        print(f"\n⏱️ {self.phase} epoch {epoch + 1}: {rate}, {wait}, peak RSS {record['peak_rss_mb']} MB{flag}")
+        self.write_report()
+
+    def on_train_end(self, logs=None):
+        self._stop_trace()
+        self.write_report()
+
+    def _stop_trace(self):
+        if self._tracing:
+            tf.profiler.experimental.stop()
+            self._tracing = False
+            print(f"🔬 Profiler trace written to {self.trace_dir} (tensorboard --logdir {self.trace_dir})")
+
+    # -- report --
+    def _load_previous(self):
+        """Epochs recorded by an earlier (interrupted) run, so a resumed run extends the report"""
+        try:
+            with open(self.report_path, "r", encoding="utf-8") as f:
+                return json.load(f).get("epochs", [])
+        except (OSError, ValueError):
+            return []
+
+    def summary(self):
+        measured = [e for e in self.epochs if e["input_wait_share"] is not None]
+        rates = [e["images_per_second"] for e in self.epochs if e["images_per_second"]]
+        wait = sum(e["input_wait_seconds"] for e in measured)
+        train = sum(e["train_seconds"] for e in measured)
+        return {
+            "epochs": len(self.epochs),
+            "mean_images_per_second": round(float(np.mean(rates)), 1) if rates else None,
+            "input_wait_share": round(wait / train, 4) if train else None,
+            "input_bound_epochs": sum(1 for e in measured if e["input_bound"]),
+            "peak_rss_mb": max((e["peak_rss_mb"] or 0 for e in self.epochs), default=None) or None,
+            "trace_dir": self.trace_dir if os.path.isdir(self.trace_dir) else None,
+        }
+
+    def write_report(self):
+        directory = os.path.dirname(self.report_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = self.report_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"summary": self.summary(), "epochs": self.epochs}, f, indent=2)
+        os.replace(tmp_path, self.report_path)
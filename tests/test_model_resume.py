@@ -0,0 +1,98 @@
+"""
+Interrupt a training run mid-epoch and resume it: every batch of the
+interrupted epoch must be trained on exactly once.
+
+    python -m pytest -q tests
+"""
+import os
+import sys
+
+import numpy as np
+import pytest
+import tensorflow as tf
+import keras
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import model as model_module  # noqa: E402
+
+SEEN = []  # sample ids fed to train steps, in order
+
+
+@keras.saving.register_keras_serializable(package="resume_test")
+class RecordIds(keras.layers.Layer):
+    """Identity layer that appends the sample ids of each training batch to SEEN"""
+
+    def call(self, x, training=None):
+        if training:
+            def record(ids):
+                SEEN.extend(int(i) for i in ids)
+                return np.int64(0)
+            token = tf.numpy_function(record, [x[:, 0]], tf.int64, stateful=True)
+            with tf.control_dependencies([token]):
+                x = tf.identity(x)
+        return x
+
+
+def tiny_model(num_classes, compact=False):
+    inputs = keras.Input(shape=(1,))
+    outputs = keras.layers.Dense(num_classes, activation="softmax")(RecordIds()(inputs))
+    model = keras.Model(inputs, outputs)
+    model.compile(optimizer="adam", loss="categorical_crossentropy")
+    return model
+
+
+class ShuffledIds(keras.utils.PyDataset):
+    """DirectoryIterator stand-in: batch i is index_array[i*bs:(i+1)*bs], reshuffled on epoch end"""
+
+    def __init__(self, n=12, batch_size=2, seed=0):
+        super().__init__()
+        self.n = n
+        self.batch_size = batch_size
+        self.num_classes = 2
+        self.rng = np.random.default_rng(seed)
+        self.on_epoch_end()
+
+    def __len__(self):
+        return self.n // self.batch_size
+
+    def __getitem__(self, index):
+        ids = self.index_array[index * self.batch_size:(index + 1) * self.batch_size]
+        return ids.reshape(-1, 1).astype("float32"), np.eye(2, dtype="float32")[ids % 2]
+
+    def on_epoch_end(self):
+        self.index_array = self.rng.permutation(self.n)
+
+
+class StopAfter(keras.callbacks.Callback):
+    """Simulates a killed run: raises after `batches` train batches"""
+
+    def __init__(self, batches):
+        super().__init__()
+        self.batches = batches
+        self.done = 0
+
+    def wrap(self, data):
+        return data
+
+    def on_train_batch_end(self, batch, logs=None):
+        self.done += 1
+        if self.done == self.batches:
+            raise KeyboardInterrupt("simulated interruption")
+
+
+def test_resume_trains_each_batch_of_the_interrupted_epoch_once(tmp_path, monkeypatch):
+    monkeypatch.setattr(model_module, "build_model", tiny_model)
+    save_path = str(tmp_path / "model.keras")
+    checkpoint_dir = str(tmp_path / "checkpoints")
+    SEEN.clear()
+
+    with pytest.raises(KeyboardInterrupt):
+        model_module.train_model(ShuffledIds(seed=0), None, epochs=1, save_path=save_path,
+                                 checkpoint_dir=checkpoint_dir, checkpoint_every=1, profiler=StopAfter(3))
+    assert len(SEEN) == 6  # 3 batches of 2
+    assert model_module.latest_checkpoint(checkpoint_dir)["step"] == 3
+
+    # A fresh process: new dataset object with a different shuffle, order restored from the checkpoint
+    model_module.train_model(ShuffledIds(seed=1), None, epochs=1, save_path=save_path,
+                             checkpoint_dir=checkpoint_dir, checkpoint_every=1)
+    assert sorted(SEEN) == list(range(12))
@@ -1,8 +1,15 @@
 # train.py
 
+import os
+import sys
+import argparse
 import keras as tf
 from keras.preprocessing.image import ImageDataGenerator
-from model import train_model
+from model import train_model, CHECKPOINT_EVERY
+
+# Shared tf.data input pipeline and training profiler live with the rest of the training code in new/
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "new"))
+from training_profiler import ThroughputProfiler, PROFILE_STEPS, parse_steps
 
 
 # -------------------------------------------------
@@ -14,6 +21,7 @@ EPOCHS = 10
 
 TRAIN_DIR = "dataset/train"
 TEST_DIR = "dataset/test"
+SHARDS_DIR = "dataset_shards"
 
 # -------------------------------------------------
 # DATASET LOADING
@@ -52,20 +60,86 @@ def load_dataset():
     return train_data, test_data
 
 
+def load_dataset_tfdata(num_shards=1, shard_index=0, train_dir=TRAIN_DIR, test_dir=TEST_DIR):
+    """Same data and augmentation as load_dataset, through the tf.data pipeline"""
+    from data_pipeline import build_dataset
+
+    print("[INFO] Loading dataset (tf.data)...")
+    train_data, train_info = build_dataset(
+        train_dir,
+        image_size=IMAGE_SIZE,
+        batch_size=BATCH_SIZE,
+        training=True,
+        rotation_range=10,
+        zoom_range=0.2,
+        horizontal_flip=True,
+        num_shards=num_shards,
+        shard_index=shard_index
+    )
+    test_data, _ = build_dataset(test_dir, image_size=IMAGE_SIZE, batch_size=BATCH_SIZE,
+                                 class_names=train_info.class_names)
+
+    print("[INFO] Dataset loaded successfully.")
+    print(f"[INFO] Classes detected: {train_info.class_indices}")
+
+    return train_data, test_data, train_info.num_classes
+
+
+def load_dataset_shards(shards_dir=SHARDS_DIR, num_shards=1, shard_index=0):
+    """Compile (incrementally) and read the memory-mapped dataset shards"""
+    from dataset_shards import compile_shards
+
+    train_shards = os.path.join(shards_dir, "train")
+    test_shards = os.path.join(shards_dir, "test")
+    compile_shards(TRAIN_DIR, train_shards, IMAGE_SIZE)
+    compile_shards(TEST_DIR, test_shards, IMAGE_SIZE)
+    return load_dataset_tfdata(num_shards, shard_index, train_shards, test_shards)
+
+
 # -------------------------------------------------
 # MAIN TRAINING SCRIPT
 # -------------------------------------------------
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pipeline", choices=["generator", "tfdata", "shards"], default="generator",
+                        help="ImageDataGenerator (default), the parallel tf.data loader, or compiled shards")
+    parser.add_argument("--shards-dir", default=SHARDS_DIR, help="shards: where the compiled dataset is kept")
+    parser.add_argument("--num-shards", type=int, default=1, help="tf.data: split the training files across workers")
+    parser.add_argument("--shard-index", type=int, default=0, help="tf.data: this worker's shard")
+    parser.add_argument("--checkpoint-every", type=int, default=CHECKPOINT_EVERY,
+                        help="Batches between checkpoints (0 = only at epoch ends)")
+    parser.add_argument("--no-resume", action="store_true", help="Ignore checkpoints of an interrupted run")
+    parser.add_argument("--profile-steps", default=PROFILE_STEPS,
+                        help="START,STOP: capture a TF profiler trace of these training steps")
+    args = parser.parse_args()
+
     print("\n================ START TRAINING ================\n")
 
-    train_data, test_data = load_dataset()
+    if args.pipeline == "shards":
+        train_data, test_data, num_classes = load_dataset_shards(args.shards_dir, args.num_shards, args.shard_index)
+    elif args.pipeline == "tfdata":
+        train_data, test_data, num_classes = load_dataset_tfdata(args.num_shards, args.shard_index)
+    else:
+        train_data, test_data = load_dataset()
+        num_classes = train_data.num_classes
+
+    # Throughput / input-stall report next to the checkpoints
+    save_path = "chest_disease_model.h5"
+    checkpoint_dir = os.path.splitext(save_path)[0] + "_checkpoints"
+    profiler = ThroughputProfiler(os.path.join(checkpoint_dir, "throughput.json"), batch_size=BATCH_SIZE,
+                                  trace_steps=parse_steps(args.profile_steps))
 
     # Train using model.py
     model, history = train_model(
         train_data=train_data,
         test_data=test_data,
         epochs=EPOCHS,
-        save_path="chest_disease_model.h5"
+        save_path=save_path,
+        num_classes=num_classes,
+        checkpoint_dir=checkpoint_dir,
+        resume=not args.no_resume,
+        checkpoint_every=args.checkpoint_every,
+        profiler=profiler
     )
 
     print("\n================ TRAINING COMPLETED ================\n")